@@ -1,69 +1,381 @@
 # 1_Criar_Base_Vetorial.py
 import os
+import json
 import time
+import argparse
+import numpy as np
 import google.generativeai as genai
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
+
+from agrofel.armazem import (
+    ArmazemChunks, existe_armazem, existe_indice_langchain, converter_indice_langchain, gravar_armazem, remover_indice_langchain,
+    carregar_config_indice, reconstruir_indice, faltam_indices_auxiliares, gravar_indices_auxiliares, remover_armazem,
+)
+from agrofel.particoes import (
+    CRITERIOS, existe_base_particionada, carregar_resumo, pasta_da_particao, particao_do_arquivo, gravar_particao,
+    gravar_resumo_particoes, remover_particao, remover_particoes,
+)
+from agrofel.ingestao import (
+    CachePaginas, calcular_hash_arquivo, extrair_pdfs_em_paralelo, agrupar_em_lotes, criar_divisor_texto,
+)
+from agrofel.historico import estimar_tokens
+from agrofel import rastreio
+from agrofel.embeddings import (
+    MODELOS_PADRAO, criar_modelo_embeddings, CacheEmbeddings, EmbeddingsComCache, CheckpointEmbeddings, EtapaEmbeddings,
+)
 
 # Carrega as variáveis de ambiente (sua chave de API) do arquivo .env
 load_dotenv()
 
-# Configura a API do Google
+# --- Configuração dos Embeddings ---
+# 'google' usa o Gemini; 'local' usa sentence-transformers na CPU e funciona sem rede
+BACKEND_EMBEDDINGS = os.getenv("AGROFEL_EMBEDDINGS_BACKEND", "google")
+MODELO_EMBEDDINGS = os.getenv("AGROFEL_EMBEDDINGS_MODELO") or MODELOS_PADRAO.get(BACKEND_EMBEDDINGS)
+# Textos por pedido ao backend, pedidos simultâneos e tentativas por lote
+TAMANHO_LOTE_API = 64
+MAX_PEDIDOS_SIMULTANEOS = 4
+MAX_TENTATIVAS_EMBEDDINGS = 6
+
+# Configura a API do Google (só é necessária para o backend 'google')
 api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("A chave GOOGLE_API_KEY não foi encontrada no arquivo .env")
-genai.configure(api_key=api_key)
+if BACKEND_EMBEDDINGS == "google":
+    if not api_key:
+        raise ValueError("A chave GOOGLE_API_KEY não foi encontrada no arquivo .env")
+    genai.configure(api_key=api_key)
 
 # --- Definição dos Caminhos Locais para Windows ---
 # Caminho base do seu projeto. Use barras normais.
 CAMINHO_BASE_PROJETO = "C:/Users/Usuario/Documents/Agrofel/"
 # Caminho completo para a pasta de documentos
 PASTA_BULAS = os.path.join(CAMINHO_BASE_PROJETO, "documentos/")
-# Caminho completo para salvar o índice vetorial
+# Caminho completo para salvar a base de conhecimento (chunks, vetores e índice FAISS)
 CAMINHO_INDEX_FAISS = os.path.join(CAMINHO_BASE_PROJETO, "faiss_index_agrofel")
+# Manifesto com o SHA-256 de cada PDF já indexado e os ids dos seus chunks
+CAMINHO_MANIFESTO = os.path.join(CAMINHO_INDEX_FAISS, "manifesto.json")
+# 2: chunks do agrofel.divisao (secções e trechos pequenos); bases da versão 1 são reconstruídas
+VERSAO_MANIFESTO = 2
+# Cache do texto extraído de cada PDF, para que novos testes de chunking não reprocessem os PDFs
+PASTA_CACHE_PAGINAS = os.path.join(CAMINHO_BASE_PROJETO, "cache_paginas")
+# Checkpoint dos embeddings já calculados, para retomar uma construção interrompida
+CAMINHO_CHECKPOINT_EMBEDDINGS = os.path.join(CAMINHO_BASE_PROJETO, "checkpoint_embeddings.sqlite")
+# Cache de embeddings por (modelo, texto), partilhado com o app.py
+CAMINHO_CACHE_EMBEDDINGS = os.path.join(CAMINHO_BASE_PROJETO, "cache_embeddings.sqlite")
+
+# --- Tipo de Índice FAISS ---
+# 'flat' (exato), 'sqfp16', 'sq8', 'ivf_flat', 'ivf_sq8', 'ivf_pq', 'hnsw' ou 'hnsw_sq8'.
+# Parâmetros opcionais: nlist, nprobe, M, ef_construction, ef_search, pq_m, pq_nbits (ver agrofel/indices.py).
+CONFIG_INDICE = {"tipo": os.getenv("AGROFEL_TIPO_INDICE", "flat")}
+
+# --- Partições ---
+# A base é dividida em partições por este critério (ver agrofel/particoes.py); o app carrega
+# cada uma só quando uma pergunta precisa dela. Vazio grava uma base única.
+CRITERIO_PARTICOES = os.getenv("AGROFEL_PARTICOES", "tipo")
+if CRITERIO_PARTICOES and CRITERIO_PARTICOES not in CRITERIOS:
+    raise ValueError(f"AGROFEL_PARTICOES deve ser um de {sorted(CRITERIOS)} ou vazio, não '{CRITERIO_PARTICOES}'.")
+
+# --- Parâmetros do pipeline de ingestão ---
+# Número de processos usados na extração dos PDFs (None = número de núcleos)
+MAX_PROCESSOS_EXTRACAO = None
+# Quantidade de chunks que a etapa de embeddings recebe de cada vez
+TAMANHO_LOTE_EMBEDDINGS = 256
+
+def agrupar_pdfs_por_hash(lista_arquivos: list) -> dict:
+    """
+    Agrupa os PDFs pelo hash do conteúdo. Arquivos byte a byte idênticos
+    (ex: '10186459_1.pdf' e '10186459_2.pdf') ficam no mesmo grupo e só o
+    primeiro nome, em ordem alfabética, é processado.
+    """
+    grupos = {}
+    for nome_arquivo in sorted(lista_arquivos):
+        sha = calcular_hash_arquivo(os.path.join(PASTA_BULAS, nome_arquivo))
+        grupos.setdefault(sha, []).append(nome_arquivo)
+    return grupos
+
+def carregar_manifesto() -> dict:
+    """ Lê o manifesto do índice. Devolve um manifesto vazio se não existir ou for de outra versão. """
+    if os.path.exists(CAMINHO_MANIFESTO):
+        with open(CAMINHO_MANIFESTO, "r", encoding="utf-8") as f:
+            manifesto = json.load(f)
+        if manifesto.get("versao") == VERSAO_MANIFESTO:
+            return manifesto
+        print("Manifesto de versão diferente encontrado; o índice será reconstruído do zero.")
+    return {"versao": VERSAO_MANIFESTO, "arquivos": {}}
+
+def salvar_manifesto(manifesto: dict):
+    """ Grava o manifesto ao lado do índice FAISS. """
+    with open(CAMINHO_MANIFESTO, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+
+def pasta_do_armazem(particao: str) -> str:
+    """ Pasta onde fica gravada a partição ('' = base única). """
+    return pasta_da_particao(CAMINHO_INDEX_FAISS, particao) if particao else CAMINHO_INDEX_FAISS
+
+def abrir_armazens_anteriores() -> dict:
+    """ Partição -> ArmazemChunks da base gravada ('' numa base única); {} se ainda não houver base. """
+    if existe_base_particionada(CAMINHO_INDEX_FAISS):
+        return {nome: ArmazemChunks(pasta_do_armazem(nome)) for nome in carregar_resumo(CAMINHO_INDEX_FAISS)["particoes"]}
+    if existe_armazem(CAMINHO_INDEX_FAISS):
+        return {"": ArmazemChunks(CAMINHO_INDEX_FAISS)}
+    return {}
+
+def primeiras_paginas(armazens: dict) -> dict:
+    """ sha256 -> texto dos chunks da primeira página de cada PDF já indexado (para o critério de partição). """
+    paginas = {}
+    for armazem in armazens.values():
+        for i in range(len(armazem)):
+            documento = armazem.documento(i)
+            sha, pagina = documento.metadata.get("sha256", ""), documento.metadata.get("page", 0)
+            if sha not in paginas or pagina < paginas[sha][0]:
+                paginas[sha] = (pagina, [])
+            if pagina == paginas[sha][0]:
+                paginas[sha][1].append(documento.page_content)
+    return {sha: "\n".join(textos) for sha, (_, textos) in paginas.items()}
+
+def chunks_mantidos(armazens: dict, shas: set) -> tuple:
+    """ Chunks, vetores e secções dos PDFs `shas` na base anterior, para regravar sem novos embeddings. """
+    ids, textos, metadatas, vetores, pais = [], [], [], [], []
+    for armazem in armazens.values():
+        manter = [i for i, sha in enumerate(armazem.sha256()) if sha in shas]
+        for i in manter:
+            documento = armazem.documento(i)
+            ids.append(documento.id)
+            textos.append(documento.page_content)
+            metadatas.append(documento.metadata)
+        if manter:
+            vetores.append(np.array(armazem.vetores[manter], dtype=np.float32))
+        pais += [pai for pai in armazem.pais() if pai.metadata.get("sha256") in shas]
+    return ids, textos, metadatas, vetores, pais
 
-def criar_base_de_conhecimento():
+def criar_base_de_conhecimento(particao: str = None):
     """
-    Processa todos os PDFs na pasta 'documentos' e cria/salva o índice FAISS.
+    Cria ou atualiza a base de conhecimento a partir dos PDFs na pasta 'documentos'.
+    Usa o manifesto para processar apenas arquivos novos ou alterados, remover os
+    vetores de arquivos apagados e ignorar duplicatas idênticas. Numa base particionada
+    só são regravadas as partições com PDFs novos, alterados ou removidos; com `particao`,
+    os PDFs dessa partição são também divididos e incorporados de novo.
     """
-    if not os.path.exists(PASTA_BULAS) or not os.listdir(PASTA_BULAS):
-        print(f"ERRO: A pasta '{PASTA_BULAS}' não existe ou está vazia.")
+    if not os.path.isdir(PASTA_BULAS):
+        print(f"ERRO: A pasta '{PASTA_BULAS}' não existe.")
         return
 
     print(f"Iniciando processamento dos PDFs em '{PASTA_BULAS}'...")
     inicio = time.time()
 
     lista_arquivos = [f for f in os.listdir(PASTA_BULAS) if f.lower().endswith('.pdf')]
-    if not lista_arquivos:
+    # Sem PDFs, só há trabalho se a base ainda tiver bulas indexadas (para as remover).
+    if not lista_arquivos and not carregar_manifesto()["arquivos"]:
         print(f"Nenhum PDF encontrado em '{PASTA_BULAS}'.")
         return
 
-    todos_documentos = []
-    for nome_arquivo in lista_arquivos:
-        caminho_completo = os.path.join(PASTA_BULAS, nome_arquivo)
-        print(f"Processando: {nome_arquivo}")
-        loader = PyPDFLoader(caminho_completo)
-        paginas = loader.load()
-        for pagina in paginas:
-            pagina.metadata['source'] = nome_arquivo
-        todos_documentos.extend(paginas)
+    pdfs_por_hash = agrupar_pdfs_por_hash(lista_arquivos)
+    duplicatas = len(lista_arquivos) - len(pdfs_por_hash)
+    if duplicatas:
+        print(f"{duplicatas} PDF(s) idêntico(s) a outro arquivo serão ignorados.")
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
-    chunks = text_splitter.split_documents(todos_documentos)
+    # Chunks com texto já visto (ex: reprocessamento de um PDF pouco alterado) saem do cache.
+    embeddings = EmbeddingsComCache(
+        criar_modelo_embeddings(BACKEND_EMBEDDINGS, MODELO_EMBEDDINGS),
+        MODELO_EMBEDDINGS,
+        CacheEmbeddings(CAMINHO_CACHE_EMBEDDINGS),
+    )
+    config_embeddings = {"backend": BACKEND_EMBEDDINGS, "modelo": MODELO_EMBEDDINGS}
 
-    print(f"\n{len(lista_arquivos)} PDFs processados, {len(chunks)} chunks de texto criados.")
-    print("Inicializando modelo de embeddings e criando índice FAISS...")
+    # Só reaproveitamos o índice existente se ele tiver um manifesto compatível
+    # e tiver sido criado com o mesmo modelo de embeddings.
+    manifesto = carregar_manifesto()
+    config_anterior = manifesto.get("embeddings", {"backend": "google", "modelo": MODELOS_PADRAO["google"]})
+    anteriores = {}
+    if manifesto["arquivos"] and config_anterior == config_embeddings:
+        if not existe_base_particionada(CAMINHO_INDEX_FAISS) and not existe_armazem(CAMINHO_INDEX_FAISS) \
+                and existe_indice_langchain(CAMINHO_INDEX_FAISS):
+            print("Convertendo o índice do formato antigo (pickle do LangChain) para o novo formato...")
+            converter_indice_langchain(CAMINHO_INDEX_FAISS)
+        anteriores = abrir_armazens_anteriores()
+    if not anteriores:
+        manifesto = {"versao": VERSAO_MANIFESTO, "arquivos": {}}
+    manifesto["embeddings"] = config_embeddings
+
+    # Base gravada sem partições ou com outro critério: os chunks mudam de partição com os vetores que já têm.
+    mudou_particoes = bool(anteriores) and manifesto.get("particoes", "") != CRITERIO_PARTICOES
+    if mudou_particoes:
+        print(f"Critério de partição alterado ('{manifesto.get('particoes', '')}' -> '{CRITERIO_PARTICOES}'); "
+              "a base será regravada sem novos embeddings.")
+        primeiras = primeiras_paginas(anteriores)
+        for sha, entrada in manifesto["arquivos"].items():
+            entrada["particao"] = particao_do_arquivo(CRITERIO_PARTICOES, entrada["arquivo"], primeiras.get(sha, ""))
+    manifesto["particoes"] = CRITERIO_PARTICOES
+
+    novos = [sha for sha in pdfs_por_hash if sha not in manifesto["arquivos"]]
+    removidos = [sha for sha in manifesto["arquivos"] if sha not in pdfs_por_hash]
+    # Os PDFs da partição pedida são divididos e incorporados de novo (o texto e os vetores
+    # de trechos que não mudaram saem dos caches); as outras partições não são tocadas.
+    refeitos = []
+    if particao is not None:
+        refeitos = [sha for sha, entrada in manifesto["arquivos"].items()
+                    if entrada.get("particao") == particao and sha in pdfs_por_hash]
+        if not CRITERIO_PARTICOES or not refeitos:
+            print(f"ERRO: a base em '{CAMINHO_INDEX_FAISS}' não tem a partição '{particao}'.")
+            return
+        print(f"A refazer a partição '{particao}' ({len(refeitos)} PDFs).")
+        novos += refeitos
+
+    # Os nomes das duplicatas podem mudar mesmo sem alteração de conteúdo.
+    for sha, entrada in manifesto["arquivos"].items():
+        if sha in pdfs_por_hash:
+            entrada["arquivo"], *entrada["duplicatas"] = pdfs_por_hash[sha]
+
+    if not novos and not removidos and not mudou_particoes:
+        salvar_manifesto(manifesto)
+        if "" in anteriores and faltam_indices_auxiliares(CAMINHO_INDEX_FAISS):
+            # Bases criadas antes dos índices BM25 e de produtos: saem dos chunks já gravados.
+            anterior = anteriores[""]
+            documentos = [anterior.documento(i) for i in range(len(anterior))]
+            linhas_doses = gravar_indices_auxiliares(
+                CAMINHO_INDEX_FAISS, [d.page_content for d in documentos], [d.metadata for d in documentos],
+                anterior.pais() or None,
+            )
+            print(f"Índices auxiliares (BM25, produtos e {linhas_doses} linhas de dose) criados para a base existente.")
+        desatualizados = [nome for nome in anteriores if carregar_config_indice(pasta_do_armazem(nome)) != CONFIG_INDICE]
+        if desatualizados:
+            # Só o tipo de índice mudou: reconstrói-se a partir dos vetores gravados, sem novos embeddings.
+            for nome in desatualizados:
+                anteriores[nome].fechar()
+                reconstruir_indice(pasta_do_armazem(nome), CONFIG_INDICE)
+            print(f"\nÍndice reconstruído com a configuração {CONFIG_INDICE}"
+                  + (f" nas partições {', '.join(desatualizados)}." if CRITERIO_PARTICOES else "."))
+            return
+        print("\nNenhum PDF novo, alterado ou removido. O índice já está atualizado.")
+        return
+
+    # Partições a regravar: as dos PDFs removidos ou refeitos e, depois da extração, as dos novos.
+    sujas = {manifesto["arquivos"][sha].get("particao", "") for sha in removidos + refeitos}
+    for sha in removidos:
+        print(f"Removido do índice: {manifesto['arquivos'].pop(sha)['arquivo']}")
+
+    # Chunks novos; os dos PDFs que continuam na pasta são mantidos com os vetores já calculados.
+    ids, textos, metadatas, vetores, pais = [], [], [], [], []
+    divisor = criar_divisor_texto()
+    total_chunks = 0
+
+    def gerar_chunks():
+        """ Divide cada PDF assim que a sua extração termina e regista os ids e a partição no manifesto. """
+        arquivos = [(sha, pdfs_por_hash[sha][0]) for sha in novos]
+        cache = CachePaginas(PASTA_CACHE_PAGINAS)
+        for sha, nome_arquivo, paginas in extrair_pdfs_em_paralelo(arquivos, PASTA_BULAS, cache, MAX_PROCESSOS_EXTRACAO):
+            print(f"Processando: {nome_arquivo}")
+            with rastreio.etapa("ingestao_divisao", paginas=len(paginas)) as etapa:
+                pais_arquivo, chunks_arquivo = divisor.dividir(paginas)
+                etapa.atualizar(chunks=len(chunks_arquivo), pais=len(pais_arquivo))
+            pais.extend(pais_arquivo)
+            ids_arquivo = [chunk.id for chunk in chunks_arquivo]
+            manifesto["arquivos"][sha] = {
+                "arquivo": nome_arquivo, "duplicatas": pdfs_por_hash[sha][1:], "ids": ids_arquivo,
+                "particao": particao_do_arquivo(CRITERIO_PARTICOES, nome_arquivo, paginas[0].page_content if paginas else ""),
+            }
+            yield from zip(chunks_arquivo, ids_arquivo)
+
+    checkpoint = CheckpointEmbeddings(CAMINHO_CHECKPOINT_EMBEDDINGS, MODELO_EMBEDDINGS)
+    etapa_embeddings = EtapaEmbeddings(
+        embeddings,
+        tamanho_lote=TAMANHO_LOTE_API,
+        max_concorrencia=MAX_PEDIDOS_SIMULTANEOS,
+        max_tentativas=MAX_TENTATIVAS_EMBEDDINGS,
+        checkpoint=checkpoint,
+    )
+
+    # Os chunks seguem em lotes para a etapa de embeddings, sem acumular o acervo inteiro em memória.
+    print(f"Gerando embeddings ({BACKEND_EMBEDDINGS}: {MODELO_EMBEDDINGS}) e atualizando o índice FAISS...")
+    for lote in agrupar_em_lotes(gerar_chunks(), TAMANHO_LOTE_EMBEDDINGS):
+        chunks, ids_lote = map(list, zip(*lote))
+        textos_lote = [chunk.page_content for chunk in chunks]
+        with rastreio.etapa("ingestao_embeddings", textos=len(textos_lote),
+                            tokens=sum(estimar_tokens(t) for t in textos_lote)):
+            vetores.append(np.asarray(etapa_embeddings.incorporar(textos_lote, ids_lote), dtype=np.float32))
+        ids.extend(ids_lote)
+        textos.extend(textos_lote)
+        metadatas.extend(chunk.metadata for chunk in chunks)
+        total_chunks += len(chunks)
+
+    print(f"\n{len(novos)} PDFs novos, alterados ou refeitos, {len(removidos)} removidos, {total_chunks} chunks de texto "
+          f"criados ({len(pais)} secções).")
+    rastreio.anotar(pdfs_novos=len(novos), pdfs_removidos=len(removidos), chunks=total_chunks)
+    print(etapa_embeddings.resumo())
+    print(f"Cache de embeddings: {embeddings.estatisticas()}")
+
+    # Cada partição suja é regravada com os seus chunks mantidos seguidos dos novos; com outro
+    # critério, todas. As restantes ficam como estão em disco.
+    particao_do_sha = {sha: entrada.get("particao", "") for sha, entrada in manifesto["arquivos"].items()}
+    grupos = set(particao_do_sha.values())
+    sujas |= {particao_do_sha[sha] for sha in novos} | (grupos | set(anteriores) if mudou_particoes else set())
+    vetores_novos = np.vstack(vetores) if vetores else None
+    gravacoes = {}
+    for nome in sorted(sujas & grupos):
+        manter = {sha for sha, p in particao_do_sha.items() if p == nome} - set(novos)
+        ids_p, textos_p, metadatas_p, vetores_p, pais_p = chunks_mantidos(anteriores, manter)
+        posicoes = [i for i, metadata in enumerate(metadatas) if particao_do_sha[metadata["sha256"]] == nome]
+        ids_p += [ids[i] for i in posicoes]
+        textos_p += [textos[i] for i in posicoes]
+        metadatas_p += [metadatas[i] for i in posicoes]
+        if posicoes:
+            vetores_p.append(vetores_novos[posicoes])
+        pais_p += [pai for pai in pais if particao_do_sha[pai.metadata["sha256"]] == nome]
+        gravacoes[nome] = (ids_p, textos_p, metadatas_p, vetores_p, pais_p)
+    # Liberta o mmap antes de substituir os arquivos (necessário no Windows).
+    for armazem in anteriores.values():
+        armazem.fechar()
+
+    if not any(dados[0] for dados in gravacoes.values()) and not grupos - sujas:
+        if anteriores:
+            # Todas as bulas indexadas foram removidas (ou as que restam não têm texto): a base
+            # anterior é apagada, para não continuar a responder com elas.
+            remover_particoes(CAMINHO_INDEX_FAISS)
+            remover_armazem(CAMINHO_INDEX_FAISS)
+            remover_indice_langchain(CAMINHO_INDEX_FAISS)
+            salvar_manifesto(manifesto)
+            print("AVISO: nenhum chunk para indexar; a base de conhecimento anterior foi apagada.")
+        else:
+            print("AVISO: nenhum chunk para indexar; a base de conhecimento não foi alterada.")
+        checkpoint.fechar()
+        return
 
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    db_vetorial = FAISS.from_documents(chunks, embeddings)
-    db_vetorial.save_local(CAMINHO_INDEX_FAISS)
+    with rastreio.etapa("ingestao_gravacao", chunks=sum(len(dados[0]) for dados in gravacoes.values()),
+                        particoes=len(gravacoes)) as etapa:
+        if not CRITERIO_PARTICOES:
+            ids_p, textos_p, metadatas_p, vetores_p, pais_p = gravacoes[""]
+            linhas_doses = gravar_armazem(CAMINHO_INDEX_FAISS, ids_p, textos_p, metadatas_p, np.vstack(vetores_p),
+                                          CONFIG_INDICE, pais_p)
+            remover_particoes(CAMINHO_INDEX_FAISS)
+        else:
+            for nome, (ids_p, textos_p, metadatas_p, vetores_p, pais_p) in gravacoes.items():
+                if not ids_p:
+                    # PDFs sem texto aproveitável: a partição fica de fora até ter chunks.
+                    remover_particao(CAMINHO_INDEX_FAISS, nome)
+                    continue
+                gravar_particao(CAMINHO_INDEX_FAISS, nome, ids_p, textos_p, metadatas_p, np.vstack(vetores_p),
+                                CONFIG_INDICE, pais_p)
+                print(f"Partição '{nome}': {len(ids_p)} chunks gravados.")
+            for nome in set(anteriores) - grupos - {""}:
+                remover_particao(CAMINHO_INDEX_FAISS, nome)
+                print(f"Partição '{nome}' removida (sem PDFs).")
+            if "" in anteriores:
+                remover_armazem(CAMINHO_INDEX_FAISS)
+            linhas_doses = gravar_resumo_particoes(CAMINHO_INDEX_FAISS, CRITERIO_PARTICOES)
+        etapa["linhas_doses"] = linhas_doses
+    print(f"Tabela de doses: {linhas_doses} linhas (produto × cultura × alvo) extraídas das bulas.")
+    remover_indice_langchain(CAMINHO_INDEX_FAISS)
+    salvar_manifesto(manifesto)
+    checkpoint.limpar()
+    checkpoint.fechar()
 
     fim = time.time()
-    print(f"\nSUCESSO! Base de conhecimento criada em '{CAMINHO_INDEX_FAISS}'.")
+    print(f"\nSUCESSO! Base de conhecimento atualizada em '{CAMINHO_INDEX_FAISS}'.")
     print(f"Tempo de execução: {round(fim - inicio, 2)}s.")
 
 if __name__ == "__main__":
-    criar_base_de_conhecimento()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Cria ou atualiza a base de conhecimento a partir dos PDFs das bulas.")
+    parser.add_argument("--particao", default=None,
+                        help="Divide e incorpora de novo só os PDFs desta partição (ex.: certificados)")
+    args = parser.parse_args()
+    # Uma linha JSON por etapa em AGROFEL_RASTREIO_ARQUIVO, todas com o id desta execução.
+    with rastreio.turno("ingestao"):
+        criar_base_de_conhecimento(args.particao)
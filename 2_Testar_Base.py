@@ -2,8 +2,10 @@
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_community.vectorstores import FAISS
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from agrofel.embeddings import config_embeddings_do_indice, criar_modelo_embeddings
+from agrofel.particoes import abrir_base, existe_base
 
 # --- CONFIGURAÇÃO INICIAL ---
 load_dotenv()
@@ -25,13 +27,14 @@ def diagnosticar_busca(query: str):
     print("="*50)
 
     # --- Carregando a Base e o Modelo ---
-    if not os.path.exists(CAMINHO_INDEX_FAISS):
+    if not existe_base(CAMINHO_INDEX_FAISS):
         print(f"ERRO: Índice FAISS não encontrado em '{CAMINHO_INDEX_FAISS}'")
         return
 
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        db = FAISS.load_local(CAMINHO_INDEX_FAISS, embeddings, allow_dangerous_deserialization=True)
+        config_embeddings = config_embeddings_do_indice(CAMINHO_INDEX_FAISS)
+        embeddings = criar_modelo_embeddings(config_embeddings["backend"], config_embeddings["modelo"])
+        db = abrir_base(CAMINHO_INDEX_FAISS, embeddings)
         llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.5)
         print("Base de conhecimento e LLM carregados com sucesso.\n")
     except Exception as e:
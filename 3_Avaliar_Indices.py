@@ -0,0 +1,84 @@
+# 3_Avaliar_Indices.py
+import os
+import time
+
+import numpy as np
+
+from agrofel.armazem import ARQUIVO_VETORES
+from agrofel.indices import construir_indice, tamanho_indice_bytes
+from agrofel.particoes import pastas_dos_armazens
+
+# Caminho para a base de conhecimento criada pelo 1_Criar_Base_Vetorial.py
+CAMINHO_INDEX_FAISS = "C:/Users/Usuario/Documents/Agrofel/faiss_index_agrofel"
+
+# Configurações a comparar com o índice exato (flat)
+CONFIGS_CANDIDATAS = [
+    {"tipo": "sqfp16"},
+    {"tipo": "sq8"},
+    {"tipo": "ivf_flat", "nprobe": 8},
+    {"tipo": "ivf_flat", "nprobe": 32},
+    {"tipo": "ivf_sq8", "nprobe": 16},
+    {"tipo": "ivf_pq", "nprobe": 16},
+    {"tipo": "hnsw", "ef_search": 32},
+    {"tipo": "hnsw", "ef_search": 128},
+    {"tipo": "hnsw_sq8", "ef_search": 64},
+]
+K = 5
+NUM_CONSULTAS = 200
+# Ruído somado aos vetores amostrados, para que as consultas não sejam cópias exatas dos chunks
+RUIDO_CONSULTAS = 0.01
+
+def medir_indice(indice, consultas: np.ndarray, k: int):
+    """ Executa uma busca por consulta (como no app) e devolve os resultados e as latências em ms. """
+    resultados, latencias = [], []
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        _, posicoes = indice.search(consulta[None, :], k)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        resultados.append(posicoes[0])
+    return np.array(resultados), np.array(latencias)
+
+def recall_at_k(resultados: np.ndarray, referencia: np.ndarray) -> float:
+    acertos = [len(set(r) & set(ref)) / len(ref) for r, ref in zip(resultados, referencia)]
+    return float(np.mean(acertos))
+
+def avaliar_indices():
+    """
+    Compara cada configuração candidata com o índice exato: recall@k, latência
+    por consulta (média e p95), tamanho do índice e tempo de construção.
+    """
+    # Numa base particionada, os vetores de todas as partições, como se fossem uma base única.
+    caminhos_vetores = [os.path.join(p, ARQUIVO_VETORES) for p in pastas_dos_armazens(CAMINHO_INDEX_FAISS)]
+    if not caminhos_vetores or not all(os.path.exists(c) for c in caminhos_vetores):
+        print(f"ERRO: vetores não encontrados em '{CAMINHO_INDEX_FAISS}'. Execute o '1_Criar_Base_Vetorial.py' primeiro.")
+        return
+
+    vetores = np.concatenate([np.load(c) for c in caminhos_vetores])
+    gerador = np.random.default_rng(42)
+    amostra = gerador.choice(len(vetores), size=min(NUM_CONSULTAS, len(vetores)), replace=False)
+    consultas = vetores[amostra] + gerador.normal(0, RUIDO_CONSULTAS, (len(amostra), vetores.shape[1])).astype(np.float32)
+
+    print("=" * 90)
+    print(f"AVALIAÇÃO DE ÍNDICES: {len(vetores)} vetores de dimensão {vetores.shape[1]}, {len(consultas)} consultas, k={K}")
+    print("=" * 90)
+
+    referencia_indice = construir_indice(vetores, {"tipo": "flat"})
+    referencia, latencias_flat = medir_indice(referencia_indice, consultas, K)
+    print(f"{'Configuração':<45}{'recall@k':>9}{'média ms':>10}{'p95 ms':>9}{'tamanho MB':>12}{'build s':>9}")
+    print(f"{'flat (referência)':<45}{1.0:>9.3f}{latencias_flat.mean():>10.3f}{np.percentile(latencias_flat, 95):>9.3f}"
+          f"{tamanho_indice_bytes(referencia_indice) / 2**20:>12.2f}{0.0:>9.2f}")
+
+    for config in CONFIGS_CANDIDATAS:
+        inicio = time.time()
+        try:
+            indice = construir_indice(vetores, config)
+        except Exception as e:
+            print(f"{str(config):<45} ERRO: {e}")
+            continue
+        tempo_construcao = time.time() - inicio
+        resultados, latencias = medir_indice(indice, consultas, K)
+        print(f"{str(config):<45}{recall_at_k(resultados, referencia):>9.3f}{latencias.mean():>10.3f}"
+              f"{np.percentile(latencias, 95):>9.3f}{tamanho_indice_bytes(indice) / 2**20:>12.2f}{tempo_construcao:>9.2f}")
+
+if __name__ == "__main__":
+    avaliar_indices()
@@ -0,0 +1,135 @@
+# 4_Avaliar_Reranker.py
+import os
+import time
+import difflib
+
+import numpy as np
+import google.generativeai as genai
+from dotenv import load_dotenv
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from agrofel.embeddings import config_embeddings_do_indice, criar_modelo_embeddings
+from agrofel.particoes import abrir_base, existe_base
+from agrofel.reranker import ReordenadorCrossEncoder, MODELO_RERANKER_PADRAO
+
+# --- CONFIGURAÇÃO INICIAL ---
+load_dotenv()
+api_key = os.getenv("GOOGLE_API_KEY")
+if not api_key:
+    raise ValueError("Chave de API do Google não encontrada! Verifique seu arquivo .env")
+genai.configure(api_key=api_key)
+
+# Caminho para o índice FAISS
+CAMINHO_INDEX_FAISS = "C:/Users/Usuario/Documents/Agrofel/faiss_index_agrofel"
+
+# Mesmos parâmetros do agente_especialista_recomenda (app_copia_original.py)
+K_CANDIDATOS = 10
+K_SELECIONADOS = 3
+
+# Conjunto fixo de perguntas, para que as execuções sejam comparáveis entre si
+PERGUNTAS = [
+    "Qual produto usar para Capim-amargoso na cultura da soja?",
+    "o que passar na buva antes do plantio da soja",
+    "guanxuma no milho, qual herbicida?",
+    "qual a dose do Glyphotal TR por hectare?",
+    "como controlar corda-de-viola no algodão",
+    "herbicida pré-emergente para milho",
+    "qual o intervalo de reentrada depois da aplicação?",
+    "posso misturar 2,4-D com glifosato no tanque?",
+    "dessecação em pré-plantio do trigo",
+    "controle de caruru na soja em pós-emergência",
+    "qual a vazão de calda recomendada para aplicação terrestre?",
+    "trapoeraba no café, o que aplicar?",
+]
+
+PROMPT_FILTRAGEM = """
+    Analise a PERGUNTA do usuário e os seguintes CHUNKS de texto extraídos de bulas de produtos.
+    Sua tarefa é identificar e retornar APENAS o conteúdo dos 3 chunks que são MAIS RELEVANTES e ÚTEIS para responder à pergunta.
+    Não adicione nenhuma palavra sua, apenas retorne o texto exato dos chunks selecionados, separados por '---'.
+
+    PERGUNTA: "{query}"
+
+    CHUNKS:
+    {contexto_bruto}
+    """
+
+def filtrar_com_llm(llm, query: str, docs: list):
+    """
+    Filtro original com o gemini-1.5-flash. O LLM devolve texto, não índices: cada trecho
+    devolvido é associado ao chunk mais parecido. Devolve (indices, trechos_alterados).
+    """
+    contexto_bruto = "\n\n---\n\n".join([f"Chunk {i+1}:\n{doc.page_content}" for i, doc in enumerate(docs)])
+    resposta = llm.invoke(PROMPT_FILTRAGEM.format(query=query, contexto_bruto=contexto_bruto)).content
+    indices, alterados = [], 0
+    for trecho in (t.strip() for t in resposta.split("---")):
+        if not trecho:
+            continue
+        if not any(trecho in doc.page_content or doc.page_content.strip() in trecho for doc in docs):
+            alterados += 1
+        semelhancas = [difflib.SequenceMatcher(None, trecho[:500], doc.page_content[:500]).ratio() for doc in docs]
+        melhor = int(np.argmax(semelhancas))
+        if melhor not in indices:
+            indices.append(melhor)
+    return indices[:K_SELECIONADOS], alterados
+
+def avaliar_reranker():
+    """
+    Para cada pergunta, recupera K_CANDIDATOS chunks (como o app original) e compara a
+    escolha dos K_SELECIONADOS melhores feita pelo LLM e pelo cross-encoder: latência
+    (média e p95), concordância (sobreposição dos conjuntos e do 1.º lugar) e quantas
+    vezes o LLM devolveu texto que não existe em nenhum chunk.
+    """
+    if not existe_base(CAMINHO_INDEX_FAISS):
+        print(f"ERRO: Índice FAISS não encontrado em '{CAMINHO_INDEX_FAISS}'")
+        return
+
+    config_embeddings = config_embeddings_do_indice(CAMINHO_INDEX_FAISS)
+    embeddings = criar_modelo_embeddings(config_embeddings["backend"], config_embeddings["modelo"])
+    db = abrir_base(CAMINHO_INDEX_FAISS, embeddings)
+    llm_filtro = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.0)
+    reordenador = ReordenadorCrossEncoder()
+    # Aquece o modelo para a primeira pergunta não pagar o carregamento
+    reordenador.pontuar("aquecimento", db.similarity_search("aquecimento", k=1))
+
+    print("=" * 90)
+    print(f"RERANKER ({MODELO_RERANKER_PADRAO}) vs FILTRO LLM (gemini-1.5-flash): "
+          f"{len(PERGUNTAS)} perguntas, {K_CANDIDATOS} candidatos -> {K_SELECIONADOS}")
+    print("=" * 90)
+    print(f"{'Pergunta':<55}{'LLM ms':>9}{'CE ms':>8}{'sobrep.':>9}{'top-1':>7}")
+
+    latencias_llm, latencias_ce, sobreposicoes, mesmos_top1, total_alterados = [], [], [], [], 0
+    for pergunta in PERGUNTAS:
+        docs = db.similarity_search(pergunta, k=K_CANDIDATOS)
+        if not docs:
+            print(f"{pergunta[:53]:<55} sem resultados")
+            continue
+
+        inicio = time.perf_counter()
+        try:
+            escolha_llm, alterados = filtrar_com_llm(llm_filtro, pergunta, docs)
+        except Exception as e:
+            print(f"{pergunta[:53]:<55} ERRO no LLM: {e}")
+            continue
+        latencias_llm.append((time.perf_counter() - inicio) * 1000)
+        total_alterados += alterados
+
+        inicio = time.perf_counter()
+        pontuacoes = reordenador.pontuar(pergunta, docs)
+        latencias_ce.append((time.perf_counter() - inicio) * 1000)
+        escolha_ce = np.argsort(-pontuacoes)[:K_SELECIONADOS].tolist()
+
+        sobreposicoes.append(len(set(escolha_llm) & set(escolha_ce)) / K_SELECIONADOS)
+        mesmos_top1.append(bool(escolha_llm) and escolha_llm[0] == escolha_ce[0])
+        print(f"{pergunta[:53]:<55}{latencias_llm[-1]:>9.0f}{latencias_ce[-1]:>8.0f}"
+              f"{sobreposicoes[-1]:>9.2f}{'sim' if mesmos_top1[-1] else 'não':>7}")
+
+    if not sobreposicoes:
+        return
+    print("-" * 90)
+    print(f"Latência LLM:  média {np.mean(latencias_llm):.0f} ms | p95 {np.percentile(latencias_llm, 95):.0f} ms")
+    print(f"Latência CE:   média {np.mean(latencias_ce):.0f} ms | p95 {np.percentile(latencias_ce, 95):.0f} ms")
+    print(f"Concordância:  sobreposição@{K_SELECIONADOS} {np.mean(sobreposicoes):.2f} | mesmo 1.º lugar {np.mean(mesmos_top1):.2f}")
+    print(f"Trechos devolvidos pelo LLM que não existem em nenhum chunk: {total_alterados}")
+
+if __name__ == "__main__":
+    avaliar_reranker()
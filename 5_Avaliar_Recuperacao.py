@@ -0,0 +1,280 @@
+# 5_Avaliar_Recuperacao.py
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from agrofel.armazem import BaseConhecimento, gravar_armazem
+from agrofel.avaliacao import (
+    LLMDeterministico, paginas_dos_docs, paginas_relevantes, recall_em_k, precisao_limitada_em_k, reciprocal_rank, percentis,
+)
+from agrofel.contexto import montar_contexto
+from agrofel.embeddings import MODELOS_PADRAO, criar_modelo_embeddings, CacheEmbeddings, EmbeddingsComCache
+from agrofel.indices import CONFIG_INDICE_PADRAO
+from agrofel.ingestao import CachePaginas, calcular_hash_arquivo, extrair_pdfs_em_paralelo, criar_divisor_texto
+from agrofel.particoes import CRITERIOS, BaseParticionada, gravar_particao, gravar_resumo_particoes, particao_do_arquivo
+from agrofel.reranker import criar_reordenador_do_ambiente
+
+# Mesmas etapas do 2_Testar_Base.py (busca, contexto e geração), mas para um conjunto fixo
+# de perguntas com as páginas esperadas, medidas e comparadas com uma linha de base gravada.
+PASTA_PROJETO = os.path.dirname(os.path.abspath(__file__))
+PASTA_BULAS = os.path.join(PASTA_PROJETO, "documentos")
+CAMINHO_CONJUNTO = os.path.join(PASTA_PROJETO, "avaliacao", "conjunto_referencia.json")
+CAMINHO_LINHA_BASE = os.path.join(PASTA_PROJETO, "avaliacao", "linha_base.json")
+
+# Candidatos avaliados por pergunta e cortes do recall
+K_CANDIDATOS = 10
+KS_RECALL = (1, 3, 5, 10)
+# Chunks que seguem para o contexto, como no app.py (4 com produto, 5 sem)
+K_CONTEXTO_PRODUTO = 4
+K_CONTEXTO = 5
+ETAPAS = ("embedding", "busca", "rerank", "geracao")
+# Diferença tolerada face à linha de base. A qualidade é determinística com os substitutos
+# locais; a latência varia com a máquina, por isso só falha a avaliação com --estrito.
+TOLERANCIA_QUALIDADE = 0.005
+TOLERANCIA_LATENCIA = 0.5
+
+PROMPT_GERACAO = """
+Você é um consultor especialista da Agrofel. Responda à pergunta do cliente com base **exclusivamente** nos trechos das bulas.
+
+PERGUNTA DO CLIENTE: "{pergunta}"
+
+TRECHOS RELEVANTES DAS BULAS:
+---
+{contexto}
+---
+"""
+
+def criar_modelos(modelos: str):
+    """ 'deterministicos' corre sem rede; 'reais' usa o backend de embeddings do ambiente e o Gemini. """
+    if modelos == "deterministicos":
+        return "deterministico", MODELOS_PADRAO["deterministico"], LLMDeterministico()
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    load_dotenv()
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    backend = os.getenv("AGROFEL_EMBEDDINGS_BACKEND", "google")
+    modelo = os.getenv("AGROFEL_EMBEDDINGS_MODELO") or MODELOS_PADRAO[backend]
+    return backend, modelo, ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.0)
+
+def construir_base(pasta_bulas: str, pasta: str, modelo_embeddings, pasta_cache_paginas: str = None,
+                   criterio_particoes: str = "") -> dict:
+    """
+    Cria a base de conhecimento numa pasta temporária com o divisor de texto atual, tal
+    como o 1_Criar_Base_Vetorial.py (PDFs idênticos só uma vez), única ou dividida em
+    partições pelo `criterio_particoes`. Devolve números da base.
+    """
+    inicio = time.perf_counter()
+    pdfs_por_hash = {}
+    for nome_arquivo in sorted(f for f in os.listdir(pasta_bulas) if f.lower().endswith(".pdf")):
+        pdfs_por_hash.setdefault(calcular_hash_arquivo(os.path.join(pasta_bulas, nome_arquivo)), nome_arquivo)
+
+    divisor = criar_divisor_texto()
+    cache_paginas = CachePaginas(pasta_cache_paginas or os.path.join(pasta, "cache_paginas"))
+    chunks, pais, particao_do_sha = [], [], {}
+    for sha, nome_arquivo, paginas in extrair_pdfs_em_paralelo(list(pdfs_por_hash.items()), pasta_bulas, cache_paginas):
+        particao_do_sha[sha] = particao_do_arquivo(criterio_particoes, nome_arquivo, paginas[0].page_content if paginas else "")
+        pais_arquivo, chunks_arquivo = divisor.dividir(paginas)
+        pais += pais_arquivo
+        chunks += chunks_arquivo
+    # Ordem estável, independente da ordem em que os processos terminam a extração.
+    def ordem(doc):
+        sha, n = doc.id.rsplit("-", 1)
+        return sha, int(n)
+
+    chunks, pais = sorted(chunks, key=ordem), sorted(pais, key=ordem)
+    textos = [c.page_content for c in chunks]
+    vetores = np.asarray(modelo_embeddings.embed_documents(textos), dtype=np.float32)
+    pasta_base = os.path.join(pasta, "base")
+    if criterio_particoes:
+        for nome in sorted(set(particao_do_sha.values())):
+            posicoes = [i for i, c in enumerate(chunks) if particao_do_sha[c.metadata["sha256"]] == nome]
+            gravar_particao(pasta_base, nome, [chunks[i].id for i in posicoes], [textos[i] for i in posicoes],
+                            [chunks[i].metadata for i in posicoes], vetores[posicoes], CONFIG_INDICE_PADRAO,
+                            [p for p in pais if particao_do_sha[p.metadata["sha256"]] == nome])
+        linhas_doses = gravar_resumo_particoes(pasta_base, criterio_particoes)
+    else:
+        linhas_doses = gravar_armazem(pasta_base, [c.id for c in chunks], textos, [c.metadata for c in chunks], vetores,
+                                      CONFIG_INDICE_PADRAO, pais)
+    return {
+        "pdfs": len(pdfs_por_hash),
+        "chunks": len(textos),
+        "pais": len(pais),
+        "particoes": len(set(particao_do_sha.values())) if criterio_particoes else 0,
+        "linhas_doses": linhas_doses,
+        "caracteres_por_chunk": round(float(np.mean([len(t) for t in textos])), 1),
+        "tamanho_mb": round(sum(os.path.getsize(os.path.join(raiz, a)) for raiz, _, arquivos in os.walk(pasta_base)
+                                for a in arquivos) / 2**20, 2),
+        "tempo_construcao_s": round(time.perf_counter() - inicio, 2),
+    }
+
+def avaliar_pergunta(pergunta: dict, db, modelo_embeddings, llm, reordenador, repeticoes: int, latencias: dict) -> dict:
+    """ Mede cada etapa `repeticoes` vezes; a qualidade vem da ordem final (após o rerank). """
+    query, produto = pergunta["pergunta"], pergunta.get("produto")
+    # O vetor da pergunta fica no cache em memória, como no app: a busca não volta a medir o embedding.
+    db.embeddings.embed_query(query)
+    cadeia = ChatPromptTemplate.from_template(PROMPT_GERACAO) | llm | StrOutputParser()
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        modelo_embeddings.embed_query(query)
+        latencias["embedding"].append((time.perf_counter() - inicio) * 1000)
+
+        inicio = time.perf_counter()
+        if produto:
+            docs = db.busca_por_produto(query, produto, k=K_CANDIDATOS)
+        else:
+            docs = db.busca_hibrida(query, k=K_CANDIDATOS)
+        latencias["busca"].append((time.perf_counter() - inicio) * 1000)
+
+        if reordenador is not None:
+            inicio = time.perf_counter()
+            docs = reordenador.reordenar(query, docs)
+            latencias["rerank"].append((time.perf_counter() - inicio) * 1000)
+
+        # Como no app: os chunks que seguem para o contexto trocam-se pela secção quando ela interessa.
+        inicio = time.perf_counter()
+        contexto = montar_contexto(db.expandir_pais(docs[:K_CONTEXTO_PRODUTO if produto else K_CONTEXTO]))
+        resposta = "".join(cadeia.stream({"contexto": contexto.texto, "pergunta": query}))
+        latencias["geracao"].append((time.perf_counter() - inicio) * 1000)
+
+    # Chunks da mesma secção contam uma vez, como a secção que os substitui.
+    recuperadas = paginas_dos_docs(db.expandir_pais(docs))
+    relevantes = paginas_relevantes(pergunta)
+    resultado = {f"recall@{k}": recall_em_k(recuperadas, relevantes, k) for k in KS_RECALL}
+    resultado.update({f"precisao_limitada@{k}": precisao_limitada_em_k(recuperadas, relevantes, k) for k in KS_RECALL})
+    resultado["mrr"] = reciprocal_rank(recuperadas, relevantes)
+    resultado["tokens_contexto"] = contexto.tokens_finais
+    resultado["tamanho_resposta"] = len(resposta)
+    return resultado
+
+def comparar_com_linha_base(resultado: dict, linha_base: dict, estrito: bool) -> list:
+    """ Devolve as regressões encontradas; as de latência só contam com `estrito`. """
+    if linha_base.get("versao_conjunto") != resultado["versao_conjunto"] or linha_base.get("modelos") != resultado["modelos"]:
+        print("\nLinha de base gravada com outro conjunto de referência ou outros modelos: comparação ignorada.")
+        return []
+    print("\nCOMPARAÇÃO COM A LINHA DE BASE")
+    # Tamanho da base e do contexto: só informativos, mudam de propósito com o divisor.
+    for chave, nome in (("chunks", "chunks"), ("tamanho_mb", "base (MB)")):
+        if chave in linha_base.get("base", {}):
+            print(f"  {nome:<22}{linha_base['base'][chave]:>8} -> {resultado['base'][chave]:>6}")
+    if "tokens_contexto_medio" in linha_base:
+        print(f"  {'tokens contexto':<22}{linha_base['tokens_contexto_medio']:>8} -> {resultado['tokens_contexto_medio']:>6}")
+    regressoes = []
+    for metrica, valor in resultado["metricas"].items():
+        anterior = linha_base["metricas"].get(metrica)
+        if anterior is None:
+            continue
+        estado = "REGRESSÃO" if valor < anterior - TOLERANCIA_QUALIDADE else "ok"
+        print(f"  {metrica:<22}{anterior:>8.3f} -> {valor:>6.3f}  {estado}")
+        if estado != "ok":
+            regressoes.append(metrica)
+    for etapa, valores in resultado["latencias_ms"].items():
+        anterior = linha_base["latencias_ms"].get(etapa, {}).get("p95")
+        if anterior is None or valores["p95"] is None:
+            continue
+        estado = "mais lenta" if valores["p95"] > anterior * (1 + TOLERANCIA_LATENCIA) else "ok"
+        print(f"  {'p95 ' + etapa:<22}{anterior:>8.2f} -> {valores['p95']:>6.2f} ms  {estado}")
+        if estado != "ok" and estrito:
+            regressoes.append(f"p95 {etapa}")
+    return regressoes
+
+def avaliar_recuperacao(args) -> int:
+    """
+    Constrói a base a partir dos PDFs, corre o conjunto de referência e imprime recall@k,
+    precisão limitada@k, MRR e p50/p95 de cada etapa. Devolve o código de saída (1 se houver regressão).
+    """
+    with open(args.conjunto, "r", encoding="utf-8") as f:
+        conjunto = json.load(f)
+    backend, nome_modelo, llm = criar_modelos(args.modelos)
+    modelo_embeddings = criar_modelo_embeddings(backend, nome_modelo)
+    reordenador = criar_reordenador_do_ambiente()
+
+    pasta = tempfile.mkdtemp(prefix="agrofel_avaliacao_")
+    try:
+        print(f"A construir a base a partir de '{args.documentos}' ({backend}: {nome_modelo})...")
+        base = construir_base(args.documentos, pasta, modelo_embeddings, args.cache_paginas, args.particoes)
+        print(f"{base['pdfs']} PDFs, {base['chunks']} chunks ({base['caracteres_por_chunk']} caracteres em média) "
+              f"em {base['pais']} secções, {base['linhas_doses']} linhas de dose, {base['tamanho_mb']} MB, "
+              f"{base['tempo_construcao_s']} s" + (f", {base['particoes']} partições" if args.particoes else ""))
+        embeddings = EmbeddingsComCache(modelo_embeddings, nome_modelo, CacheEmbeddings(os.path.join(pasta, "cache.sqlite")))
+        db = (BaseParticionada if args.particoes else BaseConhecimento)(os.path.join(pasta, "base"), embeddings)
+
+        print("=" * 90)
+        print(f"CONJUNTO DE REFERÊNCIA v{conjunto['versao']}: {len(conjunto['perguntas'])} perguntas, "
+              f"{args.repeticoes} repetições, rerank {'ativo' if reordenador else 'desativado'}")
+        print("=" * 90)
+        print(f"{'Pergunta':<40}" + "".join(f"{f'r@{k}':>7}" for k in KS_RECALL) + f"{'RR':>7}{'tokens':>8}")
+        latencias = {etapa: [] for etapa in ETAPAS}
+        por_pergunta = {}
+        for pergunta in conjunto["perguntas"]:
+            r = avaliar_pergunta(pergunta, db, modelo_embeddings, llm, reordenador, args.repeticoes, latencias)
+            por_pergunta[pergunta["id"]] = r
+            print(f"{pergunta['id'][:38]:<40}" + "".join(f"{r[f'recall@{k}']:>7.2f}" for k in KS_RECALL)
+                  + f"{r['mrr']:>7.2f}{r['tokens_contexto']:>8}")
+        if args.particoes:
+            estatisticas = db.estatisticas()
+            print(f"Partições por busca: {estatisticas['particoes_por_consulta']} de {estatisticas['particoes']} "
+                  f"({estatisticas['consultas_por_particao']})")
+        db.fechar()
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    metricas = {m: round(float(np.mean([r[m] for r in por_pergunta.values()])), 4)
+                for m in [f"recall@{k}" for k in KS_RECALL] + [f"precisao_limitada@{k}" for k in KS_RECALL] + ["mrr"]}
+    resultado = {
+        "versao_conjunto": conjunto["versao"],
+        "modelos": args.modelos,
+        "base": base,
+        "metricas": metricas,
+        "latencias_ms": {etapa: percentis(valores) for etapa, valores in latencias.items()},
+        "tokens_contexto_medio": round(float(np.mean([r["tokens_contexto"] for r in por_pergunta.values()])), 1),
+        "por_pergunta": por_pergunta,
+    }
+
+    print("-" * 90)
+    print("  ".join(f"{m} {v:.3f}" for m, v in metricas.items()))
+    print(f"Tokens de contexto por pergunta: {resultado['tokens_contexto_medio']}")
+    for etapa, valores in resultado["latencias_ms"].items():
+        if valores["p50"] is None:
+            print(f"  {etapa:<10} —")
+        else:
+            print(f"  {etapa:<10} p50 {valores['p50']:>9.2f} ms | p95 {valores['p95']:>9.2f} ms")
+
+    if args.gravar_linha_base:
+        with open(args.linha_base, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"\nLinha de base gravada em '{args.linha_base}'.")
+        return 0
+    if not os.path.exists(args.linha_base):
+        print("\nSem linha de base para comparar. Use --gravar-linha-base para gravar esta execução.")
+        return 0
+    with open(args.linha_base, "r", encoding="utf-8") as f:
+        regressoes = comparar_com_linha_base(resultado, json.load(f), args.estrito)
+    if regressoes:
+        print(f"\nFALHOU: regressão em {', '.join(regressoes)}.")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Avaliação offline da recuperação e da latência por etapa.")
+    parser.add_argument("--documentos", default=PASTA_BULAS, help="Pasta com os PDFs das bulas")
+    parser.add_argument("--conjunto", default=CAMINHO_CONJUNTO, help="Conjunto de referência (JSON)")
+    parser.add_argument("--linha-base", default=CAMINHO_LINHA_BASE, help="Resultado gravado para comparação")
+    parser.add_argument("--gravar-linha-base", action="store_true", help="Grava esta execução como a nova linha de base")
+    parser.add_argument("--modelos", choices=("deterministicos", "reais"), default="deterministicos",
+                        help="'deterministicos' corre sem rede (CI); 'reais' usa os embeddings do ambiente e o Gemini")
+    parser.add_argument("--cache-paginas", default=None,
+                        help="Pasta para guardar o texto extraído entre execuções (por omissão, extrai sempre)")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Execuções de cada pergunta para as latências")
+    parser.add_argument("--estrito", action="store_true", help="Também falha quando o p95 de uma etapa piora")
+    parser.add_argument("--particoes", choices=sorted(CRITERIOS), default="",
+                        help="Divide a base em partições por este critério (por omissão, base única)")
+    sys.exit(avaliar_recuperacao(parser.parse_args()))
@@ -0,0 +1,125 @@
+# 6_Aquecer_Respostas.py
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from agrofel import rastreio
+from agrofel.motor import Motor, CAMINHO_INDEX_FAISS, buscar_documentos, carregar_respostas_aquecidas, ferramenta_buscar_recomendacao
+from agrofel.respostas_aquecidas import pergunta_do_par
+
+# Antes da época (dessecação, pós-emergência), gera as respostas de BuscaRecomendacao dos
+# pares cultura × alvo das tabelas de recomendação das bulas. O motor serve-as sem busca
+# nem Gemini enquanto as bulas de cada par não mudarem.
+
+# Texto das respostas em que o Gemini não encontrou produto: não vale a pena guardá-las.
+SEM_PRODUTO = "não encontrei um produto específico"
+
+
+class LimiteTaxa:
+    """ No máximo `por_minuto` pedidos por minuto, repartidos pelas threads. """
+
+    def __init__(self, por_minuto: float):
+        self.intervalo = 60.0 / por_minuto
+        self._lock = threading.Lock()
+        self._proximo = time.monotonic()
+
+    def esperar(self):
+        with self._lock:
+            agora = time.monotonic()
+            vez = max(agora, self._proximo)
+            self._proximo = vez + self.intervalo
+        time.sleep(vez - agora)
+
+
+def aquecer_par(par: dict, db, llm, respostas, limite: LimiteTaxa) -> str:
+    """ Gera e grava a resposta de um par. Devolve 'gerada', 'sem_produto' ou 'erro'. """
+    pergunta = pergunta_do_par(par)
+    limite.esperar()
+    with rastreio.etapa("aquecimento", cultura=par["cultura"]) as etapa:
+        try:
+            docs = buscar_documentos(pergunta, db)
+            resposta = ferramenta_buscar_recomendacao(pergunta, db, llm, docs=docs) if docs else SEM_PRODUTO
+            texto = resposta if isinstance(resposta, str) else "".join(resposta)
+        except Exception as e:
+            print(f"  ERRO em '{pergunta}': {e}")
+            etapa["estado"] = "erro"
+            return "erro"
+        estado = "sem_produto" if SEM_PRODUTO in texto else "gerada"
+        if estado == "gerada":
+            respostas.guardar(par, pergunta, texto, [doc.id for doc in docs])
+        etapa["estado"] = estado
+    print(f"  {estado:<12} {pergunta}")
+    return estado
+
+def taxa_acerto_do_rastreio(caminho: str) -> dict:
+    """ Consultas ao armazém registadas no rastreio (app e serviço) e quantas foram servidas por ele. """
+    consultas = acertos = 0
+    for arquivo in rastreio.arquivos_rastreio(caminho):
+        with open(arquivo, "r", encoding="utf-8") as f:
+            for linha in f:
+                registo = json.loads(linha)
+                if registo["etapa"] == "respostas_aquecidas":
+                    consultas += 1
+                    acertos += bool(registo["atributos"].get("acerto"))
+    return {"consultas": consultas, "acertos": acertos,
+            "taxa_acerto": round(acertos / consultas, 3) if consultas else None}
+
+def aquecer_respostas(args) -> int:
+    from dotenv import load_dotenv
+    import google.generativeai as genai
+    load_dotenv()
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+
+    motor = Motor.carregar(args.indice)
+    if motor.db.doses is None:
+        print(f"ERRO: '{args.indice}' não tem a tabela de doses. Corra o 1_Criar_Base_Vetorial.py.")
+        return 1
+    respostas = carregar_respostas_aquecidas(motor.db)
+    pares = motor.db.doses.pares_cultura_alvo()
+    if args.culturas:
+        culturas = {c.strip() for c in args.culturas.split(",")}
+        pares = [par for par in pares if par["cultura"] in culturas]
+    if args.limite:
+        pares = pares[:args.limite]
+
+    antes = respostas.cobertura(pares)
+    print(f"{antes['pares']} pares cultura × alvo, {antes['com_resposta']} já com resposta válida.")
+    if not args.so_relatorio:
+        pendentes = pares if args.forcar else [par for par in pares if not respostas.valida(par)]
+        print(f"A gerar {len(pendentes)} respostas ({args.concorrencia} em paralelo, "
+              f"até {args.pedidos_por_minuto} por minuto)...")
+        limite = LimiteTaxa(args.pedidos_por_minuto)
+        with rastreio.turno("aquecimento"), ThreadPoolExecutor(max_workers=args.concorrencia) as executor:
+            tarefa = rastreio.no_contexto_atual(aquecer_par)
+            estados = Counter(executor.map(lambda par: tarefa(par, motor.db, motor.llm, respostas, limite), pendentes))
+        print(f"Geradas: {estados['gerada']} | sem produto: {estados['sem_produto']} | erros: {estados['erro']}")
+
+    depois = respostas.cobertura(pares)
+    uso = taxa_acerto_do_rastreio(args.rastreio)
+    print("=" * 70)
+    print(f"Cobertura: {depois['com_resposta']}/{depois['pares']} pares ({depois['cobertura']:.1%})")
+    if uso["consultas"]:
+        print(f"Taxa de acerto em produção: {uso['acertos']}/{uso['consultas']} pedidos de recomendação "
+              f"({uso['taxa_acerto']:.1%}), segundo '{args.rastreio}'")
+    else:
+        print(f"Taxa de acerto em produção: sem consultas registadas em '{args.rastreio}'")
+    respostas.fechar()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pré-calcula as respostas dos pares cultura × alvo das bulas.")
+    parser.add_argument("--indice", default=CAMINHO_INDEX_FAISS, help="Pasta da base de conhecimento")
+    parser.add_argument("--culturas", default=None, help="Só estas culturas, separadas por vírgulas (ex.: soja,milho)")
+    parser.add_argument("--limite", type=int, default=None, help="Só os N pares recomendados por mais produtos")
+    parser.add_argument("--concorrencia", type=int, default=4, help="Pares gerados em paralelo")
+    parser.add_argument("--pedidos-por-minuto", type=float, default=30, help="Limite de pares por minuto (quota da API)")
+    parser.add_argument("--forcar", action="store_true", help="Gera de novo mesmo os pares com resposta válida")
+    parser.add_argument("--so-relatorio", action="store_true", help="Só mostra a cobertura e a taxa de acerto")
+    parser.add_argument("--rastreio", default=rastreio.ARQUIVO_RASTREIO,
+                        help="Registo do rastreio de onde calcular a taxa de acerto")
+    sys.exit(aquecer_respostas(parser.parse_args()))
@@ -0,0 +1,2 @@
+# agrofel/__init__.py
+""" Módulos partilhados entre o script de ingestão das bulas e o app.py. """
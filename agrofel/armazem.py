@@ -0,0 +1,383 @@
+# agrofel/armazem.py
+"""
+Formato em disco da base de conhecimento, sem pickle:
+- chunks.arrow: texto, metadados e id de cada chunk num arquivo Arrow IPC, aberto por mmap;
+- pais.arrow: as secções de onde vêm os chunks (ver agrofel.divisao), no mesmo formato;
+- vetores.npy: vetores float32 na mesma ordem dos chunks, usados para reconstruir o índice;
+- indice.faiss: índice FAISS de busca, também aberto por mmap;
+- indice.json: tipo e parâmetros do índice (ver agrofel.indices);
+- lexico.npz: índice BM25 sobre os mesmos chunks (ver agrofel.lexical);
+- produtos.json: nome de produto -> posições dos seus chunks (ver agrofel.produtos);
+- doses.sqlite: tabela produto × cultura × alvo × dose das bulas (ver agrofel.doses).
+Vários processos do Streamlit partilham assim a cache de páginas do sistema operativo
+em vez de cada um desserializar e guardar a sua própria cópia dos chunks.
+"""
+import os
+import json
+from collections import Counter
+
+import faiss
+import numpy as np
+import pyarrow as pa
+from langchain_core.documents import Document
+
+from agrofel.indices import CONFIG_INDICE_PADRAO, construir_indice, aplicar_parametros_busca
+from agrofel.lexical import ARQUIVO_LEXICO, IndiceBM25, carregar_indice_lexico, fundir_rrf
+from agrofel.produtos import ARQUIVO_PRODUTOS, IndiceProdutos, carregar_indice_produtos
+from agrofel.doses import ARQUIVO_DOSES, gravar_tabela_doses, carregar_tabela_doses, paginas_dos_chunks
+from agrofel.divisao import com_titulo
+
+ARQUIVO_CHUNKS = "chunks.arrow"
+ARQUIVO_PAIS = "pais.arrow"
+ARQUIVO_VETORES = "vetores.npy"
+ARQUIVO_INDICE = "indice.faiss"
+ARQUIVO_CONFIG_INDICE = "indice.json"
+# Formato antigo gravado pelo FAISS do LangChain (docstore em pickle)
+ARQUIVOS_LANGCHAIN = ("index.faiss", "index.pkl")
+
+ESQUEMA_CHUNKS = pa.schema([
+    ("id", pa.string()),
+    ("texto", pa.string()),
+    ("metadata", pa.string()),
+    ("sha256", pa.string()),
+])
+
+# Mapeia os códigos do índice em vez de os copiar para a memória de cada processo.
+FLAGS_LEITURA_FAISS = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+# Uma secção com até isto de caracteres substitui o chunk mesmo que só ele tenha sido encontrado
+TAMANHO_PAI_CURTO = 1200
+
+
+def existe_armazem(pasta: str) -> bool:
+    return all(os.path.exists(os.path.join(pasta, a)) for a in (ARQUIVO_CHUNKS, ARQUIVO_VETORES, ARQUIVO_INDICE))
+
+def versao_armazem(pasta: str) -> tuple:
+    """ Muda sempre que os chunks ou o índice são regravados (os.replace cria um arquivo novo). """
+    versao = []
+    for arquivo in (ARQUIVO_CHUNKS, ARQUIVO_INDICE):
+        estado = os.stat(os.path.join(pasta, arquivo))
+        versao += [estado.st_mtime_ns, estado.st_size]
+    return tuple(versao)
+
+def existe_indice_langchain(pasta: str) -> bool:
+    return all(os.path.exists(os.path.join(pasta, a)) for a in ARQUIVOS_LANGCHAIN)
+
+def _gravar_atomico(caminho: str, gravar):
+    """ Grava num arquivo temporário e só depois substitui o definitivo. """
+    temporario = caminho + ".tmp"
+    gravar(temporario)
+    os.replace(temporario, caminho)
+
+def carregar_config_indice(pasta: str) -> dict:
+    """ Configuração com que o índice foi construído; bases sem indice.json usam o índice exato. """
+    caminho = os.path.join(pasta, ARQUIVO_CONFIG_INDICE)
+    if not os.path.exists(caminho):
+        return dict(CONFIG_INDICE_PADRAO)
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def gravar_indice(pasta: str, vetores: np.ndarray, config_indice: dict = None):
+    """ Constrói o índice de busca a partir dos vetores e grava-o junto com a sua configuração. """
+    config_indice = config_indice or CONFIG_INDICE_PADRAO
+    indice = construir_indice(vetores, config_indice)
+    _gravar_atomico(os.path.join(pasta, ARQUIVO_INDICE), lambda caminho: faiss.write_index(indice, caminho))
+
+    def gravar_config(caminho):
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(config_indice, f, indent=2)
+
+    _gravar_atomico(os.path.join(pasta, ARQUIVO_CONFIG_INDICE), gravar_config)
+
+def reconstruir_indice(pasta: str, config_indice: dict):
+    """ Troca o tipo de índice sem recalcular embeddings, usando o vetores.npy já gravado. """
+    vetores = np.load(os.path.join(pasta, ARQUIVO_VETORES))
+    gravar_indice(pasta, vetores, config_indice)
+
+def _gravar_tabela_arrow(caminho_final: str, ids: list, textos: list, metadatas: list):
+    tabela = pa.table({
+        "id": ids,
+        "texto": textos,
+        "metadata": [json.dumps(m, ensure_ascii=False) for m in metadatas],
+        "sha256": [m.get("sha256", "") for m in metadatas],
+    }, schema=ESQUEMA_CHUNKS)
+
+    def gravar(caminho):
+        with pa.OSFile(caminho, "wb") as sink, pa.ipc.new_file(sink, ESQUEMA_CHUNKS) as escritor:
+            escritor.write_table(tabela)
+
+    _gravar_atomico(caminho_final, gravar)
+
+def gravar_armazem(pasta: str, ids: list, textos: list, metadatas: list, vetores: np.ndarray, config_indice: dict = None,
+                   pais: list = None):
+    """
+    Grava chunks, vetores e índice de busca. Os três arquivos ficam sempre na mesma ordem.
+    `pais` são os Documents das secções (ver agrofel.divisao); sem eles, a base fica sem
+    pais.arrow e a busca devolve sempre os chunks. Devolve o nº de linhas da tabela de doses.
+    """
+    os.makedirs(pasta, exist_ok=True)
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+
+    def gravar_vetores(caminho):
+        with open(caminho, "wb") as f:
+            np.save(f, vetores)
+
+    _gravar_tabela_arrow(os.path.join(pasta, ARQUIVO_CHUNKS), ids, textos, metadatas)
+    caminho_pais = os.path.join(pasta, ARQUIVO_PAIS)
+    if pais is not None:
+        _gravar_tabela_arrow(caminho_pais, [p.id for p in pais], [p.page_content for p in pais], [p.metadata for p in pais])
+    elif os.path.exists(caminho_pais):
+        os.remove(caminho_pais)
+    _gravar_atomico(os.path.join(pasta, ARQUIVO_VETORES), gravar_vetores)
+    gravar_indice(pasta, vetores, config_indice)
+    return gravar_indices_auxiliares(pasta, textos, metadatas, pais)
+
+def gravar_indices_auxiliares(pasta: str, textos: list, metadatas: list, pais: list = None) -> int:
+    """
+    Índices derivados apenas dos chunks (BM25, produtos e tabela de doses), na mesma ordem
+    do ArmazemChunks. Devolve o nº de linhas da tabela de doses.
+    """
+    _gravar_atomico(os.path.join(pasta, ARQUIVO_LEXICO), IndiceBM25.construir(textos).gravar)
+    return gravar_produtos_e_doses(pasta, textos, metadatas, pais)
+
+def gravar_produtos_e_doses(pasta: str, textos: list, metadatas: list, pais: list = None) -> int:
+    """
+    Índice de produtos e tabela de doses. O nome do produto e as tabelas de doses saem do
+    texto de cada página, refeito a partir dos `pais` (secções sem o título à frente) ou,
+    sem eles, dos chunks. Devolve o nº de linhas da tabela de doses.
+    """
+    textos_paginas = [p.page_content for p in pais] if pais is not None else textos
+    metadatas_paginas = [p.metadata for p in pais] if pais is not None else metadatas
+    rostos = [
+        ({"source": arquivo, "page": pagina}, texto)
+        for arquivo, paginas in paginas_dos_chunks(metadatas_paginas, textos_paginas).items()
+        for pagina, texto in paginas
+    ]
+    indice_produtos = IndiceProdutos.construir(metadatas, textos, rostos=rostos)
+    _gravar_atomico(os.path.join(pasta, ARQUIVO_PRODUTOS), indice_produtos.gravar)
+    linhas_doses = 0
+
+    def gravar_doses(caminho):
+        nonlocal linhas_doses
+        linhas_doses = gravar_tabela_doses(caminho, metadatas_paginas, textos_paginas, indice_produtos)
+
+    _gravar_atomico(os.path.join(pasta, ARQUIVO_DOSES), gravar_doses)
+    return linhas_doses
+
+def faltam_indices_auxiliares(pasta: str) -> bool:
+    return not all(os.path.exists(os.path.join(pasta, a)) for a in (ARQUIVO_LEXICO, ARQUIVO_PRODUTOS, ARQUIVO_DOSES))
+
+def remover_armazem(pasta: str):
+    """ Apaga os chunks, vetores e índices de busca (ao passar a base para partições). """
+    for arquivo in (ARQUIVO_CHUNKS, ARQUIVO_PAIS, ARQUIVO_VETORES, ARQUIVO_INDICE, ARQUIVO_CONFIG_INDICE, ARQUIVO_LEXICO):
+        caminho = os.path.join(pasta, arquivo)
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+
+def _documento_da_tabela(tabela, posicao: int) -> Document:
+    return Document(
+        id=tabela.column("id")[posicao].as_py(),
+        page_content=tabela.column("texto")[posicao].as_py(),
+        metadata=json.loads(tabela.column("metadata")[posicao].as_py()),
+    )
+
+
+class ArmazemChunks:
+    """ Acesso só de leitura, por mmap, aos chunks, pais e vetores gravados por gravar_armazem. """
+
+    def __init__(self, pasta: str):
+        self.pasta = pasta
+        self._arquivo_chunks = pa.memory_map(os.path.join(pasta, ARQUIVO_CHUNKS), "r")
+        self.tabela = pa.ipc.open_file(self._arquivo_chunks).read_all()
+        self.vetores = np.load(os.path.join(pasta, ARQUIVO_VETORES), mmap_mode="r")
+        # Bases criadas antes do agrofel.divisao não têm pais.
+        self._arquivo_pais, self.tabela_pais, self._posicao_pai = None, None, {}
+        caminho_pais = os.path.join(pasta, ARQUIVO_PAIS)
+        if os.path.exists(caminho_pais):
+            self._arquivo_pais = pa.memory_map(caminho_pais, "r")
+            self.tabela_pais = pa.ipc.open_file(self._arquivo_pais).read_all()
+            self._posicao_pai = {id_pai: i for i, id_pai in enumerate(self.tabela_pais.column("id").to_pylist())}
+
+    def fechar(self):
+        """ Liberta os mapeamentos de memória, para que os arquivos possam ser substituídos. """
+        self.tabela = None
+        self.tabela_pais = None
+        self.vetores = None
+        self._arquivo_chunks.close()
+        if self._arquivo_pais is not None:
+            self._arquivo_pais.close()
+
+    def __len__(self) -> int:
+        return self.tabela.num_rows
+
+    def ids(self) -> list:
+        return self.tabela.column("id").to_pylist()
+
+    def sha256(self) -> list:
+        return self.tabela.column("sha256").to_pylist()
+
+    def documento(self, posicao: int) -> Document:
+        """ Materializa um único chunk; os restantes continuam apenas mapeados. """
+        return _documento_da_tabela(self.tabela, posicao)
+
+    def pais(self) -> list:
+        """ Todos os pais, por ordem (para regravar a base); [] se a base não os tiver. """
+        if self.tabela_pais is None:
+            return []
+        return [_documento_da_tabela(self.tabela_pais, i) for i in range(self.tabela_pais.num_rows)]
+
+    def pai(self, id_pai: str):
+        """ A secção com este id, ou None. """
+        posicao = self._posicao_pai.get(id_pai)
+        return _documento_da_tabela(self.tabela_pais, posicao) if posicao is not None else None
+
+    def bulas(self) -> dict:
+        """ Nome do PDF -> sha256, a partir dos chunks. """
+        bulas = {}
+        for posicao, sha in enumerate(self.sha256()):
+            if sha not in bulas.values():
+                fonte = self.documento(posicao).metadata.get("source", "")
+                bulas.setdefault(os.path.basename(fonte), sha)
+        return bulas
+
+
+def expandir_pais(docs: list, obter_pai) -> list:
+    """
+    Troca os chunks pela secção de onde vêm quando dois ou mais são da mesma secção ou
+    quando a secção é curta (TAMANHO_PAI_CURTO). A secção fica no lugar do seu chunk mais
+    relevante e leva o título à frente se começa a meio (tabela que continua da página
+    anterior). Os restantes chunks seguem como estão, pequenos. `obter_pai(id)` devolve a
+    secção, ou None.
+    """
+    por_pai = Counter(doc.metadata.get("pai") for doc in docs)
+    expandidos, usados = [], set()
+    for doc in docs:
+        id_pai = doc.metadata.get("pai")
+        if id_pai in usados:
+            continue
+        pai = obter_pai(id_pai) if id_pai else None
+        if pai is None or (por_pai[id_pai] < 2 and len(pai.page_content) > TAMANHO_PAI_CURTO):
+            expandidos.append(doc)
+            continue
+        pai.page_content = com_titulo(pai.page_content, pai.metadata.get("secao", ""))
+        expandidos.append(pai)
+        usados.add(id_pai)
+    return expandidos
+
+
+class BaseConhecimento:
+    """
+    Substitui o FAISS do LangChain no app.py: mesma interface de busca
+    (similarity_search e similarity_search_with_score), mas lendo o formato do ArmazemChunks.
+    Usa o tipo de índice que foi construído; nprobe e ef_search ajustam a busca aproximada.
+    """
+
+    def __init__(self, pasta: str, embeddings, nprobe: int = None, ef_search: int = None):
+        self.pasta = pasta
+        self.embeddings = embeddings
+        self.armazem = ArmazemChunks(pasta)
+        self.config_indice = carregar_config_indice(pasta)
+        self.indice = faiss.read_index(os.path.join(pasta, ARQUIVO_INDICE), FLAGS_LEITURA_FAISS)
+        aplicar_parametros_busca(self.indice, self.config_indice, nprobe=nprobe, ef_search=ef_search)
+        self.lexico = carregar_indice_lexico(pasta)
+        self.produtos = carregar_indice_produtos(pasta)
+        self.doses = carregar_tabela_doses(pasta)
+
+    def versao(self) -> tuple:
+        return versao_armazem(self.pasta)
+
+    def bulas(self) -> dict:
+        return self.armazem.bulas()
+
+    def fechar(self):
+        self.armazem.fechar()
+
+    def _buscar_posicoes(self, vetor, k: int) -> list:
+        """ Devolve [(posicao, distancia)] dos k vizinhos mais próximos do vetor. """
+        distancias, posicoes = self.indice.search(np.asarray([vetor], dtype=np.float32), k)
+        return [(int(p), float(d)) for d, p in zip(distancias[0], posicoes[0]) if p != -1]
+
+    def similarity_search_by_vector_with_score(self, vetor, k: int = 4) -> list:
+        return [(self.armazem.documento(p), d) for p, d in self._buscar_posicoes(vetor, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list:
+        return self.similarity_search_by_vector_with_score(self.embeddings.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def candidatos(self, vetor, query: str, candidatos: int = 20, posicoes: list = None, bm25: dict = None) -> tuple:
+        """
+        Candidatos da busca vetorial [(posicao, distancia)] e do BM25 [(posicao, pontuacao)]:
+        os `candidatos` melhores de toda a base ou, com `posicoes` (os chunks de um produto,
+        um sub-índice de poucas dezenas de linhas), todos eles, por distância exata.
+        `bm25` são o idf e o comprimento médio de uma base particionada (ver IndiceBM25.pontuar).
+        """
+        vetor = np.asarray(vetor, dtype=np.float32)
+        if posicoes is None:
+            densos = self._buscar_posicoes(vetor, candidatos)
+        else:
+            posicoes = np.asarray(posicoes)
+            distancias = ((self.armazem.vetores[posicoes] - vetor) ** 2).sum(axis=1)
+            ordem = np.argsort(distancias)
+            densos = list(zip(posicoes[ordem].tolist(), distancias[ordem].tolist()))
+        if self.lexico is None:
+            return densos, []
+        if posicoes is None:
+            return densos, self.lexico.buscar_com_pontuacao(query, candidatos, **(bm25 or {}))
+        pontuacoes = self.lexico.pontuar(query, **(bm25 or {}))[posicoes]
+        ordem = np.argsort(-pontuacoes)
+        ordem = ordem[pontuacoes[ordem] > 0]
+        return densos, list(zip(posicoes[ordem].tolist(), pontuacoes[ordem].tolist()))
+
+    def busca_hibrida(self, query: str, k: int = 4, candidatos: int = 20) -> list:
+        """
+        Combina, por Reciprocal Rank Fusion, os `candidatos` melhores chunks da busca
+        vetorial e do BM25. Sem índice léxico, equivale ao similarity_search.
+        """
+        if self.lexico is None:
+            return self.similarity_search(query, k)
+        densos, lexicos = self.candidatos(self.embeddings.embed_query(query), query, candidatos)
+        return [self.armazem.documento(p) for p in fundir_rrf([[p for p, _ in densos], [p for p, _ in lexicos]], k)]
+
+    def busca_por_produto(self, query: str, nome_produto: str, k: int = 4) -> list:
+        """
+        Busca só entre os chunks do produto indicado: distância exata aos vetores desse
+        produto fundida com o BM25 restrito. Se o produto não for reconhecido, recorre à
+        busca híbrida em toda a base.
+        """
+        chave = self.produtos.resolver(nome_produto) if self.produtos is not None else None
+        if chave is None:
+            return self.busca_hibrida(query, k)
+        densos, lexicos = self.candidatos(self.embeddings.embed_query(query), query, posicoes=self.produtos.posicoes(chave))
+        return [self.armazem.documento(p) for p in fundir_rrf([[p for p, _ in densos], [p for p, _ in lexicos]], k)]
+
+    def pai(self, id_pai: str):
+        return self.armazem.pai(id_pai)
+
+    def expandir_pais(self, docs: list) -> list:
+        """ Ver expandir_pais: a secção inteira só segue quando vários chunks vêm dela. """
+        return expandir_pais(docs, self.pai)
+
+
+def converter_indice_langchain(pasta: str):
+    """
+    Migra, uma única vez, um índice gravado pelo FAISS do LangChain para o novo formato,
+    reaproveitando os vetores já calculados. É o único ponto que ainda lê o pickle, e só
+    no script de ingestão, sobre um arquivo criado por nós próprios.
+    """
+    from langchain_community.vectorstores import FAISS
+
+    antigo = FAISS.load_local(pasta, None, allow_dangerous_deserialization=True)
+    ids = [antigo.index_to_docstore_id[i] for i in range(antigo.index.ntotal)]
+    documentos = [antigo.docstore.search(id_chunk) for id_chunk in ids]
+    vetores = antigo.index.reconstruct_n(0, antigo.index.ntotal)
+    gravar_armazem(pasta, ids, [d.page_content for d in documentos], [d.metadata for d in documentos], vetores)
+    remover_indice_langchain(pasta)
+
+def remover_indice_langchain(pasta: str):
+    """ Apaga os arquivos do formato antigo, se existirem. """
+    for arquivo in ARQUIVOS_LANGCHAIN:
+        caminho = os.path.join(pasta, arquivo)
+        if os.path.exists(caminho):
+            os.remove(caminho)
@@ -0,0 +1,116 @@
+# agrofel/avaliacao.py
+"""
+Peças do banco de avaliação (5_Avaliar_Recuperacao.py): métricas de recuperação contra o
+conjunto de referência e substitutos determinísticos do modelo de embeddings e do LLM,
+para que a avaliação corra sem rede (ex.: em CI) e dê sempre os mesmos resultados.
+"""
+import os
+import hashlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from agrofel.lexical import tokenizar
+
+DIMENSAO_DETERMINISTICA = 384
+
+
+class EmbeddingsDeterministicos(Embeddings):
+    """
+    Hashing de termos e de trigramas de caracteres num vetor normalizado. Não tem a
+    qualidade de um modelo treinado, mas perguntas e chunks com as mesmas palavras ficam
+    próximos, e o resultado é igual em qualquer máquina (usa blake2b, não o hash() do Python).
+    """
+
+    def __init__(self, dimensao: int = DIMENSAO_DETERMINISTICA):
+        self.dimensao = dimensao
+
+    def _posicao(self, termo: str) -> int:
+        return int.from_bytes(hashlib.blake2b(termo.encode("utf-8"), digest_size=8).digest(), "little") % self.dimensao
+
+    def _incorporar(self, texto: str) -> list:
+        vetor = np.zeros(self.dimensao, dtype=np.float32)
+        for termo in tokenizar(texto):
+            vetor[self._posicao(termo)] += 1.0
+            for i in range(len(termo) - 2):
+                vetor[self._posicao("#" + termo[i:i + 3])] += 0.5
+        norma = np.linalg.norm(vetor)
+        return (vetor / norma if norma else vetor).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._incorporar(texto) for texto in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._incorporar(text)
+
+
+class LLMDeterministico(BaseChatModel):
+    """
+    Substituto do Gemini: devolve, palavra a palavra, o início do texto entre os primeiros
+    separadores '---' do prompt (o contexto das bulas). Mede o custo local da geração
+    (montagem do prompt, cadeia e streaming) sem rede nem variação entre execuções.
+    """
+
+    max_palavras: int = 120
+
+    @property
+    def _llm_type(self) -> str:
+        return "agrofel-deterministico"
+
+    def _resposta(self, messages) -> str:
+        prompt = "\n".join(str(m.content) for m in messages)
+        partes = prompt.split("---")
+        texto = partes[1] if len(partes) > 2 else prompt
+        return " ".join(texto.split()[:self.max_palavras])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._resposta(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for i, palavra in enumerate(self._resposta(messages).split(" ")):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=palavra if i == 0 else " " + palavra))
+
+
+# --- MÉTRICAS ---
+
+def paginas_dos_docs(docs: list) -> list:
+    """ (arquivo, página) de cada chunk, pela ordem da busca. """
+    return [(os.path.basename(doc.metadata.get("source", "")), doc.metadata.get("page")) for doc in docs]
+
+def paginas_relevantes(pergunta: dict) -> set:
+    return {(r["arquivo"], pagina) for r in pergunta["relevantes"] for pagina in r["paginas"]}
+
+def recall_em_k(recuperadas: list, relevantes: set, k: int) -> float:
+    """ Páginas relevantes entre os k primeiros chunks, sobre todas as relevantes; nunca desce quando k cresce. """
+    if not relevantes:
+        return 0.0
+    return len(set(recuperadas[:k]) & relevantes) / len(relevantes)
+
+def precisao_limitada_em_k(recuperadas: list, relevantes: set, k: int) -> float:
+    """
+    Páginas relevantes entre os k primeiros chunks, sobre o máximo que k chunks podem
+    encontrar. Perguntas gerais têm dezenas de páginas relevantes e um recall baixo mesmo
+    com todos os chunks certos; esta mede se os k primeiros são os certos. Como o
+    denominador cresce com k, pode descer de um k para o seguinte.
+    """
+    if not relevantes:
+        return 0.0
+    return len(set(recuperadas[:k]) & relevantes) / min(k, len(relevantes))
+
+def reciprocal_rank(recuperadas: list, relevantes: set) -> float:
+    """ 1 / posição do primeiro chunk relevante; 0 se nenhum for. """
+    for posicao, pagina in enumerate(recuperadas, start=1):
+        if pagina in relevantes:
+            return 1.0 / posicao
+    return 0.0
+
+def percentis(latencias_ms: list) -> dict:
+    if not latencias_ms:
+        return {"p50": None, "p95": None}
+    return {
+        "p50": round(float(np.percentile(latencias_ms, 50)), 3),
+        "p95": round(float(np.percentile(latencias_ms, 95)), 3),
+    }
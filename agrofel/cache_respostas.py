@@ -0,0 +1,155 @@
+# agrofel/cache_respostas.py
+"""
+Cache de respostas das ferramentas BuscaRecomendacao e BuscaTecnica. A mesma pergunta
+feita por outras palavras ("o que passar no capim amargoso da soja" / "capim-amargoso
+na soja, o que aplicar?") reutiliza a resposta gerada pelo Gemini, desde que a busca
+devolva exatamente os mesmos chunks e o índice não tenha sido reconstruído.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from agrofel.lexical import tokenizar
+
+MAX_ENTRADAS = 500
+TTL_SEGUNDOS = 24 * 3600
+# Similaridade de cosseno mínima entre os vetores das perguntas para reutilizar uma resposta
+LIMIAR_SIMILARIDADE = 0.92
+
+
+@dataclass
+class EntradaCache:
+    ferramenta: str
+    escopo: str
+    vetor: np.ndarray
+    ids_chunks: tuple
+    resposta: str
+    criada_em: float
+
+
+def _normalizar_argumento(valor) -> str:
+    return " ".join(tokenizar(str(valor or "")))
+
+def _vetor_unitario(vetor) -> np.ndarray:
+    vetor = np.asarray(vetor, dtype=np.float32)
+    norma = float(np.linalg.norm(vetor))
+    return vetor / norma if norma else vetor
+
+
+class CacheRespostas:
+    """
+    LRU em memória, partilhado pelas sessões do processo. Uma entrada é encontrada pelos
+    argumentos normalizados da ferramenta ou, se não houver, pela pergunta mais parecida
+    (mesma ferramenta e mesmo produto) acima do LIMIAR_SIMILARIDADE. Em ambos os casos só
+    é devolvida se os chunks recuperados agora forem os mesmos que geraram a resposta.
+    """
+
+    def __init__(self, max_entradas: int = MAX_ENTRADAS, ttl_segundos: float = TTL_SEGUNDOS,
+                 limiar_similaridade: float = LIMIAR_SIMILARIDADE):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.limiar_similaridade = limiar_similaridade
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self._versao_indice = None
+        self.acertos_exatos = 0
+        self.acertos_semanticos = 0
+        self.falhas = 0
+        self.rejeitadas_por_chunks = 0
+        self.invalidacoes = 0
+
+    @staticmethod
+    def chave(ferramenta: str, argumentos: dict) -> str:
+        """ 'BuscaTecnica|nome_produto=glyphotal tr|pergunta_tecnica=dose hectare'. """
+        partes = [f"{nome}={_normalizar_argumento(valor)}" for nome, valor in sorted(argumentos.items())]
+        return "|".join([ferramenta] + partes)
+
+    @staticmethod
+    def escopo(argumentos: dict) -> str:
+        """ Respostas técnicas só são comparáveis entre perguntas sobre o mesmo produto. """
+        return _normalizar_argumento(argumentos.get("nome_produto"))
+
+    def _verificar_versao(self, versao_indice):
+        # Chamado com o lock adquirido. Um índice reconstruído invalida todas as respostas.
+        if versao_indice != self._versao_indice:
+            if self._entradas:
+                self.invalidacoes += 1
+            self._entradas.clear()
+            self._versao_indice = versao_indice
+
+    def _expirada(self, entrada: EntradaCache, agora: float) -> bool:
+        return agora - entrada.criada_em > self.ttl_segundos
+
+    def _mais_parecida(self, ferramenta: str, escopo: str, vetor: np.ndarray, agora: float):
+        candidatas = [
+            (chave, entrada) for chave, entrada in self._entradas.items()
+            if entrada.ferramenta == ferramenta and entrada.escopo == escopo and not self._expirada(entrada, agora)
+        ]
+        if not candidatas:
+            return None, None
+        similaridades = np.stack([entrada.vetor for _, entrada in candidatas]) @ vetor
+        melhor = int(np.argmax(similaridades))
+        if similaridades[melhor] < self.limiar_similaridade:
+            return None, None
+        return candidatas[melhor]
+
+    def obter(self, ferramenta: str, argumentos: dict, vetor_consulta, ids_chunks: list, versao_indice):
+        """ Devolve a resposta guardada ou None. """
+        agora = time.time()
+        with self._lock:
+            self._verificar_versao(versao_indice)
+            chave = self.chave(ferramenta, argumentos)
+            entrada = self._entradas.get(chave)
+            semantica = False
+            if entrada is not None and self._expirada(entrada, agora):
+                del self._entradas[chave]
+                entrada = None
+            if entrada is None:
+                chave, entrada = self._mais_parecida(ferramenta, self.escopo(argumentos), _vetor_unitario(vetor_consulta), agora)
+                semantica = entrada is not None
+            if entrada is None:
+                self.falhas += 1
+                return None
+            if entrada.ids_chunks != tuple(ids_chunks):
+                # A busca já não devolve os mesmos trechos: a resposta pode estar desatualizada.
+                self.rejeitadas_por_chunks += 1
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            if semantica:
+                self.acertos_semanticos += 1
+            else:
+                self.acertos_exatos += 1
+            return entrada.resposta
+
+    def guardar(self, ferramenta: str, argumentos: dict, vetor_consulta, ids_chunks: list, versao_indice, resposta: str):
+        with self._lock:
+            self._verificar_versao(versao_indice)
+            chave = self.chave(ferramenta, argumentos)
+            self._entradas[chave] = EntradaCache(
+                ferramenta, self.escopo(argumentos), _vetor_unitario(vetor_consulta),
+                tuple(ids_chunks), resposta, time.time(),
+            )
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            consultas = self.acertos_exatos + self.acertos_semanticos + self.falhas
+            return {
+                "entradas": len(self._entradas),
+                "acertos_exatos": self.acertos_exatos,
+                "acertos_semanticos": self.acertos_semanticos,
+                "falhas": self.falhas,
+                "rejeitadas_por_chunks": self.rejeitadas_por_chunks,
+                "invalidacoes": self.invalidacoes,
+                "taxa_acerto": round((consultas - self.falhas) / consultas, 3) if consultas else 0.0,
+            }
@@ -0,0 +1,101 @@
+# agrofel/cliente.py
+"""
+Cliente do serviço HTTP (agrofel.servico), usado pelo app.py e pela página de diagnóstico
+quando AGROFEL_SERVICO_URL está definido. `responder` tem a mesma forma que Motor.responder:
+chama `progresso` com cada etapa e devolve um gerador com os pedaços da resposta.
+"""
+import json
+
+import requests
+
+# Segundos para abrir a ligação e entre dois eventos da resposta (o primeiro token pode demorar)
+TEMPO_LIGACAO = 5
+TEMPO_LEITURA = 120
+
+
+class ServicoIndisponivel(Exception):
+    """ Serviço desligado, com erro ou ocupado; `espera` (s) vem do Retry-After de um 503. """
+
+    def __init__(self, mensagem: str, espera: int = None):
+        super().__init__(mensagem)
+        self.espera = espera
+
+
+def _sem_progresso(etapa: str):
+    pass
+
+
+class ClienteServico:
+
+    def __init__(self, url: str, senha_admin: str = None):
+        self.url = url.rstrip("/")
+        self.senha_admin = senha_admin
+        # Reutiliza a ligação TCP entre turnos da mesma sessão.
+        self.sessao_http = requests.Session()
+
+    def responder(self, pergunta: str, mensagens: list, sessao: str = None, progresso=_sem_progresso):
+        """
+        Envia o turno e lê os eventos até ao primeiro pedaço de texto (as etapas anteriores
+        vão para `progresso`). Levanta ServicoIndisponivel antes disso; o resto da resposta
+        chega pelo gerador devolvido, à medida que o serviço o transmite.
+        """
+        corpo = {"pergunta": pergunta, "historico": mensagens, "sessao": sessao}
+        try:
+            resposta = self.sessao_http.post(f"{self.url}/conversa", json=corpo, stream=True,
+                                             timeout=(TEMPO_LIGACAO, TEMPO_LEITURA))
+        except requests.RequestException as e:
+            raise ServicoIndisponivel(f"Serviço do assistente inacessível: {e}")
+        if resposta.status_code == 503:
+            espera = resposta.headers.get("Retry-After")
+            resposta.close()
+            raise ServicoIndisponivel("Serviço do assistente ocupado.", int(espera) if espera else None)
+        if resposta.status_code != 200:
+            resposta.close()
+            raise ServicoIndisponivel(f"Serviço do assistente respondeu {resposta.status_code}.")
+
+        eventos = self._eventos(resposta)
+        try:
+            for evento in eventos:
+                if evento["tipo"] == "progresso":
+                    progresso(evento["etapa"])
+                    continue
+                if evento["tipo"] == "erro":
+                    raise ServicoIndisponivel(evento["erro"])
+                return self._texto(evento, eventos)
+        except requests.RequestException as e:
+            raise ServicoIndisponivel(f"Ligação ao serviço interrompida: {e}")
+        raise ServicoIndisponivel("O serviço terminou sem resposta.")
+
+    def _eventos(self, resposta):
+        with resposta:
+            for linha in resposta.iter_lines(decode_unicode=True):
+                if linha:
+                    yield json.loads(linha)
+
+    def _texto(self, evento: dict, eventos):
+        # Um erro depois do primeiro pedaço fica no fim do texto já mostrado.
+        while evento["tipo"] != "fim":
+            if evento["tipo"] == "texto":
+                yield evento["texto"]
+            elif evento["tipo"] == "erro":
+                yield f"\n\n{evento['erro']}"
+                return
+            try:
+                evento = next(eventos, {"tipo": "fim"})
+            except requests.RequestException as e:
+                print(f"AVISO: ligação ao serviço interrompida a meio da resposta ({e}).")
+                yield "\n\n(A ligação ao assistente foi interrompida. Por favor, tente de novo.)"
+                return
+
+    def _admin(self, metodo: str, caminho: str):
+        resposta = self.sessao_http.request(metodo, f"{self.url}{caminho}", timeout=(TEMPO_LIGACAO, 30),
+                                            headers={"X-Agrofel-Admin": self.senha_admin or ""})
+        resposta.raise_for_status()
+        return resposta
+
+    def diagnostico(self) -> dict:
+        """ Agregado do rastreio e painéis do worker que atendeu o pedido. """
+        return self._admin("GET", "/diagnostico").json()
+
+    def limpar_diagnostico(self):
+        self._admin("DELETE", "/diagnostico")
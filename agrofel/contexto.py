@@ -0,0 +1,152 @@
+# agrofel/contexto.py
+"""
+Montagem do contexto enviado ao LLM. Nas bases criadas antes do agrofel.divisao os
+chunks vizinhos repetem até 200 caracteres, e bulas duplicadas geram chunks quase
+iguais; aqui esse texto repetido é retirado, os chunks da mesma página são unidos e o
+resultado é cortado a um orçamento de tokens, dos trechos mais relevantes para os menos.
+"""
+import re
+import threading
+from dataclasses import dataclass
+
+from agrofel.historico import estimar_tokens
+from agrofel.lexical import tokenizar
+
+ORCAMENTO_TOKENS_CONTEXTO = 1600
+SEPARADOR = "\n\n---\n\n"
+# Chunks cujos 5-gramas de palavras coincidem acima disto são considerados o mesmo texto
+LIMIAR_QUASE_DUPLICADO = 0.85
+# O overlap do divisor antigo era de 200 caracteres; procuramos um pouco mais por causa dos espaços
+MAX_SOBREPOSICAO = 300
+MIN_SOBREPOSICAO = 20
+# Abaixo disto não vale a pena incluir um bloco cortado
+MIN_TOKENS_BLOCO_CORTADO = 80
+
+
+@dataclass
+class ContextoEmpacotado:
+    texto: str
+    tokens_originais: int
+    tokens_finais: int
+    chunks_recebidos: int
+    chunks_usados: int
+    duplicados_removidos: int
+
+    @property
+    def tokens_poupados(self) -> int:
+        return self.tokens_originais - self.tokens_finais
+
+
+class EstatisticasContexto:
+    """ Tokens de prompt poupados por processo, para o painel de diagnóstico. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pedidos = 0
+        self.tokens_originais = 0
+        self.tokens_finais = 0
+
+    def registar(self, contexto: ContextoEmpacotado):
+        with self._lock:
+            self.pedidos += 1
+            self.tokens_originais += contexto.tokens_originais
+            self.tokens_finais += contexto.tokens_finais
+
+    def resumo(self) -> dict:
+        with self._lock:
+            poupados = self.tokens_originais - self.tokens_finais
+            return {
+                "pedidos": self.pedidos,
+                "tokens_poupados": poupados,
+                "tokens_poupados_por_pedido": round(poupados / self.pedidos, 1) if self.pedidos else 0.0,
+                "reducao": round(poupados / self.tokens_originais, 3) if self.tokens_originais else 0.0,
+            }
+
+
+estatisticas = EstatisticasContexto()
+
+
+def _shingles(texto: str, n: int = 5) -> set:
+    palavras = tokenizar(texto)
+    if len(palavras) < n:
+        return {" ".join(palavras)}
+    return {" ".join(palavras[i:i + n]) for i in range(len(palavras) - n + 1)}
+
+def _semelhanca(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+def _posicao_no_arquivo(doc):
+    """ Os ids são '<sha256>-<n>', com n crescente ao longo do arquivo. """
+    try:
+        return int(str(doc.id).rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+def unir_sem_sobreposicao(anterior: str, seguinte: str) -> str:
+    """ Junta dois chunks consecutivos sem repetir o fim do primeiro que o segundo volta a trazer. """
+    anterior, seguinte = anterior.rstrip(), seguinte.lstrip()
+    for tamanho in range(min(MAX_SOBREPOSICAO, len(anterior), len(seguinte)), MIN_SOBREPOSICAO - 1, -1):
+        if anterior.endswith(seguinte[:tamanho]):
+            return anterior + seguinte[tamanho:]
+    # Sem sobreposição exata (espaços diferentes ou chunks não vizinhos): mantém os dois.
+    return anterior + "\n" + seguinte
+
+def _cortar(texto: str, max_tokens: int) -> str:
+    """ Corta no fim da última frase que cabe no orçamento. """
+    corte = texto[:max_tokens * 4]
+    fim_frase = max(corte.rfind(". "), corte.rfind(".\n"), corte.rfind("\n"))
+    return corte[:fim_frase + 1] if fim_frase > len(corte) // 2 else corte
+
+
+def montar_contexto(docs: list, orcamento_tokens: int = ORCAMENTO_TOKENS_CONTEXTO) -> ContextoEmpacotado:
+    """
+    `docs` vêm por ordem de relevância. Passos: (1) descarta quase duplicados de um chunk
+    mais relevante; (2) agrupa por arquivo e página, ordena cada grupo pela posição no
+    arquivo e une os chunks retirando a sobreposição; (3) preenche o orçamento com os
+    grupos pela ordem do seu chunk mais relevante.
+    """
+    tokens_originais = estimar_tokens(SEPARADOR.join(doc.page_content for doc in docs))
+
+    # 1) quase duplicados (inclui os de PDFs repetidos com outro hash)
+    unicos, vistos = [], []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        if any(_semelhanca(shingles, outro) >= LIMIAR_QUASE_DUPLICADO for outro in vistos):
+            continue
+        unicos.append(doc)
+        vistos.append(shingles)
+
+    # 2) um bloco por (arquivo, página), na ordem do primeiro chunk relevante
+    grupos = {}
+    for doc in unicos:
+        chave = (doc.metadata.get("source"), doc.metadata.get("page"))
+        grupos.setdefault(chave, []).append(doc)
+    blocos = []
+    for chunks in grupos.values():
+        if all(_posicao_no_arquivo(doc) is not None for doc in chunks):
+            chunks = sorted(chunks, key=_posicao_no_arquivo)
+        texto = chunks[0].page_content
+        for doc in chunks[1:]:
+            texto = unir_sem_sobreposicao(texto, doc.page_content)
+        blocos.append(re.sub(r"\n{3,}", "\n\n", texto.strip()))
+
+    # 3) orçamento de tokens
+    selecionados, usados = [], 0
+    for bloco in blocos:
+        restante = orcamento_tokens - usados - (estimar_tokens(SEPARADOR) if selecionados else 0)
+        if estimar_tokens(bloco) > restante:
+            if restante < MIN_TOKENS_BLOCO_CORTADO:
+                break
+            bloco = _cortar(bloco, restante)
+        selecionados.append(bloco)
+        usados = estimar_tokens(SEPARADOR.join(selecionados))
+
+    texto = SEPARADOR.join(selecionados)
+    return ContextoEmpacotado(
+        texto=texto,
+        tokens_originais=tokens_originais,
+        tokens_finais=estimar_tokens(texto),
+        chunks_recebidos=len(docs),
+        chunks_usados=sum(len(chunks) for chunks in list(grupos.values())[:len(selecionados)]),
+        duplicados_removidos=len(docs) - len(unicos),
+    )
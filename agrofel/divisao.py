@@ -0,0 +1,206 @@
+# agrofel/divisao.py
+"""
+Divisão das bulas em secções (pais) e trechos pequenos (filhos), no lugar do
+RecursiveCharacterTextSplitter de 1500 caracteres, que cortava as tabelas de doses e o
+"Modo de Aplicação" a meio da linha:
+- as linhas repetidas em quase todas as páginas de uma bula (endereço da empresa,
+  "Bula – SELECT 240 EC   5") só ficam na primeira, e o texto ilegível do extrator
+  ("/uni0041/uni0042...") sai;
+- cada página é cortada nos títulos de secção (linhas em maiúsculas: "MODO DE APLICAÇÃO",
+  "INSTRUÇÕES DE USO:"); o trecho de uma secção numa página é um pai, e a secção que
+  continua na página seguinte mantém o título;
+- cada pai é dividido em filhos de poucas linhas, sempre em fim de linha, para que as
+  linhas das tabelas cheguem inteiras, com o título da secção à frente.
+Só os filhos são indexados (FAISS, BM25, produtos). Os pais ficam no pais.arrow, servem a
+tabela de doses e substituem os filhos no contexto quando a secção inteira interessa
+(ver BaseConhecimento.expandir_pais).
+"""
+import re
+from collections import Counter
+
+from langchain_core.documents import Document
+
+from agrofel.doses import normalizar_cultura
+
+# Tamanho máximo dos filhos e dos pais, em caracteres
+TAMANHO_FILHO = 1000
+TAMANHO_MAX_PAI = 2400
+# Secções mais curtas do que isto juntam-se à seguinte da mesma página
+TAMANHO_MIN_PAI = 600
+# Uma linha presente em pelo menos esta fração das páginas é cabeçalho ou rodapé
+FRACAO_LINHA_REPETIDA = 0.6
+MIN_PAGINAS_REPETIDA = 3
+# Linhas mais curtas não contam como repetidas ("1", "Soja", "0,35 L/ha" repetem-se nas tabelas)
+MIN_LETRAS_LINHA_REPETIDA = 8
+MIN_CARACTERES_LINHA_REPETIDA = 15
+# Linhas com texto no topo e no fundo de cada página onde procurar cabeçalhos e rodapés
+LINHAS_CABECALHO = 12
+LINHAS_RODAPE = 4
+
+_GLIFO = re.compile(r"/uni[0-9A-Fa-f]{4}")
+_PALAVRA = re.compile(r"[^\W\d_]{3,}")
+
+
+def _chave_linha(linha: str) -> str:
+    """ 'Bula – SELECT 240 EC      5' e '... 6' são a mesma linha. """
+    return re.sub(r"\d+", "#", " ".join(linha.split()))
+
+def _pode_repetir(linhas: list) -> list:
+    """
+    Marca as linhas da página que podem ser cabeçalho ou rodapé: as longas em qualquer lugar
+    e, nas margens da página, também as curtas, como o "UPL" do logótipo ou o número da página.
+    """
+    com_texto = [i for i, linha in enumerate(linhas) if linha.strip()]
+    margens = set(com_texto[:LINHAS_CABECALHO] + com_texto[-LINHAS_RODAPE:])
+    return [
+        i in margens
+        or sum(c.isalpha() for c in linha) >= MIN_LETRAS_LINHA_REPETIDA
+        or len(linha.strip()) >= MIN_CARACTERES_LINHA_REPETIDA
+        for i, linha in enumerate(linhas)
+    ]
+
+def _linhas_repetidas(paginas: list) -> set:
+    """ Chaves das linhas que se repetem em quase todas as páginas da bula. """
+    if len(paginas) < MIN_PAGINAS_REPETIDA:
+        return set()
+    contagem = Counter()
+    for pagina in paginas:
+        linhas = pagina.page_content.splitlines()
+        contagem.update({_chave_linha(linha) for linha, pode in zip(linhas, _pode_repetir(linhas)) if pode and linha.strip()})
+    minimo = max(MIN_PAGINAS_REPETIDA, FRACAO_LINHA_REPETIDA * len(paginas))
+    return {chave for chave, vezes in contagem.items() if vezes >= minimo}
+
+def _ilegivel(linha: str) -> bool:
+    return len(_GLIFO.sub("", linha).strip()) < 0.3 * len(linha.strip())
+
+def e_titulo(linha: str) -> bool:
+    """ 'MODO DE APLICAÇÃO', 'COMPOSIÇÃO:'; não 'SOJA' nem 'EC' (células das tabelas). """
+    linha = linha.strip()
+    letras = [c for c in linha if c.isalpha()]
+    if len(letras) < 4 or len(linha) > 100:
+        return False
+    if sum(c.isupper() for c in letras) / len(letras) < 0.9:
+        return False
+    palavras = _PALAVRA.findall(linha)
+    if not palavras or (len(palavras) == 1 and not linha.endswith(":") and len(letras) < 8):
+        return False
+    return not normalizar_cultura(linha.strip(" :"))
+
+def com_titulo(texto: str, titulo: str) -> str:
+    """ Põe o título da secção à frente do texto, se ele ainda não começa por ele. """
+    if titulo and not " ".join(texto.split()).startswith(titulo):
+        return f"{titulo}\n{texto}"
+    return texto
+
+def _partir_linha(linha: str, tamanho: int) -> list:
+    """ Linhas maiores do que um filho (parágrafos inteiros numa linha) partem-se entre palavras. """
+    partes, atual = [], ""
+    for palavra in linha.split(" "):
+        if atual and len(atual) + len(palavra) + 1 > tamanho:
+            partes.append(atual)
+            atual = palavra
+        else:
+            atual = f"{atual} {palavra}" if atual else palavra
+    return partes + [atual] if atual else partes
+
+def _texto(bloco: list) -> str:
+    return "\n".join(linha for _, linha in bloco).strip()
+
+def _titulo(bloco: list) -> str:
+    """ Título da secção da primeira linha com texto do bloco. """
+    return next((titulo for titulo, linha in bloco if linha.strip()), "")
+
+def _agrupar_linhas(linhas: list, tamanho: int) -> list:
+    """
+    Junta as linhas [(titulo, linha)] em blocos de até `tamanho` caracteres, sem partir
+    linhas. Um último bloco muito curto junta-se ao anterior, para não criar um trecho solto
+    com uma ou duas linhas.
+    """
+    blocos, atual, tamanho_atual = [], [], 0
+    partes = ((t, parte) for t, l in linhas for parte in (_partir_linha(l, tamanho) if len(l) > tamanho else [l]))
+    for titulo, linha in partes:
+        if atual and tamanho_atual + len(linha) + 1 > tamanho:
+            blocos.append(atual)
+            atual, tamanho_atual = [], 0
+        atual.append((titulo, linha))
+        tamanho_atual += len(linha) + 1
+    if atual:
+        if blocos and tamanho_atual < tamanho // 3:
+            blocos[-1] += atual
+        else:
+            blocos.append(atual)
+    return [bloco for bloco in blocos if _texto(bloco)]
+
+
+class DivisorBulas:
+    """ Divide as páginas de uma bula (as do extrair_pdfs_em_paralelo) em pais e filhos. """
+
+    def __init__(self, tamanho_filho: int = TAMANHO_FILHO, tamanho_max_pai: int = TAMANHO_MAX_PAI):
+        self.tamanho_filho = tamanho_filho
+        self.tamanho_max_pai = tamanho_max_pai
+
+    @staticmethod
+    def _linhas(paginas: list) -> list:
+        """ [(pagina, [(titulo, linha)])]: as linhas úteis de cada página, com o título da secção de cada uma. """
+        repetidas, vistas = _linhas_repetidas(paginas), set()
+        resultado, titulo = [], ""
+        for pagina in paginas:
+            linhas, inicio_titulo = [], None
+            originais = pagina.page_content.splitlines()
+            for linha, pode_repetir in zip(originais, _pode_repetir(originais)):
+                linha = linha.rstrip()
+                chave = _chave_linha(linha)
+                if pode_repetir and chave in repetidas:
+                    if chave in vistas:
+                        continue
+                    vistas.add(chave)
+                if linha.strip() and _ilegivel(linha):
+                    continue
+                if e_titulo(linha):
+                    # Títulos em várias linhas ("... PÓS-EMERGÊNCIA DAS PLANTAS" / "DANINHAS") são um só.
+                    inicio_titulo = len(linhas) if inicio_titulo is None else inicio_titulo
+                    anteriores = [l for _, l in linhas[inicio_titulo:]]
+                    titulo = " ".join(" ".join(anteriores + [linha]).split()).strip(" :")
+                    linhas[inicio_titulo:] = [(titulo, l) for l in anteriores]
+                elif linha.strip():
+                    inicio_titulo = None
+                linhas.append((titulo, linha))
+            resultado.append((pagina, linhas))
+        return resultado
+
+    def _blocos_pais(self, linhas: list) -> list:
+        """
+        Um bloco por secção da página; as curtas juntam-se à seguinte (a última da página, à
+        anterior) e as longas partem-se.
+        """
+        seccoes = []
+        for titulo, linha in linhas:
+            if not seccoes or (titulo != seccoes[-1][-1][0] and len(_texto(seccoes[-1])) >= TAMANHO_MIN_PAI):
+                seccoes.append([])
+            seccoes[-1].append((titulo, linha))
+        if len(seccoes) > 1 and len(_texto(seccoes[-1])) < TAMANHO_MIN_PAI:
+            ultima = seccoes.pop()
+            seccoes[-1] += ultima
+        return [bloco for seccao in seccoes for bloco in _agrupar_linhas(seccao, self.tamanho_max_pai)]
+
+    def dividir(self, paginas: list) -> tuple:
+        """
+        Devolve (pais, filhos) como Documents com id. Os filhos são '<sha256>-<n>', com n
+        crescente ao longo do arquivo; cada pai tem o id do seu primeiro filho, e os filhos
+        levam o id do pai em metadata['pai'] e o título da secção em metadata['secao'].
+        """
+        pais, filhos = [], []
+        for pagina, linhas in self._linhas(paginas):
+            sha = pagina.metadata.get("sha256", "")
+            for bloco_pai in self._blocos_pais(linhas):
+                blocos_filhos = _agrupar_linhas(bloco_pai, self.tamanho_filho)
+                id_pai = f"{sha}-{len(filhos)}"
+                pais.append(Document(id=id_pai, page_content=_texto(bloco_pai),
+                                     metadata={**pagina.metadata, "secao": _titulo(bloco_pai), "filhos": len(blocos_filhos)}))
+                # O título à frente diz à busca de que secção vem uma linha solta da tabela.
+                filhos += [
+                    Document(id=f"{sha}-{len(filhos) + i}", page_content=com_titulo(_texto(bloco), _titulo(bloco)),
+                             metadata={**pagina.metadata, "secao": _titulo(bloco), "pai": id_pai})
+                    for i, bloco in enumerate(blocos_filhos)
+                ]
+        return pais, filhos
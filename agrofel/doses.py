@@ -0,0 +1,383 @@
+# agrofel/doses.py
+"""
+Tabela estruturada produto × cultura × alvo × dose, extraída das tabelas de
+recomendação das bulas durante a ingestão e gravada em SQLite. Perguntas de dose
+("dose de GLYPHOTAL para buva na soja") são respondidas por consulta indexada, sem
+busca vetorial nem LLM.
+
+O PyPDFLoader achata as tabelas: as células chegam como texto corrido, por ordem de
+escrita no PDF. O parser trata a região da tabela como uma sequência de eventos
+(cultura, planta daninha pelo nome científico, dose, volume de calda) e associa a cada
+alvo a dose da mesma linha ou, em células agrupadas, a do grupo anterior.
+"""
+import os
+import re
+import sqlite3
+
+from agrofel import roteador
+from agrofel.contexto import unir_sem_sobreposicao
+from agrofel.produtos import normalizar_nome
+
+ARQUIVO_DOSES = "doses.sqlite"
+
+CULTURAS = (
+    "alface", "algodao", "amendoim", "arroz", "aveia", "banana", "batata", "cacau", "cafe",
+    "cana de acucar", "cevada", "citros", "citrus", "coco", "eucalipto", "feijao", "fumo",
+    "girassol", "maca", "mamao", "mandioca", "milho", "nectarina", "pastagem", "pastagens",
+    "pessego", "pinus", "repolho", "seringueira", "soja", "sorgo", "tomate", "trigo", "uva",
+)
+_SINONIMOS_CULTURA = {"citrus": "citros", "pastagens": "pastagem", "cana": "cana de acucar"}
+
+_NUM = r"\d+(?:,\d+)?"
+_INTERVALO_NUM = rf"({_NUM})(?:\s*(?:a|–|-|até)\s*({_NUM}))?"
+_DOSE_COM_UNIDADE = re.compile(rf"{_INTERVALO_NUM}\s*(L|mL|ml|kg|Kg|g)\s*(?:p\.?\s*c\.?\s*)?/\s*ha")
+# Só com a unidade no cabeçalho: exige vírgula decimal ou intervalo, para não confundir com "1 aplicação"
+_DOSE_NUA = re.compile(
+    rf"(?<![\d,(])((?:\d+,\d+)(?:\s*(?:a|–|-)\s*\d+(?:,\d+)?)?|\d+\s*(?:a|–|-)\s*\d+,\d+)"
+    r"(?!\s*(?:[\d%]|dias|L\b|litros|g\s*i\.?a|kg\s*i\.?a|folhas|cm|aplica))"
+)
+_VOLUME = re.compile(rf"{_INTERVALO_NUM}\s*(?:L|litros)(?:\s*de\s*calda)?\s*/\s*ha", re.IGNORECASE)
+_VOLUME_TERRESTRE = re.compile(rf"(Terrestre|A[ée]rea)s?\s*:?\s*{_INTERVALO_NUM}(?!\s*,)", re.IGNORECASE)
+_UNIDADE_CABECALHO = re.compile(r"\(\s*(L|mL|ml|kg|Kg|g)\s*(?:p\.?\s*c\.?\s*)?/\s*ha\s*\)")
+_CABECALHO = re.compile(r"(?i)\b(cultura|nome\s+comum|folhas?\s+(?:estreitas?|largas?))\b.{0,300}?\bdoses?\b", re.DOTALL)
+_FIM_TABELA = re.compile(
+    r"(?i)\b(OBS\s*:|Observa[çc][õo]es|[ÉE]poca e intervalo|MODO DE APLICA[ÇC][ÃA]O|"
+    r"INTERVALO DE SEGURAN[ÇC]A|LIMITA[ÇC][ÕO]ES DE USO|INFORMA[ÇC][ÕO]ES SOBRE)"
+)
+# Género + epíteto; o género não pode ser uma palavra portuguesa comum no início de frase
+_BINOMIO = re.compile(r"\(?\b([A-Z][a-z]{3,})\)?\s+\(?([a-z]{3,}|spp?\.)\)?(?:\s*\(\*+\))?")
+_NAO_GENEROS = frozenset(
+    "Aplicar Aplicação Utilizar Para Quando Após Antes Complementar Número Terrestre Terrestres Aérea "
+    "Equipamentos Pulverizador Dose Doses Volume Estádio Cultura Culturas Plantas Planta Folha Folhas Nome "
+    "Produto Realizar Recomenda Controle Obs Época Máximo Intervalo Pulverização Calda Usar".split()
+)
+_NAO_EPITETOS = frozenset(
+    "que quando para com das dos nas nos plantas planta daninhas infestantes controle aplicar aplicação "
+    "estadio folhas dose doses comum cientifico produto comercial calda volume maximo ate".split()
+)
+_PALAVRAS_CABECALHO = frozenset(
+    "nome comum cientifico folha folhas estreita estreitas larga largas plantas infestantes daninhas "
+    "controladas anuais perenes dose produto comercial aplicacoes aplicacao equipamentos terrestres "
+    "aereos estadio cultura culturas numero maximo de volume calda uma pre pos emergencia".split()
+)
+_GENERICOS = frozenset("capim erva falso falsa picao carrapicho corda".split())
+_RE_INTERVALO_DIAS = re.compile(r"(?i)intervalos?\s+(?:de|entre)[^.]{0,40}?(\d+)\s*(?:(?:a|–|-)\s*(\d+)\s*)?dias")
+_RE_NUM_APLICACOES = re.compile(
+    r"(?i)(?:n[úu]mero\s+(?:m[áa]ximo\s+)?de\s+aplica[çc][õo]es\s*:?\s*(\d+)|(\d+)\s*(?:\(\w+\)\s*)?aplica[çc](?:[ãa]o|[õo]es)|(única)\s+aplica[çc][ãa]o)"
+)
+
+
+def _numero(texto: str) -> float:
+    return float(texto.replace(",", "."))
+
+def _texto_intervalo(minimo: str, maximo: str) -> str:
+    return f"{minimo} a {maximo}" if maximo else minimo
+
+def normalizar_cultura(texto: str):
+    """ 'Cana-de-açúcar' -> 'cana de acucar'; None se não for uma cultura conhecida. """
+    normalizado = normalizar_nome(texto)
+    normalizado = _SINONIMOS_CULTURA.get(normalizado, normalizado)
+    return normalizado if normalizado in CULTURAS else None
+
+def nomes_da_cultura(cultura: str) -> list:
+    """ 'citros' -> ['citros', 'citrus']: as formas com que culturas_mencionadas a reconhece. """
+    nomes = [c for c in CULTURAS if _SINONIMOS_CULTURA.get(c, c) == cultura]
+    return nomes + [s for s, c in _SINONIMOS_CULTURA.items() if c == cultura and s not in nomes]
+
+def culturas_mencionadas(texto: str) -> list:
+    normalizado = f" {normalizar_nome(texto)} "
+    encontradas = [c for c in CULTURAS if f" {c} " in normalizado]
+    if " cana " in normalizado:
+        encontradas.append("cana de acucar")
+    return list(dict.fromkeys(_SINONIMOS_CULTURA.get(c, c) for c in encontradas))
+
+def _nome_comum(trecho: str) -> str:
+    """ Texto entre o evento anterior e o nome científico, sem as palavras do cabeçalho. """
+    trecho = re.split(r"[\d():;%/]|\bha\b", trecho)[-1]
+    palavras = trecho.replace("\n", " ").split()
+    # O nome começa na última maiúscula que segue texto corrido ("... da cultura Capim-branco"),
+    # mas "Picão-branco ou Fazendeiro" e "Buva, voadeira" continuam inteiros.
+    for i in range(len(palavras) - 1, 0, -1):
+        anterior = palavras[i - 1]
+        if palavras[i][:1].isupper() and anterior[:1].islower() and not anterior.endswith(",") and anterior not in ("ou", "e"):
+            palavras = palavras[i:]
+            break
+    while palavras and normalizar_nome(palavras[0]) in _PALAVRAS_CABECALHO | {"", "e", "ou", "a"}:
+        palavras = palavras[1:]
+    nome = " ".join(palavras[-6:]).strip(" ,-–")
+    return re.sub(r"\s*-\s*", "-", nome)
+
+
+def _eventos(texto: str, unidade_cabecalho: str) -> list:
+    """ [(posicao, tipo, dados)] por ordem de aparição na região da tabela. """
+    eventos, ocupados = [], []
+
+    def livre(inicio, fim):
+        return all(fim <= a or inicio >= b for a, b in ocupados)
+
+    for m in _VOLUME_TERRESTRE.finditer(texto):
+        ocupados.append(m.span())
+        eventos.append((m.start(), "volume", f"{m.group(1).capitalize()}: {_texto_intervalo(m.group(2), m.group(3))} L/ha"))
+    for m in _VOLUME.finditer(texto):
+        if livre(*m.span()) and _numero(m.group(1)) >= 20:
+            ocupados.append(m.span())
+            eventos.append((m.start(), "volume", f"{_texto_intervalo(m.group(1), m.group(2))} L/ha"))
+    for m in _DOSE_COM_UNIDADE.finditer(texto):
+        if livre(*m.span()) and not (m.group(3) == "L" and _numero(m.group(1)) >= 20):
+            ocupados.append(m.span())
+            eventos.append((m.start(), "dose", (m.group(1), m.group(2), f"{m.group(3)}/ha")))
+    if unidade_cabecalho:
+        for m in _DOSE_NUA.finditer(texto):
+            if livre(*m.span()):
+                partes = re.split(r"\s*(?:a|–|-)\s*", m.group(1))
+                ocupados.append(m.span())
+                eventos.append((m.start(), "dose", (partes[0], partes[1] if len(partes) > 1 else None, unidade_cabecalho)))
+    for m in _BINOMIO.finditer(texto):
+        genero, epiteto = m.group(1), m.group(2)
+        if genero in _NAO_GENEROS or normalizar_cultura(genero) or epiteto in _NAO_EPITETOS or not livre(*m.span()):
+            continue
+        eventos.append((m.start(), "alvo", (f"{genero} {epiteto}", m.end())))
+    for m in re.finditer(r"[^\n]+", texto):
+        linha = m.group(0).strip()
+        primeira = re.split(r"[\s,]+", linha)[0] if linha else ""
+        # "SOJA", "Arroz", "ALGODÃO" ou "Cana-de-açúcar" numa linha sem vírgulas (não a lista de culturas)
+        if "," in linha or not primeira or linha.endswith("-"):
+            continue
+        cultura = normalizar_cultura(linha) or normalizar_cultura(primeira)
+        if not cultura:
+            continue
+        palavras = linha.split()
+        sozinha = (linha.isupper() or primeira.isupper() or len(palavras) <= 2) and not _BINOMIO.search(linha)
+        # "Cana-de-açúcar Amendoim-bravo, ... Euphorbia heterophylla": cultura seguida do primeiro alvo;
+        # "Soja voluntária Glycine max" é um alvo.
+        seguida_de_alvo = len(palavras) > 1 and palavras[1][:1].isupper() and normalizar_cultura(primeira)
+        if sozinha or seguida_de_alvo:
+            inicio = m.start() + m.group(0).index(primeira)
+            eventos.append((inicio, "cultura", (cultura, inicio + (len(linha) if sozinha else len(primeira)))))
+    return sorted(eventos, key=lambda e: e[0])
+
+def _linhas_da_regiao(texto: str, unidade: str, cultura_inicial, contexto_seguinte: str) -> tuple:
+    """ Converte os eventos de uma região de tabela em linhas. Devolve (linhas, cultura_final). """
+    eventos = _eventos(texto, unidade)
+    linhas, segmento, cultura, inicio = [], [], cultura_inicial, 0
+    segmentos = []
+    for evento in eventos:
+        if evento[1] == "cultura":
+            if segmento:
+                segmentos.append((cultura, inicio, segmento))
+            (cultura, inicio), segmento = evento[2], []
+        else:
+            segmento.append(evento)
+    if segmento:
+        segmentos.append((cultura, inicio, segmento))
+
+    intervalo_geral = _RE_INTERVALO_DIAS.search(contexto_seguinte)
+    for cultura_segmento, inicio_segmento, eventos_segmento in segmentos:
+        doses = [(i, e) for i, e in enumerate(eventos_segmento) if e[1] == "dose"]
+        volumes = [e for e in eventos_segmento if e[1] == "volume"]
+        fim_segmento = eventos_segmento[-1][0] + 200
+        trecho_segmento = texto[inicio_segmento:fim_segmento]
+        intervalo = _RE_INTERVALO_DIAS.search(trecho_segmento) or intervalo_geral
+        aplicacoes = _RE_NUM_APLICACOES.search(trecho_segmento) or _RE_NUM_APLICACOES.search(contexto_seguinte)
+        fim_anterior = inicio_segmento
+        for i, evento in enumerate(eventos_segmento):
+            if evento[1] != "alvo":
+                if evento[1] in ("dose", "volume"):
+                    fim_anterior = evento[0]
+                continue
+            nome_cientifico, fim_alvo = evento[2]
+            nome = _nome_comum(texto[fim_anterior:evento[0]])
+            fim_anterior = fim_alvo
+            if not doses:
+                continue
+            # Dose na mesma linha da tabela (antes do próximo alvo); senão, a do grupo anterior.
+            proximo_alvo = next((j for j in range(i + 1, len(eventos_segmento)) if eventos_segmento[j][1] == "alvo"), len(eventos_segmento))
+            mesma_linha = [e for j, e in doses if i < j < proximo_alvo]
+            anteriores = [e for j, e in doses if j < i]
+            dose = (mesma_linha or anteriores[-1:] or [doses[0][1]])[0]
+            volume = next((v for v in reversed(volumes) if v[0] < evento[0]), volumes[0] if volumes else None)
+            minimo, maximo, unidade_dose = dose[2]
+            linhas.append({
+                "cultura": cultura_segmento or "",
+                "alvo": (nome or nome_cientifico).strip(),
+                "nome_cientifico": nome_cientifico,
+                "dose": f"{_texto_intervalo(minimo, maximo)} {unidade_dose}",
+                "dose_min": _numero(minimo),
+                "dose_max": _numero(maximo or minimo),
+                "unidade": unidade_dose,
+                "volume_calda": volume[2] if volume else None,
+                "num_aplicacoes": _num_aplicacoes(aplicacoes),
+                "intervalo": f"{_texto_intervalo(intervalo.group(1), intervalo.group(2))} dias" if intervalo else None,
+            })
+    return linhas, cultura
+
+def _num_aplicacoes(correspondencia):
+    if correspondencia is None:
+        return None
+    if correspondencia.group(3):
+        return 1
+    return int(correspondencia.group(1) or correspondencia.group(2))
+
+def extrair_recomendacoes(paginas: list) -> list:
+    """
+    `paginas` é [(numero_pagina, texto)] de uma bula, por ordem. Uma tabela que continua na
+    página seguinte mantém a cultura em curso. Devolve dicts com a página de cada linha.
+    """
+    linhas, em_tabela, unidade, cultura = [], False, None, None
+    for numero, texto in paginas:
+        posicao = 0
+        while posicao < len(texto):
+            if not em_tabela:
+                cabecalho = _CABECALHO.search(texto, posicao)
+                if cabecalho is None:
+                    break
+                unidade_encontrada = _UNIDADE_CABECALHO.search(texto, cabecalho.start(), cabecalho.end() + 200)
+                unidade = f"{unidade_encontrada.group(1)}/ha" if unidade_encontrada else None
+                em_tabela, cultura, posicao = True, None, cabecalho.end()
+            fim = _FIM_TABELA.search(texto, posicao)
+            fim_regiao = fim.start() if fim else len(texto)
+            novas, cultura = _linhas_da_regiao(texto[posicao:fim_regiao], unidade, cultura, texto[fim_regiao:fim_regiao + 1500])
+            linhas += [dict(linha, pagina=numero) for linha in novas]
+            if fim is None:
+                break
+            em_tabela, posicao = False, fim.end()
+    return linhas
+
+
+def paginas_dos_chunks(metadatas: list, textos: list) -> dict:
+    """ Reconstrói {arquivo: [(pagina, texto)]} a partir dos chunks, unindo a sobreposição do splitter. """
+    paginas = {}
+    for metadata, texto in zip(metadatas, textos):
+        arquivo, pagina = metadata.get("source", ""), metadata.get("page", 0)
+        por_pagina = paginas.setdefault(arquivo, {})
+        por_pagina[pagina] = unir_sem_sobreposicao(por_pagina[pagina], texto) if pagina in por_pagina else texto
+    return {arquivo: sorted(por_pagina.items()) for arquivo, por_pagina in paginas.items()}
+
+def gravar_tabela_doses(caminho: str, metadatas: list, textos: list, indice_produtos) -> int:
+    """ Extrai as tabelas de todas as bulas com produto conhecido e grava-as em SQLite. Devolve o nº de linhas. """
+    produto_do_arquivo = {
+        arquivo: (chave, dados["nome"])
+        for chave, dados in (indice_produtos.produtos.items() if indice_produtos is not None else [])
+        for arquivo in dados["arquivos"]
+    }
+    registos = {}
+    for arquivo, paginas in paginas_dos_chunks(metadatas, textos).items():
+        if arquivo not in produto_do_arquivo:
+            continue
+        chave, nome = produto_do_arquivo[arquivo]
+        for linha in extrair_recomendacoes(paginas):
+            # Bula e rótulo do mesmo produto repetem as mesmas linhas.
+            identificador = (chave, linha["cultura"], normalizar_nome(linha["alvo"]), linha["dose"])
+            registos.setdefault(identificador, dict(linha, produto=nome, produto_chave=chave, arquivo=os.path.basename(arquivo)))
+
+    if os.path.exists(caminho):
+        os.remove(caminho)
+    conexao = sqlite3.connect(caminho)
+    conexao.execute("""
+        CREATE TABLE recomendacoes (
+            produto TEXT, produto_chave TEXT, cultura TEXT, alvo TEXT, alvo_normalizado TEXT,
+            nome_cientifico TEXT, dose TEXT, dose_min REAL, dose_max REAL, unidade TEXT,
+            volume_calda TEXT, num_aplicacoes INTEGER, intervalo TEXT, arquivo TEXT, pagina INTEGER
+        )""")
+    conexao.executemany(
+        "INSERT INTO recomendacoes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(r["produto"], r["produto_chave"], r["cultura"], r["alvo"], normalizar_nome(r["alvo"]), r["nome_cientifico"],
+          r["dose"], r["dose_min"], r["dose_max"], r["unidade"], r["volume_calda"], r["num_aplicacoes"],
+          r["intervalo"], r["arquivo"], r["pagina"]) for r in registos.values()],
+    )
+    conexao.execute("CREATE INDEX idx_produto_cultura ON recomendacoes (produto_chave, cultura)")
+    conexao.execute("CREATE INDEX idx_alvo ON recomendacoes (alvo_normalizado)")
+    conexao.commit()
+    conexao.close()
+    return len(registos)
+
+
+# Temas do roteador que não identificam uma planta daninha
+_TEMAS_GERAIS = {
+    "daninha", "daninhas", "mato", "praga", "pragas", "doenca", "inseto", "herbicida", "inseticida",
+    "fungicida", "dessecacao", "dessecar", "pre emergencia", "pos emergencia",
+}
+
+
+class TabelaDoses:
+    """ Consulta, só de leitura, da tabela gravada por gravar_tabela_doses. """
+
+    def __init__(self, caminho: str):
+        self._conexao = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True, check_same_thread=False)
+        self._conexao.row_factory = sqlite3.Row
+
+    def linhas_do_produto(self, chave_produto: str, cultura: str = None) -> list:
+        if cultura:
+            cursor = self._conexao.execute(
+                "SELECT * FROM recomendacoes WHERE produto_chave = ? AND cultura IN (?, '') ORDER BY cultura DESC, rowid",
+                (chave_produto, cultura),
+            )
+        else:
+            cursor = self._conexao.execute("SELECT * FROM recomendacoes WHERE produto_chave = ? ORDER BY rowid", (chave_produto,))
+        return [dict(linha) for linha in cursor]
+
+    def consultar(self, chave_produto: str, pergunta: str) -> list:
+        """
+        Linhas do produto para a cultura e o alvo citados na pergunta. Sem alvo na pergunta,
+        devolve todas as linhas da cultura; sem cultura, as de todas as culturas. Um alvo
+        citado que não está na tabela não devolve nada (a pergunta segue para a busca nas bulas).
+        """
+        culturas = culturas_mencionadas(pergunta)
+        texto = f" {normalizar_nome(pergunta)} "
+        alvo_citado = any(
+            not normalizar_cultura(termo) and termo not in _TEMAS_GERAIS for termo in roteador.termos_agronomicos(pergunta)
+        )
+        linhas = self._filtrar_alvo(self.linhas_do_produto(chave_produto, culturas[0] if culturas else None), texto,
+                                    so_com_alvo=alvo_citado)
+        if culturas and not linhas:
+            # Bulas sem coluna de cultura (ex.: glifosato) ficam associadas à cultura errada ou a nenhuma.
+            linhas = self._filtrar_alvo(self.linhas_do_produto(chave_produto), texto, so_com_alvo=True)
+        return linhas
+
+    @staticmethod
+    def _filtrar_alvo(linhas: list, texto: str, so_com_alvo: bool = False) -> list:
+        cientificos = [l for l in linhas if f" {normalizar_nome(l['nome_cientifico'])} " in texto]
+        if cientificos:
+            return cientificos
+        por_nome = [
+            l for l in linhas
+            if any(f" {nome} " in texto for nome in nomes_do_alvo(l["alvo"]))
+        ]
+        if por_nome:
+            return por_nome
+        # "caruru" encontra "Caruru-roxo", mas "capim" sozinho é genérico demais.
+        por_prefixo = [
+            l for l in linhas
+            if any(n.split()[0] not in _GENERICOS and f" {n.split()[0]} " in texto for n in nomes_do_alvo(l["alvo"]) if n)
+        ]
+        return por_prefixo or ([] if so_com_alvo else linhas)
+
+    def pares_cultura_alvo(self) -> list:
+        """
+        (cultura, alvo) distintos com cultura conhecida, dos mais recomendados (mais produtos)
+        para os menos, com o nome do alvo como aparece na bula e as bulas que o recomendam.
+        """
+        cursor = self._conexao.execute("""
+            SELECT cultura, alvo_normalizado, MIN(alvo) AS alvo, COUNT(DISTINCT produto_chave) AS produtos,
+                   GROUP_CONCAT(DISTINCT arquivo) AS arquivos
+            FROM recomendacoes WHERE cultura != '' AND alvo_normalizado != ''
+            GROUP BY cultura, alvo_normalizado ORDER BY produtos DESC, cultura, alvo_normalizado""")
+        return [{**dict(linha), "arquivos": sorted(linha["arquivos"].split(","))} for linha in cursor]
+
+    def arquivos_do_par(self, cultura: str, alvo_normalizado: str) -> list:
+        cursor = self._conexao.execute(
+            "SELECT DISTINCT arquivo FROM recomendacoes WHERE cultura = ? AND alvo_normalizado = ?",
+            (cultura, alvo_normalizado),
+        )
+        return sorted(linha["arquivo"] for linha in cursor)
+
+    def fechar(self):
+        self._conexao.close()
+
+def nomes_do_alvo(alvo: str) -> list:
+    """ 'Picão-branco ou Fazendeiro' -> ['picao branco', 'fazendeiro']. """
+    return [normalizar_nome(n) for n in re.split(r",|\bou\b|\be\b", alvo) if normalizar_nome(n)]
+
+def carregar_tabela_doses(pasta: str):
+    caminho = os.path.join(pasta, ARQUIVO_DOSES)
+    return TabelaDoses(caminho) if os.path.exists(caminho) else None
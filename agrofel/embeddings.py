@@ -0,0 +1,310 @@
+# agrofel/embeddings.py
+"""
+Etapa de embeddings do pipeline: escolha do backend (Gemini ou local, via
+sentence-transformers), envio em lotes com concorrência limitada, novas tentativas
+com backoff exponencial e checkpoints para retomar uma construção interrompida.
+Inclui também o cache de embeddings partilhado pela ingestão e pelo app.py.
+"""
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Backends disponíveis e o modelo usado por omissão em cada um
+MODELOS_PADRAO = {
+    "google": "models/embedding-001",
+    "local": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+    # Substituto sem rede nem modelo em disco, para o banco de avaliação (ver agrofel.avaliacao)
+    "deterministico": "hash-384",
+}
+
+
+def criar_modelo_embeddings(backend: str = "google", modelo: str = None):
+    """
+    Instancia o modelo de embeddings do backend pedido. O backend 'local' corre na CPU
+    com sentence-transformers e não precisa de rede depois de o modelo estar em disco.
+    """
+    if backend not in MODELOS_PADRAO:
+        raise ValueError(f"Backend de embeddings desconhecido: '{backend}'. Use um de {list(MODELOS_PADRAO)}.")
+    modelo = modelo or MODELOS_PADRAO[backend]
+    if backend == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=modelo)
+    if backend == "deterministico":
+        from agrofel.avaliacao import EmbeddingsDeterministicos
+        return EmbeddingsDeterministicos(int(modelo.rsplit("-", 1)[1]))
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=modelo, encode_kwargs={"normalize_embeddings": True})
+
+def config_embeddings_do_indice(caminho_index: str) -> dict:
+    """
+    Lê do manifesto do índice qual backend e modelo geraram os vetores, para que as
+    consultas usem o mesmo espaço vetorial. Índices antigos, sem essa informação, são do Gemini.
+    """
+    caminho_manifesto = os.path.join(caminho_index, "manifesto.json")
+    if os.path.exists(caminho_manifesto):
+        with open(caminho_manifesto, "r", encoding="utf-8") as f:
+            config = json.load(f).get("embeddings")
+        if config:
+            return config
+    return {"backend": "google", "modelo": MODELOS_PADRAO["google"]}
+
+
+class CacheEmbeddings:
+    """
+    Cache persistente de embeddings em SQLite, indexado por (modelo, tipo, hash do texto).
+    O tipo separa vetores de consulta e de documento, que o Gemini calcula de forma
+    diferente. Quando passa de `max_entradas`, as entradas usadas há mais tempo são removidas.
+    """
+
+    def __init__(self, caminho: str, max_entradas: int = 200_000):
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._insercoes_desde_limpeza = 0
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False, timeout=30)
+        # WAL permite que vários processos do Streamlit leiam enquanto outro escreve.
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (chave TEXT PRIMARY KEY, vetor BLOB, ultimo_acesso REAL)"
+        )
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_acesso ON embeddings (ultimo_acesso)")
+        self._conexao.commit()
+
+    @staticmethod
+    def chave(modelo: str, tipo: str, texto: str) -> str:
+        return hashlib.sha256(f"{modelo}\0{tipo}\0{texto}".encode("utf-8")).hexdigest()
+
+    def obter(self, chaves: list) -> dict:
+        """ Devolve {chave: vetor} das chaves presentes e renova o seu último acesso. """
+        if not chaves:
+            return {}
+        encontrados = {}
+        with self._lock:
+            for inicio in range(0, len(chaves), 500):
+                parte = chaves[inicio:inicio + 500]
+                marcadores = ",".join("?" * len(parte))
+                for chave, vetor in self._conexao.execute(
+                    f"SELECT chave, vetor FROM embeddings WHERE chave IN ({marcadores})", parte
+                ):
+                    encontrados[chave] = np.frombuffer(vetor, dtype=np.float32).tolist()
+            if encontrados:
+                agora = time.time()
+                self._conexao.executemany(
+                    "UPDATE embeddings SET ultimo_acesso = ? WHERE chave = ?", [(agora, c) for c in encontrados]
+                )
+                self._conexao.commit()
+        return encontrados
+
+    def guardar(self, itens: dict):
+        """ Grava {chave: vetor} e, de tempos a tempos, aplica o limite de tamanho. """
+        if not itens:
+            return
+        agora = time.time()
+        with self._lock:
+            self._conexao.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [(c, np.asarray(v, dtype=np.float32).tobytes(), agora) for c, v in itens.items()],
+            )
+            self._insercoes_desde_limpeza += len(itens)
+            if self._insercoes_desde_limpeza >= 1000:
+                self._aplicar_limite()
+            self._conexao.commit()
+
+    def _aplicar_limite(self):
+        self._insercoes_desde_limpeza = 0
+        (total,) = self._conexao.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if total > self.max_entradas:
+            self._conexao.execute(
+                "DELETE FROM embeddings WHERE chave IN "
+                "(SELECT chave FROM embeddings ORDER BY ultimo_acesso LIMIT ?)", (total - self.max_entradas,)
+            )
+
+
+class EmbeddingsComCache(Embeddings):
+    """
+    Envolve um modelo de embeddings do LangChain com um LRU em memória (para as consultas
+    mais repetidas, como "capim-amargoso na soja") à frente do CacheEmbeddings em disco.
+    Só os textos que faltam nos dois níveis chegam ao modelo.
+    """
+
+    def __init__(self, modelo, nome_modelo: str, cache: CacheEmbeddings, max_entradas_memoria: int = 1024):
+        self.modelo = modelo
+        self.nome_modelo = nome_modelo
+        self.cache = cache
+        self.max_entradas_memoria = max_entradas_memoria
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos_memoria = 0
+        self.acertos_disco = 0
+        self.falhas = 0
+
+    def _obter_da_memoria(self, chave: str):
+        with self._lock:
+            vetor = self._memoria.get(chave)
+            if vetor is not None:
+                self._memoria.move_to_end(chave)
+            return vetor
+
+    def _guardar_na_memoria(self, chave: str, vetor: list):
+        with self._lock:
+            self._memoria[chave] = vetor
+            self._memoria.move_to_end(chave)
+            while len(self._memoria) > self.max_entradas_memoria:
+                self._memoria.popitem(last=False)
+
+    def _incorporar(self, textos: list, tipo: str, calcular) -> list:
+        chaves = [CacheEmbeddings.chave(self.nome_modelo, tipo, texto) for texto in textos]
+        vetores = {}
+        for chave in chaves:
+            vetor = self._obter_da_memoria(chave)
+            if vetor is not None:
+                vetores[chave] = vetor
+                self.acertos_memoria += 1
+
+        do_disco = self.cache.obter([c for c in dict.fromkeys(chaves) if c not in vetores])
+        self.acertos_disco += len(do_disco)
+        vetores.update(do_disco)
+
+        faltam = {c: t for c, t in zip(chaves, textos) if c not in vetores}
+        if faltam:
+            self.falhas += len(faltam)
+            novos = dict(zip(faltam, calcular(list(faltam.values()))))
+            self.cache.guardar(novos)
+            vetores.update(novos)
+
+        for chave in dict.fromkeys(chaves):
+            self._guardar_na_memoria(chave, vetores[chave])
+        return [vetores[chave] for chave in chaves]
+
+    def embed_documents(self, texts: list) -> list:
+        return self._incorporar(texts, "documento", self.modelo.embed_documents)
+
+    def embed_query(self, text: str) -> list:
+        # Espaços extras não mudam a pergunta e não devem causar uma falha no cache.
+        texto = " ".join(text.split())
+        return self._incorporar([texto], "consulta", lambda textos: [self.modelo.embed_query(textos[0])])[0]
+
+    def estatisticas(self) -> dict:
+        return {"acertos_memoria": self.acertos_memoria, "acertos_disco": self.acertos_disco, "falhas": self.falhas}
+
+
+class CheckpointEmbeddings:
+    """
+    Guarda em SQLite os vetores já calculados durante uma construção, por id de chunk.
+    Se a construção for interrompida, a próxima execução só calcula o que falta.
+    """
+
+    def __init__(self, caminho: str, modelo: str):
+        self.modelo = modelo
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS vetores ("
+            "modelo TEXT, id TEXT, hash_texto TEXT, vetor BLOB, PRIMARY KEY (modelo, id))"
+        )
+        self._conexao.commit()
+
+    def obter(self, ids: list, hashes: list) -> dict:
+        """ Devolve {id: vetor} dos ids já calculados com o mesmo texto. """
+        encontrados = {}
+        with self._lock:
+            for id_chunk, hash_texto in zip(ids, hashes):
+                linha = self._conexao.execute(
+                    "SELECT hash_texto, vetor FROM vetores WHERE modelo = ? AND id = ?", (self.modelo, id_chunk)
+                ).fetchone()
+                if linha and linha[0] == hash_texto:
+                    encontrados[id_chunk] = np.frombuffer(linha[1], dtype=np.float32).tolist()
+        return encontrados
+
+    def guardar(self, ids: list, hashes: list, vetores: list):
+        with self._lock:
+            self._conexao.executemany(
+                "INSERT OR REPLACE INTO vetores VALUES (?, ?, ?, ?)",
+                [(self.modelo, i, h, np.asarray(v, dtype=np.float32).tobytes()) for i, h, v in zip(ids, hashes, vetores)],
+            )
+            self._conexao.commit()
+
+    def limpar(self):
+        """ Apaga o checkpoint depois de o índice ter sido gravado com sucesso. """
+        with self._lock:
+            self._conexao.execute("DELETE FROM vetores WHERE modelo = ?", (self.modelo,))
+            self._conexao.commit()
+
+    def fechar(self):
+        self._conexao.close()
+
+
+class EtapaEmbeddings:
+    """
+    Calcula os embeddings de muitos textos em lotes de `tamanho_lote`, com até
+    `max_concorrencia` pedidos simultâneos ao backend. Cada lote é tentado até
+    `max_tentativas` vezes, com espera exponencial (e algum jitter) entre tentativas,
+    e é gravado no checkpoint assim que fica pronto.
+    """
+
+    def __init__(self, modelo, tamanho_lote: int = 64, max_concorrencia: int = 4,
+                 max_tentativas: int = 6, espera_inicial: float = 2.0, checkpoint: CheckpointEmbeddings = None):
+        self.modelo = modelo
+        self.tamanho_lote = tamanho_lote
+        self.max_concorrencia = max_concorrencia
+        self.max_tentativas = max_tentativas
+        self.espera_inicial = espera_inicial
+        self.checkpoint = checkpoint
+        self.total_calculados = 0
+        self.total_reaproveitados = 0
+        self.tempo_total = 0.0
+
+    def _incorporar_com_tentativas(self, textos: list) -> list:
+        for tentativa in range(1, self.max_tentativas + 1):
+            try:
+                return self.modelo.embed_documents(textos)
+            except Exception as e:
+                if tentativa == self.max_tentativas:
+                    raise
+                espera = self.espera_inicial * 2 ** (tentativa - 1) * (1 + random.random() * 0.25)
+                print(f"AVISO: falha no lote de embeddings ({e}). Nova tentativa em {espera:.1f}s...")
+                time.sleep(espera)
+
+    def _processar_lote(self, textos: list, ids: list, hashes: list) -> list:
+        vetores = self._incorporar_com_tentativas(textos)
+        if self.checkpoint is not None:
+            self.checkpoint.guardar(ids, hashes, vetores)
+        return vetores
+
+    def incorporar(self, textos: list, ids: list) -> list:
+        """ Devolve os vetores dos textos, na mesma ordem, reaproveitando o checkpoint quando possível. """
+        inicio = time.time()
+        hashes = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in textos]
+        vetores = {}
+        if self.checkpoint is not None:
+            vetores = self.checkpoint.obter(ids, hashes)
+        self.total_reaproveitados += len(vetores)
+
+        faltam = [i for i, id_chunk in enumerate(ids) if id_chunk not in vetores]
+        lotes = [faltam[i:i + self.tamanho_lote] for i in range(0, len(faltam), self.tamanho_lote)]
+        with ThreadPoolExecutor(max_workers=self.max_concorrencia) as pool:
+            futuros = [
+                (lote, pool.submit(self._processar_lote, [textos[i] for i in lote],
+                                   [ids[i] for i in lote], [hashes[i] for i in lote]))
+                for lote in lotes
+            ]
+            for lote, futuro in futuros:
+                for i, vetor in zip(lote, futuro.result()):
+                    vetores[ids[i]] = vetor
+        self.total_calculados += len(faltam)
+        self.tempo_total += time.time() - inicio
+        return [vetores[id_chunk] for id_chunk in ids]
+
+    def resumo(self) -> str:
+        """ Linha de resumo com a vazão da etapa, útil para comparar backends. """
+        vazao = self.total_calculados / self.tempo_total if self.tempo_total else 0.0
+        return (f"{self.total_calculados} embeddings calculados, {self.total_reaproveitados} retomados do checkpoint, "
+                f"{round(self.tempo_total, 2)}s ({round(vazao, 1)} chunks/s).")
@@ -0,0 +1,129 @@
+# agrofel/historico.py
+"""
+Histórico da conversa para o prompt do roteador, com tamanho limitado. As últimas
+TURNOS_LITERAIS trocas entram como foram escritas; as anteriores são resumidas à medida
+que saem da janela (produtos citados, temas agronômicos e perguntas feitas), sem chamar
+o LLM e sem voltar a percorrer a conversa inteira. O produto em discussão fica sempre
+no topo, para que "esse produto" continue a ser resolvido numa conversa longa.
+"""
+import math
+
+from agrofel import roteador
+
+TURNOS_LITERAIS = 3
+ORCAMENTO_TOKENS = 1500
+# Recomendações longas só precisam do início (os nomes dos produtos) para o roteador
+MAX_CARACTERES_MENSAGEM = 600
+MAX_PERGUNTAS_RESUMO = 5
+MAX_TEMAS_RESUMO = 15
+MAX_PRODUTOS_RESUMO = 10
+
+
+def estimar_tokens(texto: str) -> int:
+    """ Aproximação de ~4 caracteres por token, suficiente para impor o orçamento sem chamar a API. """
+    return math.ceil(len(texto) / 4)
+
+def _encurtar(texto: str, max_caracteres: int) -> str:
+    texto = " ".join(texto.split())
+    return texto if len(texto) <= max_caracteres else texto[:max_caracteres - 3].rstrip() + "..."
+
+def _acrescentar_recente(lista: list, itens, maximo: int):
+    """ Move os itens para o fim da lista (mais recentes) e corta os mais antigos. """
+    for item in itens:
+        if item in lista:
+            lista.remove(item)
+        lista.append(item)
+    del lista[:-maximo]
+
+
+class HistoricoConversa:
+    """ Guardado em st.session_state; `atualizar` é chamado a cada turno com todas as mensagens. """
+
+    def __init__(self, indice_produtos=None, turnos_literais: int = TURNOS_LITERAIS,
+                 orcamento_tokens: int = ORCAMENTO_TOKENS):
+        self.indice_produtos = indice_produtos
+        self.turnos_literais = turnos_literais
+        self.orcamento_tokens = orcamento_tokens
+        self.produto_fixado = None
+        self._produtos = []
+        self._temas = []
+        self._perguntas = []
+        self._resumidas = 0
+        self._recentes = []
+
+    def _registar_produtos(self, texto: str):
+        if self.indice_produtos is None:
+            return []
+        mencionados = self.indice_produtos.produtos_mencionados(texto)
+        if mencionados:
+            # O produto citado mais recentemente é o que "esse produto" refere.
+            self.produto_fixado = mencionados[0]
+        return [self.indice_produtos.produtos[chave]["nome"] for chave in mencionados]
+
+    def _resumir(self, mensagem: dict):
+        """ Incorpora no resumo uma mensagem que saiu da janela literal. """
+        conteudo = mensagem["content"]
+        _acrescentar_recente(self._produtos, reversed(self._registar_produtos(conteudo)), MAX_PRODUTOS_RESUMO)
+        if mensagem["role"] == "user":
+            _acrescentar_recente(self._temas, roteador.termos_agronomicos(conteudo), MAX_TEMAS_RESUMO)
+            _acrescentar_recente(self._perguntas, [_encurtar(conteudo, 120)], MAX_PERGUNTAS_RESUMO)
+
+    def atualizar(self, mensagens: list):
+        """ Resume só as mensagens que saíram da janela desde a última chamada. """
+        limite = max(0, len(mensagens) - 2 * self.turnos_literais)
+        for mensagem in mensagens[self._resumidas:limite]:
+            self._resumir(mensagem)
+        self._resumidas = max(self._resumidas, limite)
+        self._recentes = mensagens[limite:]
+        # O produto citado na janela recente tem prioridade sobre o do resumo.
+        if self.indice_produtos is not None:
+            for mensagem in reversed(self._recentes):
+                mencionados = self.indice_produtos.produtos_mencionados(mensagem["content"])
+                if mencionados:
+                    self.produto_fixado = mencionados[0]
+                    break
+
+    def nome_produto_fixado(self):
+        if self.produto_fixado is None or self.indice_produtos is None:
+            return None
+        return self.indice_produtos.produtos[self.produto_fixado]["nome"]
+
+    def formatar(self) -> str:
+        """
+        Texto para o prompt do roteador, dentro de `orcamento_tokens`. Quando não cabe, corta
+        primeiro as perguntas antigas do resumo, depois as mensagens literais mais antigas e,
+        por último, os temas; o produto em discussão nunca é cortado.
+        """
+        fixado = self.nome_produto_fixado()
+        cabecalho = [f"PRODUTO EM DISCUSSÃO: {fixado}"] if fixado else []
+        perguntas = list(self._perguntas)
+        temas = list(self._temas)
+        recentes = [f"{m['role']}: {_encurtar(m['content'], MAX_CARACTERES_MENSAGEM)}" for m in self._recentes]
+
+        def montar():
+            resumo = []
+            if self._produtos:
+                resumo.append(f"Produtos já discutidos: {', '.join(self._produtos)}")
+            if temas:
+                resumo.append(f"Temas anteriores: {', '.join(temas)}")
+            if perguntas:
+                resumo.append("Perguntas anteriores: " + " | ".join(perguntas))
+            partes = cabecalho + (["RESUMO DA CONVERSA ANTERIOR:"] + resumo if resumo else []) + recentes
+            return "\n".join(partes)
+
+        texto = montar()
+        while estimar_tokens(texto) > self.orcamento_tokens:
+            if perguntas:
+                perguntas.pop(0)
+            elif len(recentes) > 1:
+                recentes.pop(0)
+            elif temas:
+                temas.clear()
+            else:
+                break
+            texto = montar()
+        if estimar_tokens(texto) > self.orcamento_tokens:
+            # Sobrou uma única mensagem enorme: fica o fim dela, que é o mais recente.
+            prefixo = "".join(linha + "\n" for linha in cabecalho)
+            texto = prefixo + texto[len(prefixo):][-(self.orcamento_tokens * 4 - len(prefixo)):]
+        return texto
@@ -0,0 +1,86 @@
+# agrofel/indices.py
+"""
+Tipos de índice FAISS configuráveis. O índice exato (flat) serve bem para as
+dezenas de bulas atuais; para o catálogo completo do MAPA podem ser usados índices
+aproximados (IVF, HNSW) e/ou compressão dos vetores (float16, SQ8, PQ).
+"""
+import math
+
+import faiss
+import numpy as np
+
+# Configuração por omissão: índice exato, igual ao que o LangChain criava.
+CONFIG_INDICE_PADRAO = {"tipo": "flat"}
+
+TIPOS_INDICE = ("flat", "sqfp16", "sq8", "ivf_flat", "ivf_sq8", "ivf_pq", "hnsw", "hnsw_sq8")
+
+# Parâmetros de busca por omissão para os índices aproximados
+NPROBE_PADRAO = 16
+EF_SEARCH_PADRAO = 64
+
+
+def _nlist_automatico(num_vetores: int) -> int:
+    """ ~4·√n listas, limitado para que cada lista tenha pelo menos 39 pontos de treino (exigência do k-means do FAISS). """
+    return max(1, min(int(4 * math.sqrt(num_vetores)), num_vetores // 39))
+
+def _nbits_pq_automatico(num_vetores: int) -> int:
+    """ 8 bits por subvetor precisam de 256·39 pontos de treino; com menos vetores usamos menos bits. """
+    return max(4, min(8, int(math.log2(max(num_vetores // 39, 16)))))
+
+def descricao_fabrica(config: dict, num_vetores: int, dimensao: int) -> str:
+    """ Traduz a configuração para a string do faiss.index_factory. """
+    tipo = config.get("tipo", "flat")
+    nlist = config.get("nlist") or _nlist_automatico(num_vetores)
+    m_hnsw = config.get("M", 32)
+    if tipo == "flat":
+        return "Flat"
+    if tipo == "sqfp16":
+        return "SQfp16"
+    if tipo == "sq8":
+        return "SQ8"
+    if tipo == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if tipo == "ivf_sq8":
+        return f"IVF{nlist},SQ8"
+    if tipo == "ivf_pq":
+        pq_m = config.get("pq_m", 64)
+        if dimensao % pq_m:
+            raise ValueError(f"pq_m={pq_m} tem de dividir a dimensão dos vetores ({dimensao}).")
+        nbits = config.get("pq_nbits") or _nbits_pq_automatico(num_vetores)
+        return f"IVF{nlist},PQ{pq_m}x{nbits}"
+    if tipo == "hnsw":
+        return f"HNSW{m_hnsw}"
+    if tipo == "hnsw_sq8":
+        return f"HNSW{m_hnsw}_SQ8"
+    raise ValueError(f"Tipo de índice desconhecido: '{tipo}'. Use um de {TIPOS_INDICE}.")
+
+def construir_indice(vetores: np.ndarray, config: dict = None):
+    """ Constrói (treinando, se necessário) o índice descrito por `config` com a métrica L2. """
+    config = config or CONFIG_INDICE_PADRAO
+    num_vetores, dimensao = vetores.shape
+    indice = faiss.index_factory(dimensao, descricao_fabrica(config, num_vetores, dimensao), faiss.METRIC_L2)
+    if "hnsw" in config.get("tipo", "flat"):
+        indice.hnsw.efConstruction = config.get("ef_construction", 200)
+    if not indice.is_trained and num_vetores:
+        indice.train(vetores)
+    if num_vetores:
+        indice.add(vetores)
+    aplicar_parametros_busca(indice, config)
+    return indice
+
+def aplicar_parametros_busca(indice, config: dict, nprobe: int = None, ef_search: int = None):
+    """
+    Ajusta os parâmetros de busca (nprobe para IVF, efSearch para HNSW). Valores passados
+    explicitamente têm prioridade sobre os gravados na configuração do índice.
+    """
+    tipo = config.get("tipo", "flat")
+    parametros = []
+    if tipo.startswith("ivf"):
+        parametros.append(f"nprobe={nprobe or config.get('nprobe', NPROBE_PADRAO)}")
+    if tipo.startswith("hnsw"):
+        parametros.append(f"efSearch={ef_search or config.get('ef_search', EF_SEARCH_PADRAO)}")
+    if parametros:
+        faiss.ParameterSpace().set_index_parameters(indice, ",".join(parametros))
+
+def tamanho_indice_bytes(indice) -> int:
+    return int(faiss.serialize_index(indice).size)
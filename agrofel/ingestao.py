@@ -0,0 +1,120 @@
+# agrofel/ingestao.py
+"""
+Etapas do pipeline de ingestão das bulas: extração das páginas dos PDFs num pool
+de processos, cache em disco do texto extraído e agrupamento dos chunks em lotes.
+"""
+import os
+import json
+import hashlib
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from langchain_core.documents import Document
+from langchain_community.document_loaders import PyPDFLoader
+
+from agrofel.divisao import DivisorBulas
+
+# Incrementar sempre que a forma de extrair o texto mudar, para invalidar o cache.
+VERSAO_EXTRATOR = 1
+
+
+class CachePaginas:
+    """ Guarda em disco o texto extraído de cada PDF, indexado pelo SHA-256 do arquivo. """
+
+    def __init__(self, pasta: str):
+        self.pasta = pasta
+        os.makedirs(pasta, exist_ok=True)
+
+    def _caminho(self, sha: str) -> str:
+        return os.path.join(self.pasta, f"{sha}.json")
+
+    def obter(self, sha: str):
+        """ Devolve a lista de páginas em cache, ou None se o arquivo ainda não foi extraído. """
+        caminho = self._caminho(sha)
+        if not os.path.exists(caminho):
+            return None
+        try:
+            with open(caminho, "r", encoding="utf-8") as f:
+                dados = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if dados.get("versao") != VERSAO_EXTRATOR:
+            return None
+        return dados["paginas"]
+
+    def guardar(self, sha: str, paginas: list):
+        """ Grava as páginas de forma atômica, para não deixar um cache corrompido. """
+        caminho = self._caminho(sha)
+        with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"versao": VERSAO_EXTRATOR, "paginas": paginas}, f, ensure_ascii=False)
+        os.replace(caminho + ".tmp", caminho)
+
+
+def calcular_hash_arquivo(caminho: str, tamanho_bloco: int = 1 << 20) -> str:
+    """ Calcula o SHA-256 do conteúdo de um arquivo, lendo-o em blocos. """
+    sha = hashlib.sha256()
+    with open(caminho, "rb") as arquivo:
+        for bloco in iter(lambda: arquivo.read(tamanho_bloco), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+def extrair_paginas(caminho_pdf: str) -> list:
+    """ Extrai as páginas de um PDF como dicionários serializáveis. Executa nos processos do pool. """
+    return [{"texto": p.page_content, "metadata": p.metadata} for p in PyPDFLoader(caminho_pdf).load()]
+
+def _para_documentos(paginas: list, nome_arquivo: str, sha: str) -> list:
+    return [
+        Document(page_content=p["texto"], metadata={**p["metadata"], "source": nome_arquivo, "sha256": sha})
+        for p in paginas
+    ]
+
+def extrair_pdfs_em_paralelo(arquivos: list, pasta: str, cache: CachePaginas, max_processos: int = None):
+    """
+    Gera (sha, nome_arquivo, paginas) para cada par (sha, nome_arquivo) recebido, à medida
+    que ficam prontos. PDFs já presentes no cache não são reprocessados; os demais são
+    extraídos num pool de processos com no máximo 2 * max_processos tarefas em voo, para que
+    a memória não cresça com o tamanho do acervo. PDFs que falham são avisados e ignorados.
+    """
+    pendentes = []
+    for sha, nome_arquivo in arquivos:
+        paginas = cache.obter(sha)
+        if paginas is None:
+            pendentes.append((sha, nome_arquivo))
+        else:
+            yield sha, nome_arquivo, _para_documentos(paginas, nome_arquivo, sha)
+    if not pendentes:
+        return
+
+    max_processos = min(max_processos or os.cpu_count() or 1, len(pendentes))
+    fila = iter(pendentes)
+    em_voo = {}
+    with ProcessPoolExecutor(max_workers=max_processos) as pool:
+        def submeter():
+            for sha, nome_arquivo in fila:
+                em_voo[pool.submit(extrair_paginas, os.path.join(pasta, nome_arquivo))] = (sha, nome_arquivo)
+                if len(em_voo) >= 2 * max_processos:
+                    break
+
+        submeter()
+        while em_voo:
+            prontos, _ = wait(em_voo, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                sha, nome_arquivo = em_voo.pop(futuro)
+                try:
+                    paginas = futuro.result()
+                except Exception as e:
+                    print(f"AVISO: falha ao extrair '{nome_arquivo}': {e}")
+                    continue
+                cache.guardar(sha, paginas)
+                yield sha, nome_arquivo, _para_documentos(paginas, nome_arquivo, sha)
+            submeter()
+
+def criar_divisor_texto() -> DivisorBulas:
+    """ Divisor usado na ingestão, partilhado com o 5_Avaliar_Recuperacao.py (ver agrofel.divisao). """
+    return DivisorBulas()
+
+def agrupar_em_lotes(itens, tamanho_lote: int):
+    """ Consome um iterável sob demanda e gera listas de até `tamanho_lote` itens. """
+    iterador = iter(itens)
+    while lote := list(islice(iterador, tamanho_lote)):
+        yield lote
@@ -0,0 +1,134 @@
+# agrofel/lexical.py
+"""
+Índice invertido BM25 sobre os mesmos chunks do índice FAISS, para encontrar nomes
+exatos de produtos e plantas daninhas ("GLYPHOTAL TR", "guanxuma", "capim-amargoso")
+que a busca densa às vezes perde. Corre localmente, sem chamadas à API.
+"""
+import os
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+ARQUIVO_LEXICO = "lexico.npz"
+
+# Palavras muito frequentes em português que não ajudam a distinguir chunks
+STOPWORDS = frozenset(
+    "a o as os de da do das dos e em na no nas nos um uma para por com sem que qual quais como "
+    "ao aos se ou mais muito sobre entre pelo pela pelos pelas esse essa este esta isso isto "
+    "meu minha sua seu usar uso posso devo".split()
+)
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def remover_acentos(texto: str) -> str:
+    """ 'Aplicação' -> 'Aplicacao'. Permite que 'herbicida pos-emergencia' encontre 'pós-emergência'. """
+    return "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+
+def tokenizar(texto: str) -> list:
+    """ Minúsculas, sem acentos e sem stopwords. Palavras com hífen viram termos separados. """
+    return [t for t in _TOKEN.findall(remover_acentos(texto).lower()) if t not in STOPWORDS]
+
+
+class IndiceBM25:
+    """
+    BM25 com as listas invertidas em formato CSR (numpy): para cada termo do vocabulário,
+    os chunks em que aparece e a frequência em cada um. As posições são as mesmas do
+    ArmazemChunks, por isso os resultados combinam diretamente com os do FAISS.
+    """
+
+    def __init__(self, vocabulario, indptr, docs, frequencias, comprimentos, k1: float = 1.2, b: float = 0.75):
+        self.termos = {termo: i for i, termo in enumerate(vocabulario)}
+        self.indptr = indptr
+        self.docs = docs
+        self.frequencias = frequencias
+        self.comprimentos = comprimentos
+        self.k1 = k1
+        self.b = b
+        num_docs = len(comprimentos)
+        self.comprimento_medio = float(comprimentos.mean()) if num_docs else 0.0
+        df = np.diff(indptr)
+        self.idf = np.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+    @classmethod
+    def construir(cls, textos: list) -> "IndiceBM25":
+        postings = {}
+        comprimentos = np.zeros(len(textos), dtype=np.int32)
+        for posicao, texto in enumerate(textos):
+            tokens = tokenizar(texto)
+            comprimentos[posicao] = len(tokens)
+            for termo, freq in Counter(tokens).items():
+                postings.setdefault(termo, []).append((posicao, freq))
+        vocabulario = sorted(postings)
+        indptr = np.zeros(len(vocabulario) + 1, dtype=np.int64)
+        docs, frequencias = [], []
+        for i, termo in enumerate(vocabulario):
+            for posicao, freq in postings[termo]:
+                docs.append(posicao)
+                frequencias.append(freq)
+            indptr[i + 1] = len(docs)
+        return cls(vocabulario, indptr, np.array(docs, dtype=np.int32),
+                   np.array(frequencias, dtype=np.float32), comprimentos)
+
+    def gravar(self, caminho: str):
+        vocabulario = sorted(self.termos, key=self.termos.get)
+        with open(caminho, "wb") as f:
+            np.savez(f, vocabulario=np.array(vocabulario, dtype=str), indptr=self.indptr, docs=self.docs,
+                     frequencias=self.frequencias, comprimentos=self.comprimentos)
+
+    @classmethod
+    def carregar(cls, caminho: str) -> "IndiceBM25":
+        with np.load(caminho, allow_pickle=False) as dados:
+            return cls(dados["vocabulario"].tolist(), dados["indptr"], dados["docs"],
+                       dados["frequencias"], dados["comprimentos"])
+
+    def pontuar(self, consulta: str, idf: dict = None, comprimento_medio: float = None) -> np.ndarray:
+        """
+        Pontuação BM25 de todos os chunks para a consulta (zero onde nenhum termo aparece).
+        `idf` (termo -> idf) e `comprimento_medio` substituem os deste índice: numa base
+        particionada são os de todas as partições, para que as pontuações se possam comparar.
+        """
+        pontuacoes = np.zeros(len(self.comprimentos), dtype=np.float32)
+        comprimento_medio = comprimento_medio or self.comprimento_medio
+        normalizacao = self.k1 * (1 - self.b + self.b * self.comprimentos / max(comprimento_medio, 1e-9))
+        for termo in set(tokenizar(consulta)):
+            i = self.termos.get(termo)
+            if i is None:
+                continue
+            inicio, fim = self.indptr[i], self.indptr[i + 1]
+            docs, tf = self.docs[inicio:fim], self.frequencias[inicio:fim]
+            peso = idf[termo] if idf is not None else self.idf[i]
+            pontuacoes[docs] += peso * tf * (self.k1 + 1) / (tf + normalizacao[docs])
+        return pontuacoes
+
+    def buscar_com_pontuacao(self, consulta: str, k: int = 10, **estatisticas) -> list:
+        """ [(posicao, pontuacao)] dos k chunks com maior pontuação, por ordem decrescente. """
+        pontuacoes = self.pontuar(consulta, **estatisticas)
+        candidatos = np.flatnonzero(pontuacoes)
+        if len(candidatos) > k:
+            candidatos = candidatos[np.argpartition(-pontuacoes[candidatos], k)[:k]]
+        candidatos = candidatos[np.argsort(-pontuacoes[candidatos])]
+        return list(zip(candidatos.tolist(), pontuacoes[candidatos].tolist()))
+
+    def frequencia_documentos(self) -> dict:
+        """ Termo -> nº de chunks em que aparece (o resumo de roteamento das partições). """
+        df = np.diff(self.indptr)
+        return {termo: int(df[i]) for termo, i in self.termos.items()}
+
+
+def carregar_indice_lexico(pasta: str):
+    """ Devolve o IndiceBM25 da base, ou None se a base foi criada antes de existir o índice léxico. """
+    caminho = os.path.join(pasta, ARQUIVO_LEXICO)
+    return IndiceBM25.carregar(caminho) if os.path.exists(caminho) else None
+
+def fundir_rrf(listas_de_posicoes: list, k: int, constante: int = 60) -> list:
+    """
+    Reciprocal Rank Fusion: cada lista contribui 1 / (constante + rank) para cada posição.
+    Não exige que as pontuações de BM25 e de distância L2 estejam na mesma escala.
+    """
+    pontuacoes = {}
+    for posicoes in listas_de_posicoes:
+        for rank, posicao in enumerate(posicoes):
+            pontuacoes[posicao] = pontuacoes.get(posicao, 0.0) + 1.0 / (constante + rank + 1)
+    return sorted(pontuacoes, key=pontuacoes.get, reverse=True)[:k]
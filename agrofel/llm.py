@@ -0,0 +1,395 @@
+# agrofel/llm.py
+"""
+Chamadas ao Gemini do motor (escolha da ferramenta e geração das respostas), partilhadas
+por todas as sessões de um processo:
+- um cliente por modelo e por processo (carregar_cliente_llm), em vez de um por carregamento;
+- pedidos idênticos em curso (mesmo prompt e mesmas ferramentas, ex.: a mesma pergunta
+  reencaminhada num grupo de vendedores) juntam-se num só: o primeiro vai à API e os
+  restantes recebem a mesma resposta, ou os mesmos pedaços do streaming à medida que chegam;
+- cada turno tem um orçamento de latência (orcamento_turno). O modelo principal
+  (gemini-1.5-pro) só é chamado se, tirada a reserva do modelo rápido, ainda houver tempo,
+  e tem de começar a responder dentro dele; senão, ou se falhar, a chamada segue para o
+  modelo rápido (gemini-1.5-flash).
+Com AGROFEL_LLM_URL, os pedidos vão para outro endereço da API REST do Gemini, como o
+servidor falso do agrofel.llm_falso, para experimentar tudo isto sem a API nem quota.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FuturoSemResultado
+from contextlib import contextmanager
+from functools import lru_cache
+
+from langchain_core.messages import HumanMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from agrofel import rastreio
+
+MODELO_PRINCIPAL = os.getenv("AGROFEL_LLM_MODELO", "gemini-1.5-pro-latest")
+# Vazio desativa a alternativa: o modelo principal fica com todo o orçamento
+MODELO_RAPIDO = os.getenv("AGROFEL_LLM_MODELO_RAPIDO", "gemini-1.5-flash-latest")
+TEMPERATURA = 0.2
+# Segundos de um turno para as chamadas ao LLM (escolha da ferramenta e primeiro token da resposta)
+ORCAMENTO_TURNO = float(os.getenv("AGROFEL_LLM_ORCAMENTO", 20))
+# Segundos guardados para o modelo rápido: com menos do que isto, o principal já não é chamado
+RESERVA_RAPIDO = float(os.getenv("AGROFEL_LLM_RESERVA", 6))
+# Tempo máximo de cada pedido à API fora de um turno (ex.: no 6_Aquecer_Respostas.py)
+TEMPO_MAXIMO_PEDIDO = float(os.getenv("AGROFEL_LLM_TEMPO_MAXIMO", 60))
+# Outro endereço da API REST do Gemini (ex.: http://127.0.0.1:8766, o agrofel.llm_falso)
+URL_LLM = os.getenv("AGROFEL_LLM_URL")
+
+_prazo_turno = contextvars.ContextVar("agrofel_prazo_llm", default=None)
+
+
+class TempoEsgotado(Exception):
+    """ Nenhum modelo respondeu dentro do orçamento do turno. """
+
+
+@contextmanager
+def orcamento_turno(segundos: float = ORCAMENTO_TURNO):
+    """ Prazo das chamadas ao LLM feitas no bloco. Dentro de outro orçamento, vale o que já estava em curso. """
+    if _prazo_turno.get() is not None:
+        yield
+        return
+    marcador = _prazo_turno.set(time.monotonic() + segundos)
+    try:
+        yield
+    finally:
+        _prazo_turno.reset(marcador)
+
+def tempo_restante():
+    """ Segundos até ao fim do orçamento do turno em curso; None fora de um orçamento. """
+    prazo = _prazo_turno.get()
+    return None if prazo is None else prazo - time.monotonic()
+
+def _como_mensagens(mensagens) -> list:
+    return [HumanMessage(content=mensagens)] if isinstance(mensagens, str) else list(mensagens)
+
+def _chave(mensagens: list, ferramentas: list = None) -> str:
+    """ Identifica pedidos idênticos: o texto de cada mensagem e os nomes das ferramentas. """
+    conteudo = [[m.type, m.content] for m in mensagens] + [[f.__name__ for f in ferramentas or []]]
+    return hashlib.sha256(json.dumps(conteudo, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def _nome_modelo(modelo) -> str:
+    return str(getattr(modelo, "model", None) or type(modelo).__name__).removeprefix("models/")
+
+def _em_segundo_plano(funcao, *args) -> Future:
+    """
+    Corre a função numa thread própria, com o turno do rastreio de quem chama. Uma chamada que
+    excede o prazo é abandonada (a biblioteca do Gemini não a deixa cancelar) e acaba sozinha.
+    """
+    futuro = Future()
+    executar = rastreio.no_contexto_atual(funcao)
+
+    def correr():
+        try:
+            futuro.set_result(executar(*args))
+        except BaseException as e:
+            futuro.set_exception(e)
+
+    threading.Thread(target=correr, daemon=True, name="llm").start()
+    return futuro
+
+def _opcoes_pedido(segundos: float, repetir: bool) -> dict:
+    # Com um modelo alternativo a seguir, sem as repetições da biblioteca do Google, que
+    # insistiriam num 503 até ao fim do prazo em vez de passar logo ao outro modelo.
+    return {"timeout": segundos} if repetir else {"timeout": segundos, "retry": None}
+
+def _primeiro_pedaco(modelo, opcoes: dict, mensagens: list) -> tuple:
+    """ Abre o streaming e espera pelo primeiro pedaço. Devolve (pedaço ou None, iterador do resto). """
+    iterador = iter(modelo.stream(mensagens, **opcoes))
+    return next(iterador, None), iterador
+
+def _fechar_streaming(futuro: Future):
+    # Streaming abandonado que acabou por começar: fecha-o para a geração parar.
+    if not futuro.cancelled() and futuro.exception() is None:
+        futuro.result()[1].close()
+
+
+class _Transmissao:
+    """ Pedaços de uma resposta em streaming, partilhados pelos pedidos idênticos que a leem. """
+
+    def __init__(self):
+        self.pedacos = []
+        self.terminada = False
+        self.erro = None
+        self.modelo = None
+        self.alternativa = None
+        self.leitores = 0
+        self.cancelada = False
+        self._condicao = threading.Condition()
+
+    def acrescentar(self, pedaco: str):
+        with self._condicao:
+            self.pedacos.append(pedaco)
+            self._condicao.notify_all()
+
+    def terminar(self, erro: BaseException = None):
+        with self._condicao:
+            self.terminada, self.erro = True, erro
+            self._condicao.notify_all()
+
+    def ler(self):
+        lidos = 0
+        while True:
+            with self._condicao:
+                self._condicao.wait_for(lambda: len(self.pedacos) > lidos or self.terminada)
+                novos, terminada = self.pedacos[lidos:], self.terminada
+            lidos += len(novos)
+            yield from novos
+            if terminada:
+                if self.erro is not None:
+                    raise self.erro
+                return
+
+
+class LeituraTransmissao:
+    """
+    Uma leitura da resposta em streaming: itera os pedaços de texto. `fechar` (cliente
+    desligado) para a geração quando já ninguém a lê.
+    """
+
+    def __init__(self, cliente, chave: str, transmissao: _Transmissao, juntada: bool):
+        self._cliente = cliente
+        self._chave = chave
+        self._transmissao = transmissao
+        self._fechada = False
+        self.juntada = juntada
+
+    @property
+    def modelo(self):
+        return self._transmissao.modelo
+
+    @property
+    def alternativa(self):
+        return self._transmissao.alternativa
+
+    def __iter__(self):
+        return self._transmissao.ler()
+
+    def fechar(self):
+        if not self._fechada:
+            self._fechada = True
+            self._cliente._deixar_de_ler(self._chave, self._transmissao)
+
+
+class ClienteLLM:
+    """
+    Modelo principal e rápido de um processo, partilhados (com os pedidos em curso) por todas
+    as sessões e threads. `invocar` devolve a mensagem completa (com as chamadas de ferramentas);
+    `transmitir` devolve os pedaços da resposta à medida que chegam.
+    """
+
+    def __init__(self, principal, rapido=None, reserva_rapido: float = RESERVA_RAPIDO):
+        self.principal = principal
+        self.rapido = rapido
+        self.reserva_rapido = reserva_rapido
+        self._lock = threading.Lock()
+        self._invocacoes = {}
+        self._transmissoes = {}
+        self._com_ferramentas = {}
+        self.chamadas = 0
+        self.juntadas = 0
+        self.alternativas = Counter()
+        self.esgotadas = 0
+        self.canceladas = 0
+
+    def _modelo_com_ferramentas(self, modelo, ferramentas: list):
+        if not ferramentas:
+            return modelo
+        chave = (id(modelo), tuple(ferramentas))
+        with self._lock:
+            if chave not in self._com_ferramentas:
+                self._com_ferramentas[chave] = modelo.bind_tools(ferramentas)
+            return self._com_ferramentas[chave]
+
+    def _executar(self, iniciar, descartar=None, modelos: list = None) -> tuple:
+        """
+        Corre `iniciar(modelo, opcoes do pedido)` no modelo principal ou, se o orçamento do turno não
+        chegar, ele não responder a tempo ou falhar, no rápido. O último modelo a tentar fica
+        com o que resta do orçamento, e pelo menos a reserva. Devolve (modelo, resultado,
+        motivo da alternativa). `descartar` recebe o futuro de uma chamada abandonada;
+        `modelos` substitui a sequência principal -> rápido.
+        """
+        modelos = modelos or [self.principal] + ([self.rapido] if self.rapido is not None else [])
+        motivo = None
+        restante = tempo_restante()
+        if len(modelos) > 1 and restante is not None and restante <= self.reserva_rapido:
+            modelos, motivo = modelos[1:], "orcamento"
+            self._alternativa(motivo)
+        for i, modelo in enumerate(modelos):
+            ultimo = i == len(modelos) - 1
+            restante = tempo_restante()
+            prazo = None
+            if restante is not None:
+                prazo = max(restante, self.reserva_rapido) if ultimo else restante - self.reserva_rapido
+            futuro = _em_segundo_plano(iniciar, modelo, _opcoes_pedido(prazo or TEMPO_MAXIMO_PEDIDO, repetir=ultimo))
+            try:
+                return _nome_modelo(modelo), futuro.result(timeout=prazo), motivo
+            except FuturoSemResultado:
+                if descartar is not None:
+                    futuro.add_done_callback(descartar)
+                if ultimo:
+                    with self._lock:
+                        self.esgotadas += 1
+                    raise TempoEsgotado(f"O {_nome_modelo(modelo)} não respondeu em {prazo:.1f} s.")
+                motivo = "prazo"
+            except Exception as e:
+                if ultimo:
+                    raise
+                print(f"AVISO: o {_nome_modelo(modelo)} falhou ({e}); a usar o {_nome_modelo(modelos[-1])}.")
+                motivo = "erro"
+            self._alternativa(motivo)
+
+    def _alternativa(self, motivo: str):
+        with self._lock:
+            self.alternativas[motivo] += 1
+
+    def invocar(self, mensagens, ferramentas: list = None):
+        """
+        Resposta completa (AIMessage) às `mensagens` (texto ou lista de mensagens), com as
+        `ferramentas` que o modelo pode chamar. Anota na etapa em curso o modelo usado e se
+        o pedido se juntou a outro idêntico.
+        """
+        mensagens = _como_mensagens(mensagens)
+        chave = _chave(mensagens, ferramentas)
+        with self._lock:
+            futuro = self._invocacoes.get(chave)
+            juntada = futuro is not None
+            if juntada:
+                self.juntadas += 1
+            else:
+                futuro = self._invocacoes[chave] = Future()
+                self.chamadas += 1
+
+        def iniciar(modelo, opcoes):
+            return self._modelo_com_ferramentas(modelo, ferramentas).invoke(mensagens, **opcoes)
+
+        if juntada:
+            rastreio.anotar(juntada=True)
+            return self._esperar_juntada(futuro, iniciar)
+
+        try:
+            modelo, resposta, motivo = self._executar(iniciar)
+            futuro.set_result(resposta)
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._invocacoes.pop(chave, None)
+        rastreio.anotar(juntada=False, modelo=modelo, **({"alternativa": motivo} if motivo else {}))
+        return resposta
+
+    def _esperar_juntada(self, futuro: Future, iniciar):
+        """
+        Resposta do pedido idêntico em curso, dentro do orçamento deste turno (que pode acabar
+        antes do de quem o fez). Se não chegar a tempo, este turno segue sozinho para o modelo rápido.
+        """
+        restante = tempo_restante()
+        espera = restante
+        if restante is not None and self.rapido is not None:
+            espera = max(restante - self.reserva_rapido, 0)
+        try:
+            return futuro.result(timeout=espera)
+        except FuturoSemResultado:
+            if self.rapido is None:
+                with self._lock:
+                    self.esgotadas += 1
+                raise TempoEsgotado(f"O pedido idêntico em curso não respondeu em {espera:.1f} s.")
+        self._alternativa("prazo")
+        modelo, resposta, _ = self._executar(iniciar, modelos=[self.rapido])
+        rastreio.anotar(modelo=modelo, alternativa="prazo")
+        return resposta
+
+    def transmitir(self, mensagens) -> LeituraTransmissao:
+        """
+        Começa já a gerar a resposta às `mensagens` (com o orçamento do turno em curso) e
+        devolve a leitura dos seus pedaços de texto. Um pedido idêntico em curso é lido em
+        vez de repetido, desde o primeiro pedaço.
+        """
+        mensagens = _como_mensagens(mensagens)
+        chave = _chave(mensagens)
+        with self._lock:
+            transmissao = self._transmissoes.get(chave)
+            juntada = transmissao is not None
+            if juntada:
+                self.juntadas += 1
+            else:
+                transmissao = self._transmissoes[chave] = _Transmissao()
+                self.chamadas += 1
+            transmissao.leitores += 1
+        if not juntada:
+            bombear = rastreio.no_contexto_atual(self._bombear)
+            threading.Thread(target=bombear, args=(chave, transmissao, mensagens), daemon=True,
+                             name="llm-transmissao").start()
+        return LeituraTransmissao(self, chave, transmissao, juntada)
+
+    def _bombear(self, chave: str, transmissao: _Transmissao, mensagens: list):
+        """ Lê o streaming do modelo para a transmissão partilhada, até ao fim ou até ninguém a ler. """
+        erro, iterador = None, None
+        try:
+            modelo, (primeiro, iterador), motivo = self._executar(
+                lambda modelo, opcoes: _primeiro_pedaco(modelo, opcoes, mensagens), _fechar_streaming,
+            )
+            transmissao.modelo, transmissao.alternativa = modelo, motivo
+            if primeiro is not None:
+                transmissao.acrescentar(primeiro.content)
+            for mensagem in iterador:
+                if transmissao.cancelada:
+                    break
+                transmissao.acrescentar(mensagem.content)
+        except BaseException as e:
+            erro = e
+        finally:
+            if iterador is not None:
+                iterador.close()
+            with self._lock:
+                if self._transmissoes.get(chave) is transmissao:
+                    del self._transmissoes[chave]
+            transmissao.terminar(erro)
+
+    def _deixar_de_ler(self, chave: str, transmissao: _Transmissao):
+        with self._lock:
+            transmissao.leitores -= 1
+            if transmissao.leitores == 0 and not transmissao.terminada:
+                # Os pedidos idênticos seguintes começam outra geração em vez de se juntarem a esta.
+                transmissao.cancelada = True
+                self.canceladas += 1
+                if self._transmissoes.get(chave) is transmissao:
+                    del self._transmissoes[chave]
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            pedidos = self.chamadas + self.juntadas
+            return {
+                "modelo": _nome_modelo(self.principal),
+                "modelo_rapido": _nome_modelo(self.rapido) if self.rapido is not None else None,
+                "chamadas": self.chamadas,
+                "juntadas": self.juntadas,
+                "taxa_juntadas": round(self.juntadas / pedidos, 3) if pedidos else 0.0,
+                "alternativas": dict(self.alternativas),
+                "esgotadas": self.esgotadas,
+                "canceladas": self.canceladas,
+                "em_curso": len(self._invocacoes) + len(self._transmissoes),
+            }
+
+
+@lru_cache(maxsize=None)
+def carregar_modelo(nome: str):
+    """ Um ChatGoogleGenerativeAI por modelo e por processo, partilhado por todas as sessões e threads. """
+    opcoes = {}
+    if URL_LLM:
+        # Só o transporte REST aceita outro endereço (com http://).
+        opcoes = {"client_options": {"api_endpoint": URL_LLM}, "transport": "rest",
+                  "google_api_key": os.getenv("GOOGLE_API_KEY") or "chave-local"}
+    return ChatGoogleGenerativeAI(model=nome, temperature=TEMPERATURA, **opcoes)
+
+@lru_cache(maxsize=None)
+def carregar_cliente_llm() -> ClienteLLM:
+    """ O ClienteLLM do processo, com AGROFEL_LLM_MODELO e AGROFEL_LLM_MODELO_RAPIDO. """
+    return ClienteLLM(carregar_modelo(MODELO_PRINCIPAL), carregar_modelo(MODELO_RAPIDO) if MODELO_RAPIDO else None)
@@ -0,0 +1,149 @@
+# agrofel/llm_falso.py
+"""
+Servidor falso da API REST do Gemini (generateContent e streamGenerateContent), para
+experimentar o agrofel.llm sem rede nem quota:
+
+    python -m agrofel.llm_falso --porta 8766 --atraso gemini-1.5-pro-latest=8
+    AGROFEL_LLM_URL=http://127.0.0.1:8766 python -m agrofel.servico
+
+Cada modelo começa a responder depois do seu `--atraso` (em segundos) e, no streaming, envia
+uma palavra a cada `--intervalo` segundos; os modelos em `--falha` respondem 503. O texto é
+o início do contexto das bulas (o que está entre os primeiros '---' do prompt), como no
+LLMDeterministico. Com ferramentas, chama a primeira e preenche os argumentos com o texto
+depois de ':' na última linha do prompt (no prompt do roteador, a pergunta do utilizador).
+GET /estado devolve os pedidos recebidos e interrompidos por modelo, para confirmar que os
+pedidos idênticos se juntaram e que a geração para quando o cliente desliga.
+"""
+import json
+import asyncio
+import argparse
+from collections import Counter
+
+import tornado.web
+import tornado.iostream
+
+PORTA = 8766
+# Palavras de cada resposta
+MAX_PALAVRAS = 60
+
+
+class ConfigFalso:
+
+    def __init__(self, atrasos: dict = None, atraso_padrao: float = 0.2, intervalo: float = 0.02, falhas: set = ()):
+        self.atrasos = atrasos or {}
+        self.atraso_padrao = atraso_padrao
+        self.intervalo = intervalo
+        self.falhas = set(falhas)
+        self.pedidos = Counter()
+        self.interrompidos = Counter()
+
+
+def _texto_do_prompt(corpo: dict) -> str:
+    return "\n".join(parte.get("text", "") for conteudo in corpo.get("contents", []) for parte in conteudo.get("parts", []))
+
+def _chamada_ferramenta(corpo: dict, prompt: str):
+    """ functionCall da primeira ferramenta declarada; None se o pedido não tiver ferramentas. """
+    for ferramenta in corpo.get("tools", []):
+        declaracoes = ferramenta.get("functionDeclarations") or ferramenta.get("function_declarations") or []
+        if declaracoes:
+            linhas = [linha for linha in prompt.splitlines() if linha.strip()]
+            valor = linhas[-1].rsplit(":", 1)[-1].strip() if linhas else ""
+            propriedades = declaracoes[0].get("parameters", {}).get("properties", {})
+            return {"name": declaracoes[0]["name"], "args": {nome: valor for nome in propriedades}}
+    return None
+
+def _palavras_resposta(modelo: str, prompt: str) -> list:
+    partes = prompt.split("---")
+    texto = partes[1] if len(partes) > 2 else prompt
+    return [f"[{modelo}]"] + texto.split()[:MAX_PALAVRAS]
+
+def _resposta(partes: list, tokens_prompt: int, tokens_saida: int) -> dict:
+    # finishReason 1 = STOP (o cliente REST pede os enums como inteiros).
+    return {
+        "candidates": [{"content": {"role": "model", "parts": partes}, "finishReason": 1, "index": 0}],
+        "usageMetadata": {"promptTokenCount": tokens_prompt, "candidatesTokenCount": tokens_saida,
+                          "totalTokenCount": tokens_prompt + tokens_saida},
+    }
+
+
+class ModeloHandler(tornado.web.RequestHandler):
+
+    def initialize(self, config: ConfigFalso):
+        self.config = config
+
+    async def post(self, modelo: str, metodo: str):
+        self.config.pedidos[modelo] += 1
+        if modelo in self.config.falhas:
+            self.set_status(503)
+            self.finish({"error": {"code": 503, "message": f"{modelo} indisponível (falha simulada).",
+                                   "status": "UNAVAILABLE"}})
+            return
+        corpo = json.loads(self.request.body or b"{}")
+        prompt = _texto_do_prompt(corpo)
+        tokens_prompt = len(prompt) // 4
+        await asyncio.sleep(self.config.atrasos.get(modelo, self.config.atraso_padrao))
+
+        chamada = _chamada_ferramenta(corpo, prompt)
+        palavras = [] if chamada else _palavras_resposta(modelo, prompt)
+        if metodo == "generateContent":
+            partes = [{"functionCall": chamada}] if chamada else [{"text": " ".join(palavras)}]
+            self.finish(_resposta(partes, tokens_prompt, len(palavras)))
+            return
+
+        # O cliente REST lê o streaming como um array JSON, objeto a objeto.
+        self.set_header("Content-Type", "application/json")
+        pedacos = [[{"functionCall": chamada}]] if chamada else [
+            [{"text": palavra if i == 0 else " " + palavra}] for i, palavra in enumerate(palavras)
+        ]
+        try:
+            for i, partes in enumerate(pedacos):
+                self.write(("[" if i == 0 else ",") + json.dumps(_resposta(partes, tokens_prompt, i + 1), ensure_ascii=False))
+                await self.flush()
+                await asyncio.sleep(self.config.intervalo)
+            self.finish("]")
+        except tornado.iostream.StreamClosedError:
+            self.config.interrompidos[modelo] += 1
+
+
+class EstadoHandler(tornado.web.RequestHandler):
+
+    def initialize(self, config: ConfigFalso):
+        self.config = config
+
+    def get(self):
+        self.write({"pedidos": dict(self.config.pedidos), "interrompidos": dict(self.config.interrompidos)})
+
+    def delete(self):
+        self.config.pedidos.clear()
+        self.config.interrompidos.clear()
+        self.set_status(204)
+
+
+def criar_aplicacao(config: ConfigFalso):
+    return tornado.web.Application([
+        (r"/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)", ModeloHandler, dict(config=config)),
+        (r"/estado", EstadoHandler, dict(config=config)),
+    ])
+
+async def servir(porta: int, endereco: str, config: ConfigFalso):
+    criar_aplicacao(config).listen(porta, endereco)
+    print(f"[llm falso] à escuta em http://{endereco}:{porta} (atrasos: {config.atrasos or 'nenhum'}, "
+          f"falhas: {sorted(config.falhas) or 'nenhuma'}).")
+    await asyncio.Event().wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso da API REST do Gemini, para testes locais.")
+    parser.add_argument("--porta", type=int, default=PORTA)
+    parser.add_argument("--endereco", default="127.0.0.1")
+    parser.add_argument("--atraso", action="append", default=[], metavar="MODELO=SEGUNDOS",
+                        help="Segundos até ao primeiro pedaço deste modelo (repetível)")
+    parser.add_argument("--atraso-padrao", type=float, default=0.2, help="Atraso dos restantes modelos")
+    parser.add_argument("--intervalo", type=float, default=0.02, help="Segundos entre pedaços do streaming")
+    parser.add_argument("--falha", action="append", default=[], metavar="MODELO", help="Modelo que responde 503 (repetível)")
+    args = parser.parse_args()
+    atrasos = {modelo: float(segundos) for modelo, segundos in (a.split("=", 1) for a in args.atraso)}
+    asyncio.run(servir(args.porta, args.endereco, ConfigFalso(atrasos, args.atraso_padrao, args.intervalo, args.falha)))
+
+
+if __name__ == "__main__":
+    main()
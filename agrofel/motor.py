@@ -0,0 +1,486 @@
+# agrofel/motor.py
+"""
+Motor do assistente, sem Streamlit: o orquestrador conversacional e as suas ferramentas
+(ResponderConversa, BuscaRecomendacao, BuscaTecnica, BuscaDose). O serviço HTTP
+(agrofel.servico) carrega um Motor por worker; o app.py só o usa diretamente quando não
+há serviço configurado (AGROFEL_SERVICO_URL).
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Imports para LangChain e Pydantic
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.pydantic_v1 import BaseModel, Field
+
+from agrofel.particoes import BaseParticionada, abrir_base, existe_base
+from agrofel import roteador
+from agrofel.cache_respostas import CacheRespostas
+from agrofel import contexto as montagem_contexto
+from agrofel.historico import HistoricoConversa, estimar_tokens
+from agrofel.embeddings import config_embeddings_do_indice, criar_modelo_embeddings, CacheEmbeddings, EmbeddingsComCache
+from agrofel.lexical import tokenizar
+from agrofel.reranker import criar_reordenador_do_ambiente
+from agrofel.respostas_aquecidas import RespostasAquecidas
+from agrofel.llm import TempoEsgotado, carregar_cliente_llm, orcamento_turno
+from agrofel import rastreio
+
+CAMINHO_INDEX_FAISS = "faiss_index_agrofel"
+
+# Enquanto o LLM escolhe a ferramenta, a busca de BuscaRecomendacao (a intenção mais comum)
+# já corre em paralelo. AGROFEL_EXECUCAO_ESPECULATIVA=0 volta à execução em série.
+EXECUCAO_ESPECULATIVA = os.getenv("AGROFEL_EXECUCAO_ESPECULATIVA", "1") != "0"
+# Tokens máximos dos trechos das bulas no prompt de geração
+ORCAMENTO_TOKENS_CONTEXTO = int(os.getenv("AGROFEL_ORCAMENTO_CONTEXTO", montagem_contexto.ORCAMENTO_TOKENS_CONTEXTO))
+# Com o reranker (AGROFEL_RERANKER=1), a busca traz mais candidatos e o cross-encoder escolhe os melhores.
+CANDIDATOS_RERANKER = int(os.getenv("AGROFEL_RERANKER_CANDIDATOS", 10))
+LIMIAR_RERANKER = float(os.getenv("AGROFEL_RERANKER_LIMIAR")) if os.getenv("AGROFEL_RERANKER_LIMIAR") else None
+# Linhas da tabela de doses mostradas numa resposta; acima disto pede-se a cultura e o alvo.
+MAX_LINHAS_DOSE = 8
+
+MENSAGEM_SEM_TEMPO = "Peço desculpa, o assistente está a demorar mais do que o normal a responder. Por favor, tente de novo dentro de alguns instantes."
+MENSAGEM_LINGUAGEM_INADEQUADA = "Peço desculpa, mas não posso processar pedidos com linguagem inadequada. Por favor, mantenha a conversa profissional e focada em questões agrícolas."
+
+# --- DEFINIÇÃO DAS FERRAMENTAS PARA O AGENTE ---
+class ResponderConversa(BaseModel):
+    """Ferramenta para responder a saudações, despedidas ou conversas informais que não são perguntas técnicas."""
+    resposta_cordial: str = Field(description="Uma resposta curta, amigável e profissional. Ex: 'Boa noite! Em que posso ajudar?'.")
+
+class BuscaRecomendacao(BaseModel):
+    """Ferramenta para buscar recomendações gerais de produtos para um problema agrícola."""
+    problema_agricola: str = Field(description="A descrição do problema do utilizador, incluindo praga e cultura se mencionados. Ex: 'guanxuma na soja'.")
+
+class BuscaTecnica(BaseModel):
+    """Ferramenta para buscar uma resposta técnica sobre um produto específico."""
+    nome_produto: str = Field(description="O nome do produto sobre o qual se pergunta, extraído do histórico da conversa. Ex: 'GLYPHOTAL TR'.")
+    pergunta_tecnica: str = Field(description="A pergunta técnica específica. Ex: 'qual a dosagem para 1 hectare?'.")
+
+class BuscaDose(BaseModel):
+    """Ferramenta para consultar a dose de um produto específico, por cultura e planta daninha, na tabela extraída das bulas."""
+    nome_produto: str = Field(description="O nome do produto, citado na pergunta ou extraído do histórico da conversa. Ex: 'GLYPHOTAL TR'.")
+    pergunta_tecnica: str = Field(description="A pergunta sobre a dose, com a cultura e a planta daninha se mencionadas. Ex: 'dose para buva na soja'.")
+
+
+# --- RECURSOS DO PROCESSO ---
+# Carregados uma vez por processo (por worker, no serviço) e partilhados por todas as sessões.
+
+def carregar_base_conhecimento(caminho: str = CAMINHO_INDEX_FAISS):
+    """
+    Carrega a base de conhecimento pré-construída (chunks e índice FAISS por mmap, só de
+    leitura) e o cliente do LLM do processo (agrofel.llm). Numa base particionada só o
+    resumo é lido agora; cada partição é carregada na primeira busca que a usa. Levanta FileNotFoundError se a base não existir.
+    """
+    if not existe_base(caminho):
+        raise FileNotFoundError(f"A base de conhecimento ('{caminho}') não foi encontrada.")
+    # As consultas têm de usar o mesmo modelo de embeddings que construiu o índice.
+    config_embeddings = config_embeddings_do_indice(caminho)
+    # O cache evita repetir a chamada ao modelo para perguntas já feitas.
+    embeddings = EmbeddingsComCache(
+        criar_modelo_embeddings(config_embeddings["backend"], config_embeddings["modelo"]),
+        config_embeddings["modelo"],
+        CacheEmbeddings("cache_embeddings.sqlite"),
+    )
+    # Parâmetros de busca dos índices aproximados (IVF: nprobe, HNSW: efSearch), se definidos.
+    db = abrir_base(
+        caminho,
+        embeddings,
+        nprobe=int(os.getenv("AGROFEL_NPROBE", 0)) or None,
+        ef_search=int(os.getenv("AGROFEL_EF_SEARCH", 0)) or None,
+    )
+    return db, carregar_cliente_llm()
+
+@lru_cache(maxsize=None)
+def carregar_cache_respostas():
+    """ Um único cache de respostas por processo, partilhado por todas as sessões. """
+    return CacheRespostas()
+
+@lru_cache(maxsize=None)
+def carregar_executor():
+    """ Threads partilhadas pelas sessões para as buscas especulativas. """
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="especulacao")
+
+@lru_cache(maxsize=None)
+def carregar_respostas_aquecidas(db):
+    """ Respostas pré-calculadas pelo 6_Aquecer_Respostas.py para esta base. """
+    return RespostasAquecidas(db)
+
+@lru_cache(maxsize=None)
+def carregar_reordenador():
+    """ Cross-encoder local, carregado uma vez por processo; None se AGROFEL_RERANKER não estiver ativo. """
+    return criar_reordenador_do_ambiente()
+
+
+# --- FUNÇÕES DE LÓGICA ---
+
+def _sem_progresso(etapa: str):
+    pass
+
+def buscar_documentos(query: str, db, nome_produto: str = None) -> list:
+    # Menos chunks bastam quando a busca já está restrita à bula certa.
+    k = 4 if nome_produto else 5
+    reordenador = carregar_reordenador()
+    candidatos = max(k, CANDIDATOS_RERANKER) if reordenador is not None else k
+    with rastreio.etapa("embedding") as etapa:
+        # A busca volta a pedir o vetor, que já estará no cache em memória.
+        falhas = getattr(db.embeddings, "falhas", None)
+        db.embeddings.embed_query(query)
+        if falhas is not None:
+            etapa["cache"] = db.embeddings.falhas == falhas
+    with rastreio.etapa("busca", k=candidatos, por_produto=bool(nome_produto)) as etapa:
+        if nome_produto:
+            docs = db.busca_por_produto(query, nome_produto, k=candidatos)
+        else:
+            # Busca híbrida (FAISS + BM25): nomes exatos de produtos e daninhas entram sem aumentar o k.
+            docs = db.busca_hibrida(query, k=candidatos)
+        etapa["docs"] = len(docs)
+    if reordenador is not None:
+        with rastreio.etapa("rerank", candidatos=len(docs), top_n=k) as etapa:
+            docs = reordenador.reordenar(query, docs, top_n=k, limiar=LIMIAR_RERANKER)
+            etapa["docs"] = len(docs)
+    # Os chunks são trechos pequenos das bulas; a secção inteira só segue quando vários vêm dela.
+    with rastreio.etapa("pais", chunks=len(docs)) as etapa:
+        docs = db.expandir_pais(docs)
+        etapa["docs"] = len(docs)
+    return docs
+
+def _run_rag_chain(query: str, db, llm, prompt_template: str, nome_produto: str = None,
+                   ferramenta: str = None, argumentos: dict = None, progresso=_sem_progresso, docs: list = None):
+    """
+    Função genérica para executar uma cadeia RAG. Com `nome_produto`, busca só nos chunks desse produto.
+    Com `ferramenta` e `argumentos`, reutiliza uma resposta já gerada para a mesma pergunta (ou uma
+    muito parecida) se a busca devolver os mesmos chunks.
+    Devolve o texto (respostas fixas ou do cache) ou um gerador com os tokens do LLM.
+    `docs` já recuperados (pela busca especulativa) dispensam a busca.
+    """
+    if docs is None:
+        progresso(f"A procurar nas bulas{' de ' + nome_produto if nome_produto else ''}...")
+        docs = buscar_documentos(query, db, nome_produto)
+    if not docs:
+        return "Com base nas informações disponíveis, não encontrei uma resposta específica na nossa base de dados. Poderia reformular a sua pergunta?"
+
+    progresso(f"{len(docs)} trechos encontrados nas bulas.")
+    cache = carregar_cache_respostas() if ferramenta else None
+    if cache is not None:
+        with rastreio.etapa("cache_respostas", ferramenta=ferramenta) as etapa:
+            # O vetor da pergunta já foi calculado pela busca e vem do cache de embeddings.
+            vetor_consulta = db.embeddings.embed_query(query)
+            ids_chunks = [doc.id for doc in docs]
+            versao_indice = db.versao()
+            resposta = cache.obter(ferramenta, argumentos, vetor_consulta, ids_chunks, versao_indice)
+            etapa["acerto"] = resposta is not None
+        if resposta is not None:
+            return resposta
+
+    progresso("A gerar a resposta...")
+    # Sem a sobreposição entre chunks vizinhos nem chunks repetidos, dentro do orçamento de tokens.
+    with rastreio.etapa("contexto"):
+        empacotado = montagem_contexto.montar_contexto(docs, ORCAMENTO_TOKENS_CONTEXTO)
+        rastreio.anotar(chunks=empacotado.chunks_usados, chunks_recebidos=empacotado.chunks_recebidos,
+                        tokens=empacotado.tokens_finais, tokens_poupados=empacotado.tokens_poupados)
+    montagem_contexto.estatisticas.registar(empacotado)
+    contexto = empacotado.texto
+    mensagens = ChatPromptTemplate.from_template(prompt_template).format_messages(contexto=contexto, pergunta=query)
+    # A geração começa já, com o orçamento do turno; uma pergunta idêntica em curso é lida em vez de repetida.
+    inicio = time.perf_counter()
+    resposta = llm.transmitir(mensagens)
+
+    def transmitir():
+        # Os tokens seguem para o ecrã à medida que chegam; o texto completo vai para o cache no fim.
+        # Fechado a meio (cliente desligado), o streaming do modelo deixa de ser lido se mais ninguém o ler.
+        pedacos = []
+        entrada = mensagens[0].content
+        with rastreio.etapa("geracao", ferramenta=ferramenta, tokens_entrada=estimar_tokens(entrada),
+                            juntada=resposta.juntada) as etapa:
+            try:
+                for pedaco in resposta:
+                    if not pedacos:
+                        etapa["primeiro_token_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+                    pedacos.append(pedaco)
+                    yield pedaco
+            except TempoEsgotado as e:
+                # Nem o modelo rápido começou a tempo: o aviso não vai para o cache de respostas.
+                print(f"AVISO: {e}")
+                etapa["esgotado"] = True
+                yield MENSAGEM_SEM_TEMPO
+                return
+            finally:
+                resposta.fechar()
+                etapa.atualizar(modelo=resposta.modelo, **({"alternativa": resposta.alternativa} if resposta.alternativa else {}))
+            etapa["tokens_saida"] = estimar_tokens("".join(pedacos))
+        if cache is not None:
+            cache.guardar(ferramenta, argumentos, vetor_consulta, ids_chunks, versao_indice, "".join(pedacos))
+
+    return transmitir()
+
+def ferramenta_buscar_recomendacao(problema_agricola: str, db, llm, progresso=_sem_progresso, docs: list = None):
+    """ Ferramenta que busca recomendações de produtos. """
+    prompt_template = """
+Você é um consultor especialista da Agrofel. Sua tarefa é gerar uma recomendação de produtos com base na pergunta do cliente e nas informações das bulas.
+Seja cordial e profissional.
+
+PERGUNTA DO CLIENTE: "{pergunta}"
+
+INFORMAÇÕES RELEVANTES DAS BULAS:
+---
+{contexto}
+---
+
+INSTRUÇÕES:
+1. Com base **estritamente** nas informações fornecidas, sugira até DOIS produtos relevantes.
+2. Para cada produto, extraia o NOME EXATO e crie uma descrição curta e convincente.
+3. Formato da Resposta:
+   **Produto 1:** [Nome do Produto]
+   **Descrição:** [Sua descrição]
+
+   **Produto 2:** [Nome do Produto]
+   **Descrição:** [Sua descrição]
+4. Se as informações não forem suficientes para uma recomendação segura, responda APENAS com: "Com base nas informações disponíveis, não encontrei um produto específico para a sua solicitação. Poderia reformular a sua pergunta ou gostaria de falar com um especialista?"
+5. NUNCA invente nomes de produtos ou informações técnicas.
+"""
+    return _run_rag_chain(problema_agricola, db, llm, prompt_template,
+                          ferramenta=BuscaRecomendacao.__name__,
+                          argumentos={"problema_agricola": problema_agricola}, progresso=progresso, docs=docs)
+
+def ferramenta_buscar_resposta_tecnica(nome_produto: str, pergunta_tecnica: str, db, llm, progresso=_sem_progresso):
+    """ Ferramenta que busca respostas técnicas sobre um produto. """
+    query = f"informações sobre {nome_produto} para responder: {pergunta_tecnica}"
+    prompt_template = """
+Você é um assistente técnico da Agrofel. Sua tarefa é responder a uma pergunta técnica sobre um produto, baseando-se **exclusivamente** nas informações das bulas.
+Seja preciso e cordial.
+
+PRODUTO: "{pergunta}"
+INFORMAÇÕES RELEVANTES DAS BULAS:
+---
+{contexto}
+---
+
+INSTRUÇÕES:
+1. Responda à pergunta do utilizador de forma clara e direta, usando apenas os dados fornecidos.
+2. Se a informação exata não estiver nos trechos, responda: "Não encontrei esta informação específica na bula do produto. Para detalhes técnicos, recomendo consultar um engenheiro agrônomo ou falar com um de nossos especialistas."
+3. NUNCA invente valores, dosagens ou especificações.
+"""
+    return _run_rag_chain(query, db, llm, prompt_template, nome_produto=nome_produto,
+                          ferramenta=BuscaTecnica.__name__,
+                          argumentos={"nome_produto": nome_produto, "pergunta_tecnica": pergunta_tecnica},
+                          progresso=progresso)
+
+def _formatar_dose(linha: dict) -> str:
+    alvo = linha["alvo"] + (f" (*{linha['nome_cientifico']}*)" if linha["nome_cientifico"] else "")
+    detalhes = [f"**{linha['dose']}**"]
+    if linha["volume_calda"]:
+        detalhes.append(f"calda: {linha['volume_calda']}")
+    if linha["num_aplicacoes"]:
+        detalhes.append(f"{linha['num_aplicacoes']} aplicação(ões)")
+    if linha["intervalo"]:
+        detalhes.append(f"intervalo: {linha['intervalo']}")
+    cultura = linha["cultura"].capitalize() if linha["cultura"] else "Cultura não indicada"
+    return f"- {cultura} — {alvo}: {', '.join(detalhes)} _(bula {linha['arquivo']}, pág. {linha['pagina']})_"
+
+def ferramenta_consultar_dose(nome_produto: str, pergunta_tecnica: str, db, llm, progresso=_sem_progresso):
+    """
+    Responde a perguntas de dose com a tabela gravada na ingestão (agrofel.doses), sem busca
+    vetorial nem LLM. Sem linhas para o produto, segue para a BuscaTecnica.
+    """
+    progresso("A consultar a tabela de doses...")
+    with rastreio.etapa("doses") as etapa:
+        chave = db.produtos.resolver(nome_produto) if db.produtos is not None and nome_produto else None
+        linhas = db.doses.consultar(chave, pergunta_tecnica or "") if chave is not None and db.doses is not None else []
+        etapa["linhas"] = len(linhas)
+    if not linhas:
+        return ferramenta_buscar_resposta_tecnica(nome_produto, pergunta_tecnica, db, llm, progresso)
+
+    produto = linhas[0]["produto"]
+    partes = [f"Doses de **{produto}** indicadas na bula:", ""]
+    partes += [_formatar_dose(linha) for linha in linhas[:MAX_LINHAS_DOSE]]
+    if len(linhas) > MAX_LINHAS_DOSE:
+        partes.append(f"- ... e mais {len(linhas) - MAX_LINHAS_DOSE} indicações. Diga a cultura e a planta daninha para filtrar.")
+    partes += ["", "Confirme sempre a dose e as condições de aplicação na bula e com um engenheiro agrônomo."]
+    return "\n".join(partes)
+
+def orquestrador_conversacional(query: str, chat_history: list, db, llm, progresso=_sem_progresso,
+                                historico: HistoricoConversa = None):
+    """
+    O cérebro do agente. Analisa a intenção e chama a ferramenta correta.
+    Os casos fáceis são decididos pelo roteador local; o LLM só escolhe a ferramenta
+    quando a confiança local fica abaixo de roteador.LIMIAR_CONFIANCA.
+    `progresso` recebe uma descrição de cada etapa, para mostrar ao utilizador.
+    Com EXECUCAO_ESPECULATIVA, o embedding da pergunta e a busca de BuscaRecomendacao correm
+    em paralelo com a chamada ao LLM e são descartados se ele escolher outra ferramenta.
+    `historico` (guardado na sessão) limita o histórico enviado ao LLM; sem ele, é criado para este turno.
+    """
+    progresso("A identificar a intenção da pergunta...")
+    historico = historico or HistoricoConversa(db.produtos)
+    historico.atualizar(chat_history)
+    with rastreio.etapa("roteador_local") as etapa:
+        decisao = roteador.classificar(query, chat_history, db.produtos, historico.produto_fixado)
+        etapa.atualizar(ferramenta=decisao.ferramenta, confianca=decisao.confianca,
+                        decidido=decisao.confianca >= roteador.LIMIAR_CONFIANCA)
+    if decisao.confianca >= roteador.LIMIAR_CONFIANCA:
+        roteador.estatisticas.registar(decisao)
+        return _executar_ferramenta(decisao.ferramenta, decisao.argumentos, query, db, llm, progresso)
+
+    roteador.estatisticas.registar()
+    especulacao = None
+    if EXECUCAO_ESPECULATIVA:
+        # As etapas da busca especulativa ficam no mesmo turno do rastreio.
+        especulacao = carregar_executor().submit(rastreio.no_contexto_atual(buscar_documentos), query, db)
+    # Últimas trocas literais + resumo das anteriores, dentro de um orçamento de tokens.
+    historico_formatado = historico.formatar()
+    
+    prompt_roteador = f"""
+Você é o orquestrador de um chatbot de agronomia. Sua tarefa é analisar a ÚLTIMA PERGUNTA DO UTILIZADOR e o HISTÓRICO DA CONVERSA para decidir qual ferramenta chamar. Seja cordial e profissional.
+
+- Se a pergunta for uma saudação, despedida ou conversa informal (ex: 'Olá', 'Boa noite', 'Obrigado', 'Quem é você?'), use a ferramenta `ResponderConversa`.
+- Se a pergunta for geral, sobre um problema agrícola (ex: 'praga na soja', 'o que usar para guanxuma'), use a ferramenta `BuscaRecomendacao`.
+- Se a pergunta for sobre a dose de um produto específico, citado na pergunta ou no histórico (ex: 'qual a dose do Glyphotal para buva na soja?', 'quantos litros por hectare desse produto?'), use a ferramenta `BuscaDose`.
+- Se a pergunta for claramente sobre um produto específico já mencionado no histórico (ex: 'como aplicar o Glyphotal?', 'qual o intervalo de reentrada desse produto?'), use a ferramenta `BuscaTecnica`.
+
+HISTÓRICO DA CONVERSA:
+{historico_formatado}
+
+ÚLTIMA PERGUNTA DO UTILIZADOR: {query}
+"""
+    
+    with rastreio.etapa("roteador_llm") as etapa:
+        try:
+            analise = llm.invocar(prompt_roteador, ferramentas=[BuscaRecomendacao, BuscaTecnica, BuscaDose, ResponderConversa])
+        except TempoEsgotado as e:
+            print(f"AVISO: {e} Segue a escolha do roteador local ({decisao.ferramenta}).")
+            etapa.atualizar(ferramenta=decisao.ferramenta, esgotado=True)
+            analise = None
+        else:
+            # Contagem da API quando disponível; senão, a estimativa de ~4 caracteres por token.
+            uso = getattr(analise, "usage_metadata", None) or {}
+            etapa.atualizar(
+                tokens_entrada=uso.get("input_tokens", estimar_tokens(prompt_roteador)),
+                tokens_saida=uso.get("output_tokens", 0),
+                ferramenta=analise.tool_calls[0]["name"] if analise.tool_calls else "nenhuma",
+            )
+
+    if analise is None:
+        # Sem tempo para o LLM escolher, a melhor hipótese do roteador local vale mais do que nenhuma resposta.
+        docs = _resultado_especulativo(especulacao, decisao.ferramenta, decisao.argumentos, query)
+        return _executar_ferramenta(decisao.ferramenta, decisao.argumentos, query, db, llm, progresso, docs)
+
+    if not analise.tool_calls:
+        if especulacao is not None:
+            especulacao.cancel()
+        return "Peço desculpa, não consegui entender a sua pergunta. Poderia tentar reformulá-la de outra maneira?"
+    
+    ferramenta_chamada = analise.tool_calls[0]
+    docs = _resultado_especulativo(especulacao, ferramenta_chamada['name'], ferramenta_chamada['args'], query)
+    return _executar_ferramenta(ferramenta_chamada['name'], ferramenta_chamada['args'], query, db, llm, progresso, docs)
+
+def _resultado_especulativo(especulacao, nome_ferramenta: str, argumentos: dict, query: str):
+    """
+    Os documentos da busca especulativa servem se o LLM escolheu BuscaRecomendacao sem
+    acrescentar ao problema termos que não estão na pergunta (ex.: a cultura vinda do histórico).
+    """
+    if especulacao is None:
+        return None
+    problema = argumentos.get("problema_agricola", query)
+    if nome_ferramenta != BuscaRecomendacao.__name__ or not set(tokenizar(problema)) <= set(tokenizar(query)):
+        especulacao.cancel()
+        roteador.estatisticas.registar_especulacao(aproveitada=False)
+        return None
+    try:
+        docs = especulacao.result()
+    except Exception as e:
+        print(f"AVISO: falha na busca especulativa ({e}). A buscar de novo.")
+        return None
+    roteador.estatisticas.registar_especulacao(aproveitada=True)
+    return docs
+
+def _executar_ferramenta(nome_ferramenta: str, argumentos: dict, query: str, db, llm,
+                         progresso=_sem_progresso, docs: list = None):
+    """ Executa a ferramenta escolhida pelo roteador local ou pelo LLM. """
+    rastreio.anotar(ferramenta=nome_ferramenta, especulacao_aproveitada=docs is not None)
+    if nome_ferramenta == ResponderConversa.__name__:
+        return argumentos.get("resposta_cordial", "Olá! Como posso ajudar?")
+
+    if nome_ferramenta == BuscaDose.__name__:
+        return ferramenta_consultar_dose(
+            nome_produto=argumentos.get("nome_produto"),
+            pergunta_tecnica=argumentos.get("pergunta_tecnica"),
+            db=db,
+            llm=llm,
+            progresso=progresso
+        )
+
+    if nome_ferramenta == BuscaTecnica.__name__:
+        return ferramenta_buscar_resposta_tecnica(
+            nome_produto=argumentos.get("nome_produto"),
+            pergunta_tecnica=argumentos.get("pergunta_tecnica"),
+            db=db,
+            llm=llm,
+            progresso=progresso
+        )
+    
+    problema_agricola = argumentos.get("problema_agricola", query)
+    # Pares cultura × alvo frequentes ("buva na soja") já têm a resposta gravada pelo job de aquecimento.
+    with rastreio.etapa("respostas_aquecidas") as etapa:
+        resposta = carregar_respostas_aquecidas(db).obter(problema_agricola)
+        etapa["acerto"] = resposta is not None
+    if resposta is not None:
+        return resposta
+
+    return ferramenta_buscar_recomendacao(
+        problema_agricola=problema_agricola,
+        db=db,
+        llm=llm,
+        progresso=progresso,
+        docs=docs
+    )
+
+# --- Guardrail de Segurança de Entrada ---
+def is_input_safe(query: str) -> bool:
+    """ Verifica se a entrada do utilizador contém linguagem inadequada. """
+    # Esta é uma lista de exemplo. Pode ser expandida com mais termos.
+    blocklist = ["palavrão", "insulto", "ofensa", "agressão"]
+    query_lower = query.lower()
+    if any(word in query_lower for word in blocklist):
+        return False
+    return True
+
+
+# --- MOTOR ---
+
+class Motor:
+    """
+    Base de conhecimento e LLM de um processo, partilhados (só leitura) por todas as sessões
+    e threads. Cada turno é atendido por `responder`; o histórico de cada conversa fica com
+    quem chama (a sessão do Streamlit ou o serviço).
+    """
+
+    def __init__(self, db, llm):
+        self.db = db
+        self.llm = llm
+        # Contadores mostrados na página de diagnóstico (pages/Diagnostico.py), só para administradores.
+        rastreio.registar_painel("roteador", roteador.estatisticas.resumo)
+        rastreio.registar_painel("cache_respostas", carregar_cache_respostas().estatisticas)
+        rastreio.registar_painel("contexto", montagem_contexto.estatisticas.resumo)
+        rastreio.registar_painel("respostas_aquecidas", carregar_respostas_aquecidas(db).estatisticas)
+        rastreio.registar_painel("llm", llm.estatisticas)
+        if isinstance(db, BaseParticionada):
+            rastreio.registar_painel("particoes", db.estatisticas)
+
+    @classmethod
+    def carregar(cls, caminho: str = CAMINHO_INDEX_FAISS):
+        return cls(*carregar_base_conhecimento(caminho))
+
+    def novo_historico(self) -> HistoricoConversa:
+        return HistoricoConversa(self.db.produtos)
+
+    def responder(self, pergunta: str, mensagens: list, historico: HistoricoConversa = None, progresso=_sem_progresso):
+        """
+        Um turno da conversa: `mensagens` são as anteriores à pergunta ({"role", "content"}).
+        Devolve o texto (respostas fixas ou do cache) ou um gerador com os tokens do LLM.
+        """
+        if not is_input_safe(pergunta):
+            return MENSAGEM_LINGUAGEM_INADEQUADA
+        # As chamadas ao LLM do turno (escolha da ferramenta e início da geração) partilham um prazo.
+        with orcamento_turno():
+            return orquestrador_conversacional(pergunta, mensagens, self.db, self.llm, progresso=progresso,
+                                               historico=historico or self.novo_historico())
+
@@ -0,0 +1,328 @@
+# agrofel/particoes.py
+"""
+Base de conhecimento dividida em partições (ver CRITERIO_PARTICOES no 1_Criar_Base_Vetorial.py).
+Cada partição é uma base completa do agrofel.armazem em particoes/<nome>/; a pasta da
+base guarda só o que é de todas:
+- particoes.json: o resumo de roteamento de cada partição (arquivos, produtos, nº de
+  chunks e de tokens, tamanho e em quantos chunks aparece cada termo);
+- produtos.json e doses.sqlite: os de toda a base. As posições dos produtos são globais:
+  o deslocamento da partição no resumo mais a posição do chunk nela.
+A BaseParticionada só lê o resumo ao abrir. Cada partição é carregada na primeira busca
+que precisa dela e descartada (a usada há mais tempo) quando as carregadas passam de
+AGROFEL_PARTICOES_MEMORIA_MB. Uma busca vai só às partições com os termos da pergunta
+e junta os candidatos de todas: as distâncias já são comparáveis (o modelo de embeddings
+é o mesmo) e o BM25 usa o idf e o comprimento médio de toda a base.
+"""
+import os
+import json
+import math
+import shutil
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from agrofel import rastreio
+from agrofel.armazem import (
+    ArmazemChunks, BaseConhecimento, expandir_pais, existe_armazem, gravar_armazem, gravar_produtos_e_doses,
+)
+from agrofel.doses import carregar_tabela_doses
+from agrofel.lexical import carregar_indice_lexico, fundir_rrf, remover_acentos, tokenizar
+from agrofel.produtos import carregar_indice_produtos
+
+ARQUIVO_PARTICOES = "particoes.json"
+PASTA_PARTICOES = "particoes"
+VERSAO_PARTICOES = 1
+
+# Tamanho em disco (MB) das partições carregadas a partir do qual se descarta a usada há mais tempo
+MEMORIA_MAX_MB = float(os.getenv("AGROFEL_PARTICOES_MEMORIA_MB", 1024))
+# Partições com pontuação de roteamento abaixo desta fração da melhor ficam fora da busca
+FRACAO_ROTEAMENTO = float(os.getenv("AGROFEL_PARTICOES_FRACAO", 0.3))
+
+
+def tipo_documento(nome_arquivo: str, primeira_pagina: str) -> str:
+    """
+    'fispq', 'certificados' ou 'bulas' (bulas e rótulos, que respondem às mesmas perguntas),
+    pelo nome do arquivo ou, nos nomes só numéricos do Agrofit, pelo título da primeira página.
+    """
+    nome, texto = remover_acentos(nome_arquivo).lower(), " ".join(remover_acentos(primeira_pagina).lower().split())
+    if "fispq" in nome or "ficha de informacoes de seguranca" in texto:
+        return "fispq"
+    if "certificado" in nome or "certificado de registro" in texto:
+        return "certificados"
+    return "bulas"
+
+# Critério -> função (nome do arquivo, texto da primeira página) -> nome da partição
+CRITERIOS = {"tipo": tipo_documento}
+
+
+def particao_do_arquivo(criterio: str, nome_arquivo: str, primeira_pagina: str) -> str:
+    """ Partição de um PDF segundo o critério; '' (base única) sem critério. """
+    return CRITERIOS[criterio](nome_arquivo, primeira_pagina) if criterio else ""
+
+def existe_base_particionada(pasta: str) -> bool:
+    return os.path.exists(os.path.join(pasta, ARQUIVO_PARTICOES))
+
+def pasta_da_particao(pasta: str, nome: str) -> str:
+    return os.path.join(pasta, PASTA_PARTICOES, nome)
+
+def versao_base_particionada(pasta: str) -> tuple:
+    """ O resumo é sempre regravado depois das partições, por isso muda com qualquer uma delas. """
+    estado = os.stat(os.path.join(pasta, ARQUIVO_PARTICOES))
+    return estado.st_mtime_ns, estado.st_size
+
+def carregar_resumo(pasta: str) -> dict:
+    with open(os.path.join(pasta, ARQUIVO_PARTICOES), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _tamanho_mb(pasta: str) -> float:
+    return round(sum(os.path.getsize(os.path.join(pasta, a)) for a in os.listdir(pasta)) / 2**20, 2)
+
+def gravar_particao(pasta: str, nome: str, ids: list, textos: list, metadatas: list, vetores: np.ndarray,
+                    config_indice: dict = None, pais: list = None):
+    """
+    Grava uma partição como uma base completa (ver gravar_armazem); as restantes não são
+    tocadas. O resumo e os índices de toda a base ficam para o gravar_resumo_particoes.
+    """
+    gravar_armazem(pasta_da_particao(pasta, nome), ids, textos, metadatas, vetores, config_indice, pais)
+
+def remover_particao(pasta: str, nome: str):
+    shutil.rmtree(pasta_da_particao(pasta, nome), ignore_errors=True)
+
+def remover_particoes(pasta: str):
+    """ Apaga as partições e o resumo (ao voltar a uma base única). """
+    shutil.rmtree(os.path.join(pasta, PASTA_PARTICOES), ignore_errors=True)
+    if existe_base_particionada(pasta):
+        os.remove(os.path.join(pasta, ARQUIVO_PARTICOES))
+
+def gravar_resumo_particoes(pasta: str, criterio: str) -> int:
+    """
+    Regrava, a partir das partições em disco, o índice de produtos e a tabela de doses de
+    toda a base e, por último, o particoes.json. Devolve o nº de linhas da tabela de doses.
+    """
+    raiz = os.path.join(pasta, PASTA_PARTICOES)
+    nomes = sorted(n for n in os.listdir(raiz) if existe_armazem(os.path.join(raiz, n))) if os.path.isdir(raiz) else []
+    resumo, textos, metadatas, pais = {}, [], [], []
+    for nome in nomes:
+        armazem = ArmazemChunks(pasta_da_particao(pasta, nome))
+        documentos = [armazem.documento(i) for i in range(len(armazem))]
+        lexico = carregar_indice_lexico(pasta_da_particao(pasta, nome))
+        resumo[nome] = {
+            "chunks": len(documentos),
+            "deslocamento": len(textos),
+            "tokens": int(lexico.comprimentos.sum()),
+            "tamanho_mb": _tamanho_mb(pasta_da_particao(pasta, nome)),
+            "arquivos": armazem.bulas(),
+            "termos": lexico.frequencia_documentos(),
+        }
+        textos += [d.page_content for d in documentos]
+        metadatas += [d.metadata for d in documentos]
+        pais += armazem.pais()
+        armazem.fechar()
+
+    linhas_doses = gravar_produtos_e_doses(pasta, textos, metadatas, pais or None)
+    produtos = carregar_indice_produtos(pasta)
+    for dados in resumo.values():
+        inicio, fim = dados["deslocamento"], dados["deslocamento"] + dados["chunks"]
+        dados["produtos"] = sorted(
+            chave for chave, produto in produtos.produtos.items() if any(inicio <= p < fim for p in produto["posicoes"])
+        )
+
+    caminho = os.path.join(pasta, ARQUIVO_PARTICOES)
+    with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"versao": VERSAO_PARTICOES, "criterio": criterio, "particoes": resumo}, f, ensure_ascii=False)
+    os.replace(caminho + ".tmp", caminho)
+    return linhas_doses
+
+
+class BaseParticionada:
+    """
+    Mesma interface da BaseConhecimento para o motor (busca_hibrida, busca_por_produto,
+    expandir_pais, produtos, doses, versao...), sobre as partições de uma base.
+    Partições carregadas depois de uma reconstrução viriam já dos arquivos novos; por
+    isso, quando o particoes.json muda, o resumo, os produtos e as doses são relidos e as
+    partições carregadas até aí deixam de ser usadas.
+    """
+
+    def __init__(self, pasta: str, embeddings, nprobe: int = None, ef_search: int = None,
+                 memoria_max_mb: float = MEMORIA_MAX_MB, fracao_roteamento: float = FRACAO_ROTEAMENTO):
+        self.pasta = pasta
+        self.embeddings = embeddings
+        self.memoria_max_mb = memoria_max_mb
+        self.fracao_roteamento = fracao_roteamento
+        self._parametros_busca = {"nprobe": nprobe, "ef_search": ef_search}
+        self._lock = threading.Lock()
+        self._carregadas = OrderedDict()
+        self.carregamentos = 0
+        self.despejos = 0
+        self.consultas = 0
+        self._particoes_consultadas = Counter()
+        self._abrir()
+
+    def _abrir(self):
+        self._versao = versao_base_particionada(self.pasta)
+        self.particoes = carregar_resumo(self.pasta)["particoes"]
+        self.produtos = carregar_indice_produtos(self.pasta)
+        self.doses = carregar_tabela_doses(self.pasta)
+        self._particao_do_sha = {sha: nome for nome, dados in self.particoes.items() for sha in dados["arquivos"].values()}
+        self._df = Counter()
+        for dados in self.particoes.values():
+            self._df.update(dados["termos"])
+        self._total_chunks = sum(dados["chunks"] for dados in self.particoes.values())
+        self._comprimento_medio = sum(dados["tokens"] for dados in self.particoes.values()) / max(self._total_chunks, 1)
+        self._carregadas = OrderedDict()
+
+    def _atualizar(self):
+        with self._lock:
+            if versao_base_particionada(self.pasta) != self._versao:
+                print(f"[partições] '{self.pasta}' foi regravada; a reler o resumo.")
+                self._abrir()
+
+    def versao(self) -> tuple:
+        return versao_base_particionada(self.pasta)
+
+    def bulas(self) -> dict:
+        return {arquivo: sha for dados in self.particoes.values() for arquivo, sha in dados["arquivos"].items()}
+
+    def memoria_mb(self) -> float:
+        return sum(self.particoes[nome]["tamanho_mb"] for nome in self._carregadas)
+
+    def particao(self, nome: str) -> BaseConhecimento:
+        """ A partição, carregada na primeira vez; as outras são descartadas acima do limite de memória. """
+        with self._lock:
+            db = self._carregadas.get(nome)
+            if db is not None:
+                self._carregadas.move_to_end(nome)
+                return db
+            with rastreio.etapa("carregar_particao", particao=nome, tamanho_mb=self.particoes[nome]["tamanho_mb"]):
+                db = BaseConhecimento(pasta_da_particao(self.pasta, nome), self.embeddings, **self._parametros_busca)
+            self._carregadas[nome] = db
+            self.carregamentos += 1
+            # Uma busca em curso numa partição descartada continua com a sua referência; a
+            # memória só é libertada quando ela termina.
+            while len(self._carregadas) > 1 and self.memoria_mb() > self.memoria_max_mb:
+                self._carregadas.popitem(last=False)
+                self.despejos += 1
+            return db
+
+    def escolher_particoes(self, query: str) -> list:
+        """
+        Partições onde procurar a pergunta, pela pontuação Σ idf(termo) · log(1 + chunks da
+        partição com o termo): ficam as que chegam a `fracao_roteamento` da melhor, mais as
+        dos produtos citados. Sem nenhum termo conhecido, todas.
+        """
+        pontuacoes = {nome: 0.0 for nome in self.particoes}
+        for termo in set(tokenizar(query)):
+            if not self._df.get(termo):
+                continue
+            idf = math.log(1 + self._total_chunks / self._df[termo])
+            for nome, dados in self.particoes.items():
+                pontuacoes[nome] += idf * math.log1p(dados["termos"].get(termo, 0))
+        melhor = max(pontuacoes.values(), default=0.0)
+        if melhor <= 0:
+            return sorted(self.particoes)
+        escolhidas = {nome for nome, pontuacao in pontuacoes.items() if pontuacao >= self.fracao_roteamento * melhor}
+        for chave in (self.produtos.produtos_mencionados(query) if self.produtos is not None else []):
+            escolhidas |= {nome for nome, dados in self.particoes.items() if chave in dados["produtos"]}
+        return sorted(escolhidas)
+
+    def _estatisticas_bm25(self, query: str) -> dict:
+        """ idf (como no IndiceBM25) e comprimento médio de toda a base, para os termos da pergunta. """
+        n = self._total_chunks
+        idf = {t: float(np.log(1 + (n - self._df[t] + 0.5) / (self._df[t] + 0.5))) for t in set(tokenizar(query)) if self._df.get(t)}
+        return {"idf": idf, "comprimento_medio": self._comprimento_medio}
+
+    def _buscar(self, query: str, k: int, candidatos: int = None, posicoes: dict = None, nomes: list = None) -> list:
+        """
+        Junta os candidatos das partições `nomes` (ou das de `posicoes`: partição -> posições
+        nela) e funde a busca vetorial e o BM25 por RRF, como a BaseConhecimento.
+        """
+        self._atualizar()
+        nomes = sorted(posicoes) if posicoes is not None else nomes
+        vetor = self.embeddings.embed_query(query)
+        bm25 = self._estatisticas_bm25(query)
+        bases, densos, lexicos = {}, [], []
+        for nome in nomes:
+            bases[nome] = self.particao(nome)
+            d, l = bases[nome].candidatos(vetor, query, candidatos, posicoes[nome] if posicoes is not None else None, bm25)
+            densos += [((nome, p), distancia) for p, distancia in d]
+            lexicos += [((nome, p), pontuacao) for p, pontuacao in l]
+        densos = [c for c, _ in sorted(densos, key=lambda c: c[1])[:candidatos]]
+        lexicos = [c for c, _ in sorted(lexicos, key=lambda c: -c[1])[:candidatos]]
+        with self._lock:
+            self.consultas += 1
+            self._particoes_consultadas.update(nomes)
+        rastreio.anotar(particoes=",".join(nomes))
+        return [bases[nome].armazem.documento(p) for nome, p in fundir_rrf([densos, lexicos], k)]
+
+    def busca_hibrida(self, query: str, k: int = 4, candidatos: int = 20) -> list:
+        return self._buscar(query, k, candidatos, nomes=self.escolher_particoes(query))
+
+    def busca_por_produto(self, query: str, nome_produto: str, k: int = 4) -> list:
+        """ Só nas partições com chunks do produto; se ele não for reconhecido, busca híbrida. """
+        chave = self.produtos.resolver(nome_produto) if self.produtos is not None else None
+        if chave is None:
+            return self.busca_hibrida(query, k)
+        posicoes = {}
+        for posicao in self.produtos.posicoes(chave):
+            for nome, dados in self.particoes.items():
+                if dados["deslocamento"] <= posicao < dados["deslocamento"] + dados["chunks"]:
+                    posicoes.setdefault(nome, []).append(posicao - dados["deslocamento"])
+        return self._buscar(query, k, posicoes=posicoes)
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list:
+        self._atualizar()
+        vetor = self.embeddings.embed_query(query)
+        resultados = []
+        for nome in self.escolher_particoes(query):
+            resultados += self.particao(nome).similarity_search_by_vector_with_score(vetor, k)
+        return sorted(resultados, key=lambda r: r[1])[:k]
+
+    def similarity_search(self, query: str, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def pai(self, id_pai: str):
+        # Os ids são "<sha256 do PDF>-<n>", e a secção está na partição do seu PDF.
+        nome = self._particao_do_sha.get(id_pai.rsplit("-", 1)[0])
+        return self.particao(nome).pai(id_pai) if nome is not None else None
+
+    def expandir_pais(self, docs: list) -> list:
+        return expandir_pais(docs, self.pai)
+
+    def estatisticas(self) -> dict:
+        """ Para a página de diagnóstico. """
+        with self._lock:
+            return {
+                "particoes": len(self.particoes),
+                "carregadas": list(self._carregadas),
+                "memoria_mb": round(self.memoria_mb(), 2),
+                "memoria_max_mb": self.memoria_max_mb,
+                "carregamentos": self.carregamentos,
+                "despejos": self.despejos,
+                "consultas": self.consultas,
+                "particoes_por_consulta":
+                    round(sum(self._particoes_consultadas.values()) / self.consultas, 2) if self.consultas else 0.0,
+                "consultas_por_particao": dict(self._particoes_consultadas),
+            }
+
+    def fechar(self):
+        with self._lock:
+            for db in self._carregadas.values():
+                db.fechar()
+            self._carregadas.clear()
+
+
+def existe_base(pasta: str) -> bool:
+    """ Base particionada ou base única. """
+    return existe_base_particionada(pasta) or existe_armazem(pasta)
+
+def abrir_base(pasta: str, embeddings, **parametros_busca):
+    """ BaseParticionada ou BaseConhecimento, conforme o formato da base em `pasta`. """
+    classe = BaseParticionada if existe_base_particionada(pasta) else BaseConhecimento
+    return classe(pasta, embeddings, **parametros_busca)
+
+def pastas_dos_armazens(pasta: str) -> list:
+    """ A pasta de cada partição, pela ordem do resumo (a dos deslocamentos), ou só a da base única. """
+    if not existe_base_particionada(pasta):
+        return [pasta]
+    return [pasta_da_particao(pasta, nome) for nome in carregar_resumo(pasta)["particoes"]]
@@ -0,0 +1,194 @@
+# agrofel/produtos.py
+"""
+Índice nome de produto -> chunks, construído a partir do nome do arquivo da bula e da
+sua página de rosto. Permite que uma pergunta técnica sobre um produto conhecido seja
+respondida buscando apenas nos chunks desse produto.
+"""
+import os
+import re
+import json
+import difflib
+
+from agrofel.lexical import remover_acentos
+
+ARQUIVO_PRODUTOS = "produtos.json"
+
+# Palavras dos nomes de arquivo que não fazem parte do nome comercial
+_PALAVRAS_ARQUIVO_IGNORADAS = frozenset(
+    "bula rotulo certificado registro de do da n no mapa rev ver fispq cr comp pack out set".split()
+)
+# Sufixos de formulação: "ATRAZINA NORTOX 500 SC" também é conhecido como "ATRAZINA NORTOX"
+_FORMULACOES = frozenset("sc ec sl wg wp ew cs od se me gr dc sg ce".split())
+_REGISTRADO = re.compile(r"registrado\s+no\s+minist", re.IGNORECASE)
+_MARCA_COMERCIAL = re.compile(r"(?:marca|nome)\s+comercial\s*:?\s*(.+)", re.IGNORECASE)
+
+
+def normalizar_nome(nome: str) -> str:
+    """ 'GLYPHOTAL® TR' -> 'glyphotal tr'. """
+    return " ".join(re.findall(r"[a-z0-9]+", remover_acentos(nome).lower()))
+
+def _linha_de_nome(linha: str) -> bool:
+    """ Linha curta, quase toda em maiúsculas, que não é cabeçalho nem título de secção. """
+    letras = [c for c in linha if c.isalpha()]
+    if len(letras) < 2 or (len(linha) > 40 and ", " not in linha):
+        return False
+    if linha.endswith((":", ".")) or linha.upper().startswith(("BULA", "VER ", "REV", "RÓTULO", "ROTULO")):
+        return False
+    return sum(c.isupper() for c in letras) / len(letras) >= 0.8
+
+def nome_da_pagina_de_rosto(texto: str):
+    """
+    Nas bulas o nome comercial vem em maiúsculas logo antes de "Registrado no Ministério da
+    Agricultura...", às vezes seguido de uma linha com as outras marcas do mesmo registo
+    ("DECORUM" / "AMINESPRAY, CADMA, HEDONAL"). Nos certificados vem após "Marca Comercial:".
+    Devolve (nome, outras_marcas) ou (None, []).
+    """
+    registro = _REGISTRADO.search(texto)
+    if registro:
+        bloco = []
+        for linha in reversed(texto[:registro.start()].splitlines()):
+            linha = linha.strip()
+            if not linha:
+                continue
+            if not _linha_de_nome(linha) or len(bloco) == 3:
+                break
+            bloco.insert(0, linha)
+        # ", " separa marcas; "2,4-D AGROIMPORT" é um nome só.
+        outras_marcas = [m.strip() for linha in bloco if ", " in linha for m in linha.split(", ") if m.strip()]
+        nome = ""
+        for linha in (l for l in bloco if ", " not in l):
+            # O extrator de PDF às vezes parte o nome: "SEL" / "ECT 240 EC", "TRUN" / "FO".
+            nome = nome + linha if nome and len(nome) <= 4 and " " not in nome else linha
+        if not nome and outras_marcas:
+            nome, outras_marcas = outras_marcas[0], outras_marcas[1:]
+        nome, outras_marcas = nome.strip(" ,;®"), [m.strip(" ,;®") for m in outras_marcas]
+        if len(nome) >= 3:
+            return nome, [m for m in dict.fromkeys(outras_marcas) if m and m != nome]
+    correspondencia = _MARCA_COMERCIAL.search(texto)
+    if correspondencia:
+        return correspondencia.group(1).strip().split("  ")[0], []
+    return None, []
+
+def nome_do_arquivo(nome_arquivo: str):
+    """ 'f293879144_Bula_Decorum_REV20240828.pdf' -> 'decorum'; nomes só numéricos não dão nome. """
+    palavras = normalizar_nome(os.path.splitext(nome_arquivo)[0].replace("_", " ")).split()
+    palavras = [
+        p for p in palavras
+        if p not in _PALAVRAS_ARQUIVO_IGNORADAS
+        # códigos internos, datas e versões: 'f2134968160', '240300', 'rev20240828', 'set2017', 'bromcomp'
+        and not re.fullmatch(r"f?\d{5,}|\d{1,2}|v\d+|[a-z]{1,3}\d{4,}|\w*comp", p)
+    ]
+    return " ".join(palavras) or None
+
+def _grupo_arquivo(nome_arquivo: str) -> str:
+    """ '10186459_1.pdf' e '10186459.pdf' são a bula e o rótulo do mesmo produto. """
+    numero = re.match(r"(\d{5,})", nome_arquivo)
+    return numero.group(1) if numero else nome_arquivo
+
+def _aliases(nome: str, outras_marcas: list = ()) -> set:
+    normalizado = normalizar_nome(nome)
+    aliases = {normalizado, normalizado.replace(" ", "")} | {normalizar_nome(m) for m in outras_marcas}
+    palavras = normalizado.split()
+    # Sem a formulação e a concentração no fim ("atrazina nortox 500 sc" -> "atrazina nortox")
+    while len(palavras) > 1 and (palavras[-1] in _FORMULACOES or palavras[-1].isdigit()):
+        palavras = palavras[:-1]
+        aliases.add(" ".join(palavras))
+    if len(palavras) > 1 and len(palavras[0]) >= 5:
+        aliases.add(palavras[0])
+    return {a for a in aliases if len(a) >= 3}
+
+
+class IndiceProdutos:
+    """ Resolve um nome de produto (com erros de digitação) para as posições dos seus chunks. """
+
+    def __init__(self, produtos: dict):
+        self.produtos = produtos
+        self._alias_para_produto = {
+            alias: nome for nome, dados in produtos.items() for alias in dados["aliases"]
+        }
+
+    @classmethod
+    def construir(cls, metadatas: list, textos: list, rostos=None) -> "IndiceProdutos":
+        """ `rostos` são pares (metadata, texto) onde procurar o nome; por omissão, os próprios chunks. """
+        # 1) nome por arquivo: página de rosto, senão outro arquivo do mesmo produto, senão nome do arquivo
+        nomes_por_grupo, nomes_por_arquivo = {}, {}
+        for metadata, texto in (rostos if rostos is not None else zip(metadatas, textos)):
+            arquivo = metadata.get("source", "")
+            if metadata.get("page", 0) <= 1 and arquivo not in nomes_por_arquivo:
+                nome, outras_marcas = nome_da_pagina_de_rosto(texto)
+                if nome:
+                    nomes_por_arquivo[arquivo] = (nome, outras_marcas, True)
+                    nomes_por_grupo.setdefault(_grupo_arquivo(arquivo), (nome, outras_marcas, True))
+        arquivos = {m.get("source", "") for m in metadatas}
+        for arquivo in arquivos - set(nomes_por_arquivo):
+            nome = nomes_por_grupo.get(_grupo_arquivo(arquivo))
+            if nome is None and nome_do_arquivo(arquivo):
+                nome = (nome_do_arquivo(arquivo), [], False)
+            if nome:
+                nomes_por_arquivo[arquivo] = nome
+
+        # 2) agrupa arquivos e chunks pelo nome normalizado
+        produtos = {}
+        for posicao, metadata in enumerate(metadatas):
+            if metadata.get("source", "") not in nomes_por_arquivo:
+                continue
+            nome, outras_marcas, da_pagina = nomes_por_arquivo[metadata["source"]]
+            dados = produtos.setdefault(
+                normalizar_nome(nome), {"nome": nome, "outras_marcas": [], "arquivos": [], "posicoes": []}
+            )
+            if metadata["source"] not in dados["arquivos"]:
+                dados["arquivos"].append(metadata["source"])
+                # A grafia da página de rosto ("GLYPHOTAL TR") vale mais do que a do nome do arquivo.
+                if da_pagina:
+                    dados["nome"] = nome
+                dados["outras_marcas"] = list(dict.fromkeys(dados["outras_marcas"] + outras_marcas))
+            dados["posicoes"].append(posicao)
+
+        # 3) aliases; os que servem a mais de um produto são ambíguos e ficam de fora
+        contagem = {}
+        for chave, dados in produtos.items():
+            dados["aliases"] = sorted(_aliases(dados["nome"], dados["outras_marcas"]))
+            for alias in dados["aliases"]:
+                contagem[alias] = contagem.get(alias, 0) + 1
+        for chave, dados in produtos.items():
+            dados["aliases"] = [a for a in dados["aliases"] if contagem[a] == 1 or a == chave]
+        return cls(produtos)
+
+    def gravar(self, caminho: str):
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump({"produtos": self.produtos}, f, ensure_ascii=False)
+
+    @classmethod
+    def carregar(cls, caminho: str) -> "IndiceProdutos":
+        with open(caminho, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["produtos"])
+
+    def resolver(self, nome_produto: str, limiar: float = 0.75):
+        """
+        Devolve a chave do produto: primeiro por alias exato, depois por um alias contido
+        no texto pedido ("o glyphotal tr da agrofel") e, por fim, por semelhança (difflib).
+        """
+        if not nome_produto:
+            return None
+        consulta = normalizar_nome(nome_produto)
+        if consulta in self._alias_para_produto:
+            return self._alias_para_produto[consulta]
+        mencionados = self.produtos_mencionados(nome_produto)
+        if mencionados:
+            return mencionados[0]
+        parecidos = difflib.get_close_matches(consulta, list(self._alias_para_produto), n=1, cutoff=limiar)
+        return self._alias_para_produto[parecidos[0]] if parecidos else None
+
+    def produtos_mencionados(self, texto: str) -> list:
+        """ Produtos cujos aliases aparecem como palavras inteiras no texto, do alias mais longo para o mais curto. """
+        normalizado = f" {normalizar_nome(texto)} "
+        contidos = sorted((a for a in self._alias_para_produto if f" {a} " in normalizado), key=len, reverse=True)
+        return list(dict.fromkeys(self._alias_para_produto[a] for a in contidos))
+
+    def posicoes(self, chave_produto: str) -> list:
+        return self.produtos[chave_produto]["posicoes"]
+
+
+def carregar_indice_produtos(pasta: str):
+    caminho = os.path.join(pasta, ARQUIVO_PRODUTOS)
+    return IndiceProdutos.carregar(caminho) if os.path.exists(caminho) else None
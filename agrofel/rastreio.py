@@ -0,0 +1,227 @@
+# agrofel/rastreio.py
+"""
+Rastreio leve por etapa (roteador, embedding, busca, rerank, geração, ingestão...). Cada
+etapa é medida com `with etapa("busca", k=5) as e: ...; e["docs"] = 3` e fica ligada ao
+turno em curso (`with turno("chat"):`). No fim da etapa o registo vai, numa linha JSON, para
+o arquivo AGROFEL_RASTREIO_ARQUIVO e para um agregado em memória das últimas execuções
+de cada etapa, que a página de diagnóstico mostra. O arquivo fica aberto e, ao passar de
+AGROFEL_RASTREIO_MAX_MB, passa a rastreio.jsonl.1 (e assim por diante, até
+AGROFEL_RASTREIO_COPIAS cópias), para não crescer sem limite num serviço que não para.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import logging.handlers
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Arquivo JSONL com uma linha por etapa; vazio desativa o registo em disco
+ARQUIVO_RASTREIO = os.getenv("AGROFEL_RASTREIO_ARQUIVO", "rastreio.jsonl")
+# Tamanho do arquivo a partir do qual passa a uma cópia, e cópias guardadas (as mais antigas saem)
+MAX_MB_RASTREIO = float(os.getenv("AGROFEL_RASTREIO_MAX_MB", 50))
+COPIAS_RASTREIO = int(os.getenv("AGROFEL_RASTREIO_COPIAS", 5))
+# Execuções de cada etapa mantidas no agregado em memória
+JANELA_AGREGADO = 500
+
+_turno_atual = contextvars.ContextVar("agrofel_turno", default=None)
+_etapa_atual = contextvars.ContextVar("agrofel_etapa", default=None)
+
+
+class Etapa:
+    """ Atributos de uma etapa em curso; `e["tokens_saida"] = 120` acrescenta um atributo. """
+
+    def __init__(self, nome: str, atributos: dict):
+        self.nome = nome
+        self.id = uuid.uuid4().hex[:12]
+        self.atributos = atributos
+
+    def __setitem__(self, chave: str, valor):
+        self.atributos[chave] = valor
+
+    def atualizar(self, **atributos):
+        self.atributos.update(atributos)
+
+
+class AgregadoEtapas:
+    """ Janela deslizante por etapa: duração (p50/p95), médias dos números e contagens dos restantes atributos. """
+
+    def __init__(self, janela: int = JANELA_AGREGADO):
+        self.janela = janela
+        self._lock = threading.Lock()
+        self._registos = {}
+        self._totais = Counter()
+        self._erros = Counter()
+
+    def registar(self, registo: dict):
+        with self._lock:
+            self._registos.setdefault(registo["etapa"], deque(maxlen=self.janela)).append(registo)
+            self._totais[registo["etapa"]] += 1
+            if registo.get("erro"):
+                self._erros[registo["etapa"]] += 1
+
+    def resumo(self) -> dict:
+        with self._lock:
+            registos = {nome: list(fila) for nome, fila in self._registos.items()}
+            totais, erros = dict(self._totais), dict(self._erros)
+        resumo = {}
+        for nome, lista in sorted(registos.items()):
+            duracoes = [r["duracao_ms"] for r in lista]
+            numeros, categorias = {}, {}
+            for r in lista:
+                for chave, valor in r["atributos"].items():
+                    if isinstance(valor, bool) or isinstance(valor, str):
+                        categorias.setdefault(chave, Counter())[str(valor)] += 1
+                    elif isinstance(valor, (int, float)):
+                        numeros.setdefault(chave, []).append(valor)
+            resumo[nome] = {
+                "execucoes": totais.get(nome, 0),
+                "erros": erros.get(nome, 0),
+                "p50_ms": round(float(np.percentile(duracoes, 50)), 1),
+                "p95_ms": round(float(np.percentile(duracoes, 95)), 1),
+                **{f"media_{chave}": round(float(np.mean(valores)), 1) for chave, valores in numeros.items()},
+                **{chave: dict(contagem.most_common(10)) for chave, contagem in categorias.items()},
+            }
+        return resumo
+
+    def limpar(self):
+        with self._lock:
+            self._registos.clear()
+            self._totais.clear()
+            self._erros.clear()
+
+
+class _ArquivoRotativo(logging.handlers.RotatingFileHandler):
+    """
+    Com vários workers do serviço, cada processo tem o seu handler: quando outro passa o
+    arquivo a cópia, este reabre o arquivo novo em vez de continuar a escrever na cópia.
+    """
+
+    def emit(self, record):
+        if self.stream is not None:
+            try:
+                atual = os.stat(self.baseFilename)
+                aberto = os.fstat(self.stream.fileno())
+                mudou = (atual.st_dev, atual.st_ino) != (aberto.st_dev, aberto.st_ino)
+            except FileNotFoundError:
+                mudou = True
+            if mudou:
+                self.stream.close()
+                self.stream = self._open()
+        super().emit(record)
+
+
+agregado = AgregadoEtapas()
+_registo_arquivo = logging.getLogger("agrofel.rastreio")
+_registo_arquivo.propagate = False
+_registo_arquivo.setLevel(logging.INFO)
+_lock_arquivo = threading.Lock()
+# Painéis extra da página de diagnóstico (nome -> função que devolve um dict), registados pelo Motor
+paineis = {}
+
+
+def registar_painel(nome: str, funcao):
+    paineis[nome] = funcao
+
+def arquivos_rastreio(caminho: str = ARQUIVO_RASTREIO) -> list:
+    """ O arquivo do rastreio e as cópias que ainda existem, da mais antiga para a atual. """
+    if not caminho:
+        return []
+    copias = [f"{caminho}.{i}" for i in range(COPIAS_RASTREIO, 0, -1)]
+    return [c for c in copias + [caminho] if os.path.exists(c)]
+
+def _abrir_arquivo() -> bool:
+    # Um só handler (e um só arquivo aberto) por processo, criado no primeiro registo.
+    with _lock_arquivo:
+        if not _registo_arquivo.handlers:
+            try:
+                handler = _ArquivoRotativo(
+                    ARQUIVO_RASTREIO, maxBytes=int(MAX_MB_RASTREIO * 2**20), backupCount=COPIAS_RASTREIO,
+                    encoding="utf-8",
+                )
+            except OSError as e:
+                print(f"AVISO: não foi possível gravar o rastreio em '{ARQUIVO_RASTREIO}': {e}")
+                return False
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _registo_arquivo.addHandler(handler)
+        return True
+
+def _gravar(registo: dict):
+    if not ARQUIVO_RASTREIO or not _abrir_arquivo():
+        return
+    _registo_arquivo.info(json.dumps(registo, ensure_ascii=False, default=str))
+
+@contextmanager
+def etapa(nome: str, **atributos):
+    """ Mede o bloco e regista-o no turno em curso (ou sozinho, se não houver turno). """
+    registo_etapa = Etapa(nome, atributos)
+    pai = _etapa_atual.get()
+    marcador = _etapa_atual.set(registo_etapa)
+    inicio_relogio = datetime.now(timezone.utc)
+    inicio = time.perf_counter()
+    erro = None
+    try:
+        yield registo_etapa
+    except GeneratorExit:
+        # Gerador (ex.: streaming da resposta) fechado antes do fim: não é um erro.
+        raise
+    except BaseException as e:
+        erro = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _etapa_atual.reset(marcador)
+        registo = {
+            "inicio": inicio_relogio.isoformat(timespec="milliseconds"),
+            "turno": _turno_atual.get(),
+            "etapa": nome,
+            "id": registo_etapa.id,
+            "pai": pai.id if pai is not None else None,
+            "duracao_ms": round((time.perf_counter() - inicio) * 1000, 2),
+            "atributos": registo_etapa.atributos,
+        }
+        if erro:
+            registo["erro"] = erro
+        agregado.registar(registo)
+        _gravar(registo)
+
+@contextmanager
+def turno(nome: str, **atributos):
+    """ Agrupa as etapas de um pedido (um turno do chat, uma ingestão) sob o mesmo id. """
+    marcador = _turno_atual.set(uuid.uuid4().hex[:12])
+    try:
+        with etapa(nome, **atributos) as raiz:
+            yield raiz
+    finally:
+        _turno_atual.reset(marcador)
+
+def anotar(**atributos):
+    """ Acrescenta atributos à etapa em curso, sem a passar como argumento. Fora de uma etapa, não faz nada. """
+    etapa_atual = _etapa_atual.get()
+    if etapa_atual is not None:
+        etapa_atual.atualizar(**atributos)
+
+def no_contexto_atual(funcao):
+    """ Para threads do executor: a função corre com o turno e a etapa de quem a submeteu. """
+    contexto = contextvars.copy_context()
+    return lambda *args, **kwargs: contexto.run(funcao, *args, **kwargs)
+
+def medir_latencia(resposta, inicio: float):
+    """
+    Repassa os pedaços da resposta e regista em separado o tempo até ao primeiro token
+    (o que o utilizador sente) e a latência total do turno, ambos desde `inicio`.
+    """
+    primeiro_token = None
+    for pedaco in ([resposta] if isinstance(resposta, str) else resposta):
+        if primeiro_token is None:
+            primeiro_token = time.perf_counter()
+        yield pedaco
+    fim = time.perf_counter()
+    primeiro_token = primeiro_token or fim
+    anotar(primeiro_token_ms=round((primeiro_token - inicio) * 1000, 1))
+    print(f"[latência] primeiro token: {(primeiro_token - inicio) * 1000:.0f} ms | total: {(fim - inicio) * 1000:.0f} ms")
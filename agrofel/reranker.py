@@ -0,0 +1,57 @@
+# agrofel/reranker.py
+"""
+Reordenação dos chunks recuperados com um cross-encoder local (sentence-transformers, CPU).
+Substitui a filtragem feita pelo gemini-1.5-flash no app_copia_original.py: em vez de pedir
+ao LLM que devolva os 3 melhores chunks (uma chamada lenta que às vezes reescreve o texto),
+cada par (pergunta, chunk) recebe uma pontuação e os chunks seguem inalterados.
+"""
+import os
+
+import numpy as np
+
+# Multilíngue (treinado no mMARCO), por isso entende as perguntas e as bulas em português.
+MODELO_RERANKER_PADRAO = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+TAMANHO_LOTE = 16
+# O modelo só lê os primeiros 512 tokens de cada par; o resto do chunk não conta.
+MAX_TOKENS_PAR = 512
+
+
+class ReordenadorCrossEncoder:
+    """ Pontua pares (pergunta, chunk) em lote e devolve os chunks do mais para o menos relevante. """
+
+    def __init__(self, modelo: str = None, tamanho_lote: int = TAMANHO_LOTE, dispositivo: str = "cpu"):
+        from sentence_transformers import CrossEncoder
+        self.nome_modelo = modelo or MODELO_RERANKER_PADRAO
+        self.tamanho_lote = tamanho_lote
+        self.modelo = CrossEncoder(self.nome_modelo, max_length=MAX_TOKENS_PAR, device=dispositivo)
+
+    def pontuar(self, query: str, docs: list) -> np.ndarray:
+        if not docs:
+            return np.zeros(0, dtype=np.float32)
+        pares = [(query, doc.page_content) for doc in docs]
+        return np.asarray(self.modelo.predict(pares, batch_size=self.tamanho_lote, show_progress_bar=False))
+
+    def reordenar_com_pontuacao(self, query: str, docs: list, top_n: int = None, limiar: float = None) -> list:
+        """
+        Devolve [(doc, pontuacao)] por ordem decrescente. Corta em `top_n` chunks e descarta os
+        que ficam abaixo de `limiar` (pontuação bruta do modelo), mas mantém sempre o melhor.
+        """
+        pontuacoes = self.pontuar(query, docs)
+        ordem = np.argsort(-pontuacoes, kind="stable")
+        resultado = [(docs[i], float(pontuacoes[i])) for i in ordem]
+        if limiar is not None:
+            resultado = resultado[:1] + [(doc, p) for doc, p in resultado[1:] if p >= limiar]
+        return resultado[:top_n] if top_n else resultado
+
+    def reordenar(self, query: str, docs: list, top_n: int = None, limiar: float = None) -> list:
+        return [doc for doc, _ in self.reordenar_com_pontuacao(query, docs, top_n, limiar)]
+
+
+def criar_reordenador_do_ambiente():
+    """
+    AGROFEL_RERANKER=1 ativa a reordenação; AGROFEL_RERANKER_MODELO troca o modelo.
+    Devolve None se estiver desativada, para o app seguir só com a busca híbrida.
+    """
+    if os.getenv("AGROFEL_RERANKER", "0") != "1":
+        return None
+    return ReordenadorCrossEncoder(os.getenv("AGROFEL_RERANKER_MODELO") or None)
@@ -0,0 +1,176 @@
+# agrofel/respostas_aquecidas.py
+"""
+Respostas de BuscaRecomendacao pré-calculadas para os pares cultura × alvo das tabelas de
+recomendação das bulas (ex.: "buva na soja"), gravadas pelo 6_Aquecer_Respostas.py num
+SQLite ao lado da base. Na época de dessecação e pós-emergência, a maior parte das
+perguntas cai num punhado destes pares; o motor consulta este armazém antes da busca
+nas bulas e do Gemini.
+
+Cada resposta guarda o sha256 das bulas de onde veio (as dos chunks usados e as que
+recomendam o par na tabela de doses) e a lista das bulas do par. Se uma delas mudar
+(novo sha256) ou outra bula passar a recomendar o par, só essa resposta deixa de ser servida.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+from agrofel.doses import culturas_mencionadas, nomes_da_cultura, nomes_do_alvo
+from agrofel.lexical import tokenizar
+from agrofel.produtos import normalizar_nome
+
+ARQUIVO_RESPOSTAS_AQUECIDAS = "respostas_aquecidas.sqlite"
+# Palavras que só pedem a recomendação do par. Qualquer outra (produto, dose, estádio,
+# modo de aplicação...) muda a pergunta, que segue para a busca nas bulas.
+_PALAVRAS_DO_PEDIDO = frozenset(
+    "herbicida herbicidas produto produtos recomendacao recomendacoes recomenda recomendam recomendado "
+    "recomendados recomendar indica indicam indicado indicados indicar indicacao sugere sugestao controle "
+    "controlar controla contra combater combate eliminar matar acabar aplicar passar fazer faco bom boa bons boas "
+    "melhor melhores opcao opcoes utilizar tenho preciso quero existe existem algum alguma tem pode "
+    "lavoura area planta plantas daninha daninhas infestacao problema".split()
+)
+
+
+def pergunta_do_par(par: dict) -> str:
+    """ Pergunta canónica com que a resposta do par é gerada: 'Buva em soja'. """
+    alvo = re.split(r",|\bou\b", par["alvo"])[0].strip() or par["alvo_normalizado"]
+    return f"{alvo} em {par['cultura']}"
+
+def so_cultura_e_alvo(pergunta: str, cultura: str, nomes_alvo: list) -> bool:
+    """ A pergunta não tem termos além da cultura, do alvo, de stopwords e das palavras do pedido. """
+    texto = f" {normalizar_nome(pergunta)} "
+    for nome in sorted(nomes_alvo + nomes_da_cultura(cultura), key=len, reverse=True):
+        while f" {nome} " in texto:
+            texto = texto.replace(f" {nome} ", " ")
+    return set(tokenizar(texto)) <= _PALAVRAS_DO_PEDIDO
+
+def _sha_dos_chunks(ids_chunks: list) -> set:
+    # Os ids dos chunks são "<sha256 do PDF>-<n>".
+    return {id_chunk.rsplit("-", 1)[0] for id_chunk in ids_chunks}
+
+
+class RespostasAquecidas:
+    """
+    Leitura e escrita do armazém. Uma ligação partilhada, protegida por lock, serve o job
+    (várias threads a gravar) e o motor (várias sessões a ler).
+    """
+
+    def __init__(self, db, caminho: str = None):
+        self.db = db
+        self.caminho = caminho or os.path.join(db.pasta, ARQUIVO_RESPOSTAS_AQUECIDAS)
+        self._lock = threading.Lock()
+        self._conexao = None
+        self._bulas = None
+        self._versao_bulas = None
+        self.acertos = 0
+        self.falhas = 0
+        self.invalidadas = 0
+
+    def _ligar(self, criar: bool = False):
+        # Chamado com o lock adquirido. Sem o arquivo (job ainda não correu), não há respostas.
+        if self._conexao is None:
+            if not criar and not os.path.exists(self.caminho):
+                return None
+            self._conexao = sqlite3.connect(self.caminho, check_same_thread=False)
+            self._conexao.row_factory = sqlite3.Row
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("""
+                CREATE TABLE IF NOT EXISTS respostas (
+                    chave TEXT PRIMARY KEY, cultura TEXT, alvo_normalizado TEXT, nomes_alvo TEXT,
+                    pergunta TEXT, resposta TEXT, bulas TEXT, arquivos_par TEXT, criada_em REAL
+                )""")
+            self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_cultura ON respostas (cultura)")
+        return self._conexao
+
+    def bulas(self) -> dict:
+        """ Nome -> sha256 das bulas da base atual, recalculado se a base for reconstruída. """
+        versao = self.db.versao()
+        if versao != self._versao_bulas:
+            self._bulas, self._versao_bulas = self.db.bulas(), versao
+        return self._bulas
+
+    def _valida(self, linha) -> bool:
+        bulas = self.bulas()
+        if not set(json.loads(linha["bulas"])) <= set(bulas.values()):
+            return False
+        return self.db.doses.arquivos_do_par(linha["cultura"], linha["alvo_normalizado"]) == json.loads(linha["arquivos_par"])
+
+    def _par_da_pergunta(self, conexao, pergunta: str):
+        """ A linha do único par cultura × alvo citado na pergunta, se ela não pede mais nada; senão None. """
+        culturas = culturas_mencionadas(pergunta)
+        if len(culturas) != 1:
+            return None
+        texto = f" {normalizar_nome(pergunta)} "
+        linhas = [
+            linha for linha in conexao.execute("SELECT * FROM respostas WHERE cultura = ?", (culturas[0],))
+            if any(f" {nome} " in texto for nome in json.loads(linha["nomes_alvo"]))
+        ]
+        if len(linhas) != 1 or not so_cultura_e_alvo(pergunta, culturas[0], json.loads(linhas[0]["nomes_alvo"])):
+            return None
+        return linhas[0]
+
+    def obter(self, pergunta: str):
+        """
+        Resposta guardada para a pergunta, se cita um só par, sem outros termos (produto, dose,
+        estádio...), e as bulas dele não mudaram.
+        """
+        if self.db.doses is None:
+            return None
+        with self._lock:
+            conexao = self._ligar()
+            linha = self._par_da_pergunta(conexao, pergunta) if conexao is not None else None
+            if linha is not None and not self._valida(linha):
+                self.invalidadas += 1
+                linha = None
+            if linha is None:
+                self.falhas += 1
+                return None
+            self.acertos += 1
+            return linha["resposta"]
+
+    def valida(self, par: dict) -> bool:
+        """ Já há uma resposta para o par e as bulas dele não mudaram (o job salta-o). """
+        with self._lock:
+            conexao = self._ligar(criar=True)
+            linha = conexao.execute("SELECT * FROM respostas WHERE chave = ?", (self.chave(par),)).fetchone()
+            return linha is not None and self._valida(linha)
+
+    @staticmethod
+    def chave(par: dict) -> str:
+        return f"{par['cultura']}|{par['alvo_normalizado']}"
+
+    def guardar(self, par: dict, pergunta: str, resposta: str, ids_chunks: list):
+        with self._lock:
+            bulas = self.bulas()
+            shas = _sha_dos_chunks(ids_chunks) | {bulas[a] for a in par["arquivos"] if a in bulas}
+            conexao = self._ligar(criar=True)
+            conexao.execute(
+                "INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.chave(par), par["cultura"], par["alvo_normalizado"], json.dumps(nomes_do_alvo(par["alvo"])),
+                 pergunta, resposta, json.dumps(sorted(shas)), json.dumps(par["arquivos"]), time.time()),
+            )
+            conexao.commit()
+
+    def cobertura(self, pares: list) -> dict:
+        """ Pares com resposta válida, sobre todos os pares da tabela de doses. """
+        validos = sum(self.valida(par) for par in pares)
+        return {"pares": len(pares), "com_resposta": validos,
+                "cobertura": round(validos / len(pares), 3) if pares else 0.0}
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "invalidadas": self.invalidadas,
+                "taxa_acerto": round(self.acertos / consultas, 3) if consultas else 0.0,
+            }
+
+    def fechar(self):
+        with self._lock:
+            if self._conexao is not None:
+                self._conexao.close()
+                self._conexao = None
@@ -0,0 +1,173 @@
+# agrofel/roteador.py
+"""
+Roteador local de intenções. Decide, sem chamar o LLM, entre ResponderConversa,
+BuscaRecomendacao, BuscaTecnica e BuscaDose nos casos fáceis (saudações, agradecimentos,
+perguntas com produto ou praga explícitos). Quando a confiança é baixa, o
+orquestrador continua a usar o roteador com bind_tools do Gemini.
+"""
+import re
+import threading
+from dataclasses import dataclass, field
+
+from agrofel.lexical import remover_acentos
+
+# Abaixo deste valor a decisão local é descartada e o LLM escolhe a ferramenta.
+LIMIAR_CONFIANCA = 0.8
+# Quantas mensagens recentes procurar pelo produto em discussão
+MENSAGENS_PARA_PRODUTO = 6
+
+_SAUDACOES = re.compile(r"^(ola|oi|opa|eai|e ai|bom dia|boa tarde|boa noite|tudo bem|tudo bom|saudacoes)\b")
+_AGRADECIMENTOS = re.compile(r"\b(obrigad[oa]|valeu|agradeco|muito obrigad[oa]|show|perfeito|otimo)\b")
+_DESPEDIDAS = re.compile(r"\b(tchau|ate logo|ate mais|ate breve|ate amanha|falou|adeus)\b")
+_IDENTIDADE = re.compile(r"\b(quem (e|es) (voce|tu)|o que (voce|tu) (faz|fazes)|voce e um robo)\b")
+
+# Culturas, pragas, daninhas e modos de controle
+_TEMAS_AGRONOMICOS = (
+    r"soja|milho|algodao|trigo|feijao|cafe|cana|arroz|pastagem|sorgo|citros|"
+    r"daninha|daninhas|mato|capim amargoso|capim|buva|guanxuma|corda de viola|leiteiro|caruru|trapoeraba|pe de galinha|"
+    r"praga|pragas|lagarta|percevejo|ferrugem|fungo|doenca|inseto|"
+    r"dessecacao|dessecar|pre emergencia|pos emergencia|herbicida|inseticida|fungicida"
+)
+_TEMAS = re.compile(rf"\b({_TEMAS_AGRONOMICOS})\b")
+# Termos que indicam um problema agronômico (um dos temas acima ou um pedido de produto)
+_TERMOS_AGRONOMICOS = re.compile(
+    rf"\b({_TEMAS_AGRONOMICOS}|o que (usar|passar|aplicar)|qual produto|que produto|indica|recomenda)\b"
+)
+# Perguntas técnicas sobre um produto (dose, modo de aplicação, segurança...)
+_TERMOS_TECNICOS = re.compile(
+    r"\b(dose|dosagem|quantos? (litros?|ml|kg|gramas?)|por hectare|(l|kg|g|ml) ha|calda|vazao|"
+    r"como aplicar|modo de (aplicacao|uso)|intervalo|carencia|reentrada|mistura|compativel|"
+    r"epi|toxicidade|classe|registro|composicao|principio ativo|ingrediente ativo|"
+    r"chuva|residual|quando aplicar|estadio|bula)\b"
+)
+# Subconjunto de _TERMOS_TECNICOS respondido pela tabela de doses (agrofel.doses)
+_TERMOS_DOSE = re.compile(r"\b(dose|doses|dosagem|quantos? (litros?|ml|kg|gramas?)|por hectare|(l|kg|g|ml) ha)\b")
+# Referências a um produto já citado ("esse produto", "dele")
+_ANAFORAS = re.compile(r"\b(esse|este|desse|deste|nesse|neste|o mesmo|dele|dela|do produto|o produto|ele|ela)\b")
+
+_RESPOSTAS = {
+    "saudacao": "Olá! Sou o assistente virtual da Agrofel. Em que posso ajudar com a sua lavoura?",
+    "agradecimento": "De nada! Se precisar de mais alguma coisa sobre a sua lavoura, é só perguntar.",
+    "despedida": "Até breve! Bons negócios e boa safra.",
+    "identidade": "Sou o assistente virtual da Agrofel. Posso recomendar produtos para pragas e plantas daninhas e tirar dúvidas técnicas sobre as bulas.",
+}
+
+
+@dataclass
+class DecisaoRota:
+    """ Ferramenta escolhida pelo roteador local, com os mesmos argumentos das ferramentas do LLM. """
+    ferramenta: str
+    argumentos: dict = field(default_factory=dict)
+    confianca: float = 0.0
+
+
+class EstatisticasRoteador:
+    """ Contadores por processo: decisões locais (chamadas ao LLM evitadas), decisões delegadas ao LLM e buscas especulativas. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.decisoes_locais = {}
+        self.chamadas_llm = 0
+        self.especulacoes_aproveitadas = 0
+        self.especulacoes_descartadas = 0
+
+    def registar(self, decisao_local: DecisaoRota = None):
+        with self._lock:
+            if decisao_local is None:
+                self.chamadas_llm += 1
+            else:
+                self.decisoes_locais[decisao_local.ferramenta] = self.decisoes_locais.get(decisao_local.ferramenta, 0) + 1
+
+    def registar_especulacao(self, aproveitada: bool):
+        """ Busca de BuscaRecomendacao feita em paralelo com o roteador LLM: usada ou descartada. """
+        with self._lock:
+            if aproveitada:
+                self.especulacoes_aproveitadas += 1
+            else:
+                self.especulacoes_descartadas += 1
+
+    def resumo(self) -> dict:
+        with self._lock:
+            evitadas = sum(self.decisoes_locais.values())
+            total = evitadas + self.chamadas_llm
+            return {
+                "chamadas_llm_evitadas": evitadas,
+                "chamadas_llm_roteador": self.chamadas_llm,
+                "taxa_local": round(evitadas / total, 3) if total else 0.0,
+                "por_ferramenta": dict(self.decisoes_locais),
+                "especulacoes_aproveitadas": self.especulacoes_aproveitadas,
+                "especulacoes_descartadas": self.especulacoes_descartadas,
+            }
+
+
+estatisticas = EstatisticasRoteador()
+
+
+def _normalizar(texto: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", remover_acentos(texto).lower()))
+
+def termos_agronomicos(texto: str) -> list:
+    """ Culturas, pragas e daninhas citadas no texto, sem acentos ('capim amargoso', 'soja'). """
+    return list(dict.fromkeys(m.group(0) for m in _TEMAS.finditer(_normalizar(texto))))
+
+def produto_do_historico(chat_history: list, indice_produtos, produto_fixado: str = None) -> tuple:
+    """
+    Procura, da mensagem mais recente para a mais antiga, o produto em discussão.
+    Devolve (chave_produto, ambiguo): ambiguo quando a mensagem cita mais de um produto.
+    Se as mensagens recentes não citam nenhum, usa `produto_fixado` (chave guardada pelo
+    HistoricoConversa a partir de mensagens já resumidas).
+    """
+    if indice_produtos is None:
+        return None, False
+    for mensagem in reversed(chat_history[-MENSAGENS_PARA_PRODUTO:]):
+        mencionados = indice_produtos.produtos_mencionados(mensagem["content"])
+        if mencionados:
+            return mencionados[0], len(mencionados) > 1
+    return produto_fixado, False
+
+def _tipo_conversa(texto: str):
+    curta = len(texto.split()) <= 6
+    if _IDENTIDADE.search(texto):
+        return "identidade"
+    if curta and _DESPEDIDAS.search(texto):
+        return "despedida"
+    if curta and _AGRADECIMENTOS.search(texto):
+        return "agradecimento"
+    if curta and _SAUDACOES.search(texto):
+        return "saudacao"
+    return None
+
+def classificar(query: str, chat_history: list, indice_produtos=None, produto_fixado: str = None) -> DecisaoRota:
+    """
+    Classifica a mensagem com regras. A confiança reflete quão inequívoco é o caso:
+    saudações curtas e perguntas com produto explícito e termo técnico ficam acima do
+    LIMIAR_CONFIANCA; mensagens ambíguas ficam abaixo e seguem para o LLM.
+    """
+    texto = _normalizar(query)
+    agronomico = bool(_TERMOS_AGRONOMICOS.search(texto))
+    tecnico = bool(_TERMOS_TECNICOS.search(texto))
+    ferramenta_tecnica = "BuscaDose" if _TERMOS_DOSE.search(texto) else "BuscaTecnica"
+
+    tipo_conversa = _tipo_conversa(texto)
+    if tipo_conversa and not agronomico and not tecnico:
+        return DecisaoRota("ResponderConversa", {"resposta_cordial": _RESPOSTAS[tipo_conversa]}, 0.95)
+
+    citados = indice_produtos.produtos_mencionados(query) if indice_produtos is not None else []
+    if len(citados) == 1:
+        nome = indice_produtos.produtos[citados[0]]["nome"]
+        confianca = 0.9 if tecnico else 0.6
+        return DecisaoRota(ferramenta_tecnica, {"nome_produto": nome, "pergunta_tecnica": query}, confianca)
+    if len(citados) > 1:
+        # Comparações entre produtos ficam para o LLM.
+        return DecisaoRota("BuscaRecomendacao", {"problema_agricola": query}, 0.3)
+
+    if tecnico and (_ANAFORAS.search(texto) or not agronomico):
+        chave, ambiguo = produto_do_historico(chat_history, indice_produtos, produto_fixado)
+        if chave is not None:
+            nome = indice_produtos.produtos[chave]["nome"]
+            return DecisaoRota(ferramenta_tecnica, {"nome_produto": nome, "pergunta_tecnica": query}, 0.5 if ambiguo else 0.85)
+
+    if agronomico:
+        return DecisaoRota("BuscaRecomendacao", {"problema_agricola": query}, 0.85 if not tecnico else 0.6)
+
+    return DecisaoRota("BuscaRecomendacao", {"problema_agricola": query}, 0.0)
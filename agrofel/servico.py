@@ -0,0 +1,337 @@
+# agrofel/servico.py
+"""
+Serviço HTTP do assistente (tornado), independente das reexecuções do Streamlit:
+
+    python -m agrofel.servico --porta 8765 --workers 2
+
+Cada worker é um processo com o seu Motor (base aberta por mmap, só de leitura, por isso
+as páginas do índice são partilhadas entre workers pelo sistema operativo). Os pedidos
+são atendidos de forma assíncrona; o motor, que bloqueia (FAISS, Gemini), corre num
+conjunto limitado de threads. Acima de MAX_PEDIDOS_SIMULTANEOS em execução e MAX_FILA à
+espera, o pedido é recusado logo com 503 e Retry-After, em vez de acumular latência.
+
+Endpoints:
+- POST /conversa  {"pergunta", "historico": [{"role", "content"}], "sessao"} -> NDJSON em
+  streaming: {"tipo": "progresso", "etapa"}, {"tipo": "texto", "texto"}, {"tipo": "erro", "erro"}
+  e, no fim, {"tipo": "fim"};
+- GET /saude      estado do worker (pedidos em execução, à espera, recusados);
+- GET /diagnostico e DELETE /diagnostico  agregado do rastreio deste worker
+  (cabeçalho X-Agrofel-Admin com AGROFEL_ADMIN_SENHA).
+"""
+import os
+import hmac
+import json
+import time
+import asyncio
+import argparse
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+
+import tornado.web
+import tornado.netutil
+import tornado.process
+import tornado.httpserver
+import tornado.iostream
+
+from agrofel import rastreio
+from agrofel.motor import Motor, CAMINHO_INDEX_FAISS
+
+PORTA = int(os.getenv("AGROFEL_SERVICO_PORTA", 8765))
+# Pedidos a correr no motor ao mesmo tempo, por worker (threads do motor)
+MAX_PEDIDOS_SIMULTANEOS = int(os.getenv("AGROFEL_SERVICO_SIMULTANEOS", 4))
+# Pedidos à espera de vez, por worker; acima disto a resposta é 503
+MAX_FILA = int(os.getenv("AGROFEL_SERVICO_FILA", 8))
+# Segundos que um pedido pode esperar na fila antes de ser recusado
+ESPERA_MAX_FILA = float(os.getenv("AGROFEL_SERVICO_ESPERA_FILA", 10))
+# Eventos por enviar a um cliente; com a fila cheia, o motor espera (o LLM não corre à frente de um cliente lento)
+EVENTOS_EM_TRANSITO = 32
+# Históricos de conversa guardados por worker (os mais antigos saem primeiro)
+MAX_SESSOES = 1000
+
+
+class PedidoRecusado(Exception):
+    """ Worker sem capacidade para mais pedidos; o cliente deve tentar de novo depois de `espera` segundos. """
+
+    def __init__(self, motivo: str, espera: int):
+        super().__init__(motivo)
+        self.espera = espera
+
+
+class ClienteDesligado(Exception):
+    pass
+
+
+class ControloAdmissao:
+    """ Até `simultaneos` pedidos em execução e `fila` à espera de vez; os restantes são recusados. """
+
+    def __init__(self, simultaneos: int = MAX_PEDIDOS_SIMULTANEOS, fila: int = MAX_FILA,
+                 espera_max: float = ESPERA_MAX_FILA):
+        self.simultaneos = simultaneos
+        self.fila = fila
+        self.espera_max = espera_max
+        self._semaforo = asyncio.Semaphore(simultaneos)
+        self.em_execucao = 0
+        self.em_espera = 0
+        self.atendidos = 0
+        self.recusados = 0
+
+    @asynccontextmanager
+    async def admitir(self):
+        if self.em_execucao + self.em_espera >= self.simultaneos + self.fila:
+            self.recusados += 1
+            raise PedidoRecusado("Serviço ocupado: fila cheia.", espera=max(1, round(self.espera_max / 2)))
+        self.em_espera += 1
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), self.espera_max)
+        except asyncio.TimeoutError:
+            self.recusados += 1
+            raise PedidoRecusado("Serviço ocupado: tempo de espera na fila esgotado.", espera=round(self.espera_max))
+        finally:
+            self.em_espera -= 1
+        self.em_execucao += 1
+        try:
+            yield
+        finally:
+            self.em_execucao -= 1
+            self.atendidos += 1
+            self._semaforo.release()
+
+    def estado(self) -> dict:
+        return {
+            "em_execucao": self.em_execucao,
+            "em_espera": self.em_espera,
+            "atendidos": self.atendidos,
+            "recusados": self.recusados,
+            "max_simultaneos": self.simultaneos,
+            "max_fila": self.fila,
+        }
+
+
+class Sessoes:
+    """
+    HistoricoConversa por sessão, para não refazer o resumo das mensagens antigas a cada turno.
+    Com vários workers, uma sessão pode calhar noutro worker: o cliente envia sempre o
+    histórico completo e o resumo é refeito lá, com o mesmo resultado.
+
+    Um HistoricoConversa não é thread-safe, por isso cada pedido leva o da sua sessão para
+    si enquanto corre. Um segundo pedido da mesma sessão ao mesmo tempo (p. ex. depois de um
+    rerun do Streamlit a meio do streaming) recebe um histórico novo, refeito a partir das
+    mensagens que o cliente envia; o último a terminar fica guardado.
+    """
+
+    def __init__(self, motor: Motor, maximo: int = MAX_SESSOES):
+        self.motor = motor
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._historicos = OrderedDict()
+
+    @contextmanager
+    def historico(self, sessao: str):
+        """ Histórico da sessão, só deste pedido até sair do bloco; depois volta a ficar guardado. """
+        if not sessao:
+            yield self.motor.novo_historico()
+            return
+        with self._lock:
+            historico = self._historicos.pop(sessao, None) or self.motor.novo_historico()
+        try:
+            yield historico
+        finally:
+            with self._lock:
+                self._historicos.pop(sessao, None)
+                self._historicos[sessao] = historico
+                while len(self._historicos) > self.maximo:
+                    self._historicos.popitem(last=False)
+
+
+def _mensagens_validas(historico) -> bool:
+    return isinstance(historico, list) and all(
+        isinstance(m, dict) and isinstance(m.get("role"), str) and isinstance(m.get("content"), str)
+        for m in historico
+    )
+
+
+class ConversaHandler(tornado.web.RequestHandler):
+
+    def initialize(self, motor: Motor, admissao: ControloAdmissao, executor, sessoes: Sessoes):
+        self.motor = motor
+        self.admissao = admissao
+        self.executor = executor
+        self.sessoes = sessoes
+        self.desligado = threading.Event()
+
+    def on_connection_close(self):
+        self.desligado.set()
+
+    async def post(self):
+        try:
+            corpo = json.loads(self.request.body)
+            pergunta = corpo["pergunta"].strip()
+            mensagens = corpo.get("historico", [])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.set_status(400)
+            return self.finish({"erro": "JSON com 'pergunta' (texto) e 'historico' (lista) esperado."})
+        if not pergunta or not _mensagens_validas(mensagens):
+            self.set_status(400)
+            return self.finish({"erro": "Pergunta vazia ou histórico inválido."})
+
+        try:
+            async with self.admissao.admitir():
+                await self._transmitir(pergunta, mensagens, corpo.get("sessao"))
+        except PedidoRecusado as e:
+            self.set_status(503)
+            self.set_header("Retry-After", str(e.espera))
+            self.finish({"erro": str(e), "tentar_em_s": e.espera})
+
+    async def _transmitir(self, pergunta: str, mensagens: list, sessao: str):
+        """ O motor corre numa thread e passa os eventos por uma fila limitada; aqui seguem para o cliente. """
+        loop = asyncio.get_running_loop()
+        eventos = asyncio.Queue(maxsize=EVENTOS_EM_TRANSITO)
+
+        def enviar(evento):
+            # Com o cliente desligado, interrompe o motor; só o marcador de fim (None) passa.
+            if self.desligado.is_set() and evento is not None:
+                raise ClienteDesligado()
+            # Bloqueia a thread do motor enquanto a fila está cheia (contrapressão).
+            futuro = asyncio.run_coroutine_threadsafe(eventos.put(evento), loop)
+            while True:
+                try:
+                    return futuro.result(timeout=0.5)
+                except concurrent.futures.TimeoutError:
+                    if self.desligado.is_set():
+                        futuro.cancel()
+                        raise ClienteDesligado()
+
+        def executar():
+            try:
+                with rastreio.turno("chat", sessao=bool(sessao)), self.sessoes.historico(sessao) as historico:
+                    inicio = time.perf_counter()
+                    resposta = self.motor.responder(
+                        pergunta, mensagens, historico,
+                        progresso=lambda etapa: enviar({"tipo": "progresso", "etapa": etapa}),
+                    )
+                    pedacos = rastreio.medir_latencia(resposta, inicio)
+                    try:
+                        for pedaco in pedacos:
+                            enviar({"tipo": "texto", "texto": pedaco})
+                    finally:
+                        # Se o cliente saiu a meio, fecha já o streaming do LLM.
+                        pedacos.close()
+                        if not isinstance(resposta, str):
+                            resposta.close()
+                enviar({"tipo": "fim"})
+            except ClienteDesligado:
+                print("[serviço] cliente desligou-se a meio da resposta.")
+            except Exception as e:
+                print(f"ERRO no pedido: {type(e).__name__}: {e}")
+                try:
+                    enviar({"tipo": "erro", "erro": "Ocorreu um erro ao gerar a resposta."})
+                except ClienteDesligado:
+                    pass
+            finally:
+                try:
+                    enviar(None)
+                except ClienteDesligado:
+                    pass
+
+        self.set_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.set_header("Cache-Control", "no-cache")
+        tarefa = loop.run_in_executor(self.executor, executar)
+        while True:
+            evento = await eventos.get()
+            if evento is None:
+                break
+            self.write(json.dumps(evento, ensure_ascii=False) + "\n")
+            try:
+                await self.flush()
+            except tornado.iostream.StreamClosedError:
+                self.desligado.set()
+                break
+        # A vaga de admissão só é libertada quando a thread do motor termina.
+        await tarefa
+        if not self.desligado.is_set():
+            self.finish()
+
+
+class SaudeHandler(tornado.web.RequestHandler):
+
+    def initialize(self, motor: Motor, admissao: ControloAdmissao):
+        self.motor = motor
+        self.admissao = admissao
+
+    def get(self):
+        self.write({"estado": "ok", "pid": os.getpid(), "versao_armazem": self.motor.db.versao(),
+                    **self.admissao.estado()})
+
+
+class DiagnosticoHandler(tornado.web.RequestHandler):
+    """ Agregado do rastreio e painéis deste worker, para a página de diagnóstico. """
+
+    def initialize(self, admissao: ControloAdmissao):
+        self.admissao = admissao
+
+    def prepare(self):
+        senha = os.getenv("AGROFEL_ADMIN_SENHA")
+        tentativa = self.request.headers.get("X-Agrofel-Admin", "")
+        if not senha or not hmac.compare_digest(tentativa.encode(), senha.encode()):
+            raise tornado.web.HTTPError(403)
+
+    def get(self):
+        self.write({
+            "pid": os.getpid(),
+            "etapas": rastreio.agregado.resumo(),
+            "paineis": {"admissao": self.admissao.estado(),
+                        **{nome: funcao() for nome, funcao in rastreio.paineis.items()}},
+            "arquivo_rastreio": rastreio.ARQUIVO_RASTREIO,
+        })
+
+    def delete(self):
+        rastreio.agregado.limpar()
+        self.set_status(204)
+
+
+def criar_aplicacao(motor: Motor, simultaneos: int = MAX_PEDIDOS_SIMULTANEOS, fila: int = MAX_FILA):
+    admissao = ControloAdmissao(simultaneos, fila)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=simultaneos, thread_name_prefix="motor")
+    sessoes = Sessoes(motor)
+    return tornado.web.Application([
+        (r"/conversa", ConversaHandler, dict(motor=motor, admissao=admissao, executor=executor, sessoes=sessoes)),
+        (r"/saude", SaudeHandler, dict(motor=motor, admissao=admissao)),
+        (r"/diagnostico", DiagnosticoHandler, dict(admissao=admissao)),
+    ])
+
+async def servir(sockets, motor: Motor, simultaneos: int, fila: int):
+    servidor = tornado.httpserver.HTTPServer(criar_aplicacao(motor, simultaneos, fila))
+    servidor.add_sockets(sockets)
+    print(f"[serviço] worker {os.getpid()} pronto ({simultaneos} simultâneos, fila de {fila}).")
+    await asyncio.Event().wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serviço HTTP do assistente Agrofel.")
+    parser.add_argument("--porta", type=int, default=PORTA)
+    parser.add_argument("--endereco", default="127.0.0.1")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processos a atender pedidos (0 = um por CPU). Mais de um só em Linux/macOS.")
+    parser.add_argument("--indice", default=CAMINHO_INDEX_FAISS)
+    parser.add_argument("--simultaneos", type=int, default=MAX_PEDIDOS_SIMULTANEOS)
+    parser.add_argument("--fila", type=int, default=MAX_FILA)
+    args = parser.parse_args()
+
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+    load_dotenv()
+    if os.getenv("GOOGLE_API_KEY"):
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+
+    # Os sockets são abertos antes do fork, para todos os workers aceitarem na mesma porta.
+    sockets = tornado.netutil.bind_sockets(args.porta, args.endereco)
+    if args.workers != 1:
+        tornado.process.fork_processes(args.workers)
+    # Depois do fork: cada worker abre a sua base (mmap) e o seu LLM.
+    motor = Motor.carregar(args.indice)
+    asyncio.run(servir(sockets, motor, args.simultaneos, args.fila))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# pages/Diagnostico.py
+import os
+import hmac
+
+import pandas as pd
+import streamlit as st
+
+from agrofel import rastreio
+from agrofel.cliente import ClienteServico
+
+st.set_page_config(page_title="Diagnóstico - Agrofel", page_icon="🌿", layout="wide")
+
+# Com o serviço (AGROFEL_SERVICO_URL), os números vêm do worker que atender o pedido.
+SERVICO_URL = os.getenv("AGROFEL_SERVICO_URL")
+
+def senha_administrador():
+    """ AGROFEL_ADMIN_SENHA no .env ou nos segredos do Streamlit; sem ela, a página fica fechada. """
+    senha = os.getenv("AGROFEL_ADMIN_SENHA")
+    if not senha:
+        try:
+            senha = st.secrets["AGROFEL_ADMIN_SENHA"]
+        except (FileNotFoundError, KeyError):
+            senha = None
+    return senha
+
+def autenticar() -> bool:
+    if st.session_state.get("administrador"):
+        return True
+    senha = senha_administrador()
+    if not senha:
+        st.info("Página de diagnóstico desativada: defina AGROFEL_ADMIN_SENHA para a ativar.")
+        return False
+    tentativa = st.text_input("Senha de administrador", type="password")
+    if tentativa and hmac.compare_digest(tentativa.encode(), senha.encode()):
+        st.session_state.administrador = True
+        st.rerun()
+    elif tentativa:
+        st.error("Senha incorreta.")
+    return False
+
+def ler_diagnostico() -> dict:
+    """ Agregado do rastreio e painéis: do serviço, se configurado, ou deste processo. """
+    if SERVICO_URL:
+        return ClienteServico(SERVICO_URL, senha_administrador()).diagnostico()
+    return {
+        "pid": os.getpid(),
+        "etapas": rastreio.agregado.resumo(),
+        "paineis": {nome: funcao() for nome, funcao in rastreio.paineis.items()},
+        "arquivo_rastreio": rastreio.ARQUIVO_RASTREIO,
+    }
+
+def limpar_diagnostico():
+    if SERVICO_URL:
+        ClienteServico(SERVICO_URL, senha_administrador()).limpar_diagnostico()
+    else:
+        rastreio.agregado.limpar()
+
+
+st.title("Diagnóstico")
+if autenticar():
+    try:
+        diagnostico = ler_diagnostico()
+    except Exception as e:
+        st.error(f"Não foi possível ler o diagnóstico do serviço ({SERVICO_URL}): {e}")
+        st.stop()
+    resumo = diagnostico["etapas"]
+    origem = f"worker {diagnostico['pid']} do serviço" if SERVICO_URL else "neste processo"
+    st.subheader(f"Etapas (últimas {rastreio.JANELA_AGREGADO} execuções de cada uma, {origem})")
+    if resumo:
+        colunas = ["execucoes", "erros", "p50_ms", "p95_ms"]
+        # Contagens de atributos (ex.: ferramenta escolhida) em texto, numa única célula.
+        linhas = {
+            etapa: {chave: ", ".join(f"{a}: {n}" for a, n in valor.items()) if isinstance(valor, dict) else valor
+                    for chave, valor in dados.items()}
+            for etapa, dados in resumo.items()
+        }
+        tabela = pd.DataFrame.from_dict(linhas, orient="index")
+        st.dataframe(tabela[colunas + [c for c in tabela.columns if c not in colunas]], use_container_width=True)
+    else:
+        st.caption("Ainda sem pedidos.")
+
+    for nome, dados in diagnostico["paineis"].items():
+        with st.expander(nome):
+            st.json(dados)
+
+    st.caption(f"Registo detalhado (uma linha JSON por etapa): {diagnostico['arquivo_rastreio'] or 'desativado'}")
+    if st.button("Limpar agregado"):
+        limpar_diagnostico()
+        st.rerun()
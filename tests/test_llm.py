@@ -0,0 +1,136 @@
+# tests/test_llm.py
+"""
+agrofel.llm contra o servidor falso do agrofel.llm_falso, numa porta local: pedidos
+idênticos juntam-se num só e o modelo principal passa ao rápido quando falha ou demora.
+"""
+import time
+import asyncio
+import threading
+
+import pytest
+import requests
+import tornado.netutil
+import tornado.httpserver
+
+from agrofel import llm
+from agrofel.llm_falso import ConfigFalso, criar_aplicacao
+
+PRINCIPAL = "modelo-principal"
+RAPIDO = "modelo-rapido"
+PROMPT = "Instruções\n---\nGLYPHOTAL é um herbicida sistémico para buva na soja.\n---\nPERGUNTA: buva na soja"
+
+
+def servir(config: ConfigFalso) -> tuple:
+    """ Serve o servidor falso numa thread. Devolve (url, função que o para). """
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    porta = sockets[0].getsockname()[1]
+    pronto = threading.Event()
+    estado = {}
+
+    async def correr():
+        servidor = tornado.httpserver.HTTPServer(criar_aplicacao(config))
+        servidor.add_sockets(sockets)
+        estado["loop"], estado["parar"] = asyncio.get_running_loop(), asyncio.Event()
+        pronto.set()
+        await estado["parar"].wait()
+        servidor.stop()
+
+    thread = threading.Thread(target=asyncio.run, args=(correr(),), daemon=True)
+    thread.start()
+    pronto.wait(5)
+
+    def parar():
+        estado["loop"].call_soon_threadsafe(estado["parar"].set)
+        thread.join(5)
+
+    return f"http://127.0.0.1:{porta}", parar
+
+
+@pytest.fixture
+def falso(monkeypatch):
+    """ Chamar com a ConfigFalso; devolve (ClienteLLM ligado ao servidor, função que lê o /estado). """
+    paragens = []
+
+    def iniciar(config: ConfigFalso, reserva_rapido: float = 0.5):
+        url, parar = servir(config)
+        paragens.append(parar)
+        monkeypatch.setattr(llm, "URL_LLM", url)
+        cliente = llm.ClienteLLM(llm.carregar_modelo.__wrapped__(PRINCIPAL), llm.carregar_modelo.__wrapped__(RAPIDO),
+                                 reserva_rapido=reserva_rapido)
+        return cliente, lambda: requests.get(f"{url}/estado", timeout=5).json()
+
+    yield iniciar
+    for parar in paragens:
+        parar()
+
+
+def em_paralelo(funcao, quantos: int, intervalo: float = 0.0) -> list:
+    resultados = [None] * quantos
+
+    def correr(i):
+        resultados[i] = funcao()
+
+    threads = [threading.Thread(target=correr, args=(i,)) for i in range(quantos)]
+    for thread in threads:
+        thread.start()
+        time.sleep(intervalo)
+    for thread in threads:
+        thread.join(30)
+    return resultados
+
+
+def test_invocacoes_identicas_juntam_se(falso):
+    cliente, estado = falso(ConfigFalso(atrasos={PRINCIPAL: 1.0}))
+    respostas = em_paralelo(lambda: cliente.invocar(PROMPT).content, 5)
+    assert len(set(respostas)) == 1 and respostas[0].startswith(f"[{PRINCIPAL}]")
+    assert estado()["pedidos"] == {PRINCIPAL: 1}
+    assert cliente.estatisticas()["juntadas"] == 4
+
+
+def test_transmissoes_identicas_juntam_se(falso):
+    cliente, estado = falso(ConfigFalso(atrasos={PRINCIPAL: 0.5}))
+    respostas = em_paralelo(lambda: "".join(cliente.transmitir(PROMPT)), 4)
+    assert len(set(respostas)) == 1 and "GLYPHOTAL" in respostas[0]
+    assert estado()["pedidos"] == {PRINCIPAL: 1}
+
+
+def test_falha_do_principal_passa_ao_rapido(falso):
+    cliente, estado = falso(ConfigFalso(falhas={PRINCIPAL}))
+    with llm.orcamento_turno(5):
+        resposta = cliente.invocar(PROMPT)
+    assert resposta.content.startswith(f"[{RAPIDO}]")
+    # O langchain_google_genai repete uma vez um 503 antes de desistir do principal.
+    pedidos = estado()["pedidos"]
+    assert pedidos[PRINCIPAL] >= 1 and pedidos[RAPIDO] == 1
+    assert cliente.estatisticas()["alternativas"] == {"erro": 1}
+
+
+def test_principal_lento_passa_ao_rapido(falso):
+    cliente, estado = falso(ConfigFalso(atrasos={PRINCIPAL: 5.0}))
+    inicio = time.monotonic()
+    with llm.orcamento_turno(1.5):
+        leitura = cliente.transmitir(PROMPT)
+        texto = "".join(leitura)
+    assert texto.startswith(f"[{RAPIDO}]") and leitura.alternativa == "prazo"
+    assert time.monotonic() - inicio < 3
+
+
+def test_juntada_respeita_o_orcamento_do_seu_turno(falso):
+    # O primeiro pedido não tem orçamento e espera pelo principal; o segundo, idêntico,
+    # junta-se a ele mas não pode esperar mais do que o seu turno e passa ao rápido.
+    cliente, estado = falso(ConfigFalso(atrasos={PRINCIPAL: 4.0}))
+
+    def com_orcamento():
+        with llm.orcamento_turno(1.5):
+            return cliente.invocar(PROMPT).content, time.monotonic()
+
+    resultados = {}
+    lider = threading.Thread(target=lambda: resultados.update(lider=cliente.invocar(PROMPT).content))
+    lider.start()
+    time.sleep(0.3)
+    inicio = time.monotonic()
+    segundo, fim_segundo = com_orcamento()
+    lider.join(10)
+    assert segundo.startswith(f"[{RAPIDO}]") and fim_segundo - inicio < 2.5
+    assert resultados["lider"].startswith(f"[{PRINCIPAL}]")
+    assert estado()["pedidos"] == {PRINCIPAL: 1, RAPIDO: 1}